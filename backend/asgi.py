@@ -0,0 +1,19 @@
+'''
+ASGI entry point of the trivia API, e.g. `uvicorn asgi:app --workers 4`.
+ASGI_THREADS sets how many requests run at the same time in each process (64 by default),
+DB_POOL_SIZE and DB_MAX_OVERFLOW should leave a connection for each of them
+'''
+import os
+
+from flaskr import create_app
+from flaskr.asgi import AsgiApp
+from flaskr.prefork import load_caches, warm_up_in_background
+from models import get_setting
+
+flask_app = create_app()
+# every process loads its read caches before serving, or in the background with LAZY_INIT
+if get_setting(flask_app.config, 'LAZY_INIT', False, bool):
+    warm_up_in_background(flask_app)
+else:
+    load_caches(flask_app)
+app = AsgiApp(flask_app, threads=int(os.environ.get('ASGI_THREADS', 64)))
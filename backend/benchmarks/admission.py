@@ -0,0 +1,60 @@
+'''
+Measures the overhead of admission control per request: the token bucket check alone for
+the memory and SQLite bucket backends, and a full request to a limited route with and without
+the limits, through the test client.
+
+    python -m benchmarks.admission --database-url sqlite:////tmp/trivia_bench.db --checks 100000
+
+Prints microseconds per check and per request as JSON
+'''
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from flaskr import create_app
+from flaskr.admission import MemoryBuckets, SQLiteBuckets
+
+
+def microseconds_per_call(count, function):
+    started_at = time.perf_counter()
+    for number in range(count):
+        function(number)
+    return round((time.perf_counter() - started_at) * 1e6 / count, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--checks', type=int, default=100000)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {}
+    memory_buckets = MemoryBuckets()
+    results['memory_check_us'] = microseconds_per_call(
+        args.checks, lambda number: memory_buckets.take('search:{}'.format(number % args.clients), 1e9, 1e9))
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_buckets = SQLiteBuckets(os.path.join(directory, 'rate_limits.db'))
+        results['sqlite_check_us'] = microseconds_per_call(
+            args.checks // 10, lambda number: sqlite_buckets.take('search:{}'.format(number % args.clients), 1e9, 1e9))
+
+    # limits high enough to admit every request, so only their cost is measured. The search term
+    # matches no question to keep the search itself cheap, and the best of five rounds is kept
+    search = {'searchTerm': 'qqqqqqqq'}
+    for name, config in (('unlimited', {'RATE_LIMITING': False}),
+                         ('limited', {'RATE_LIMITS': {'search': (1e9, 1e9)}})):
+        app = create_app(dict(config, DATABASE_URL=args.database_url, RESPONSE_CACHE_SIZE=0))
+        client = app.test_client()
+        client.post('/questions/search', json=search)
+        results[name + '_request_us'] = min(
+            microseconds_per_call(args.requests, lambda number: client.post('/questions/search', json=search))
+            for _ in range(5))
+    results['request_overhead_us'] = round(results['limited_request_us'] - results['unlimited_request_us'], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
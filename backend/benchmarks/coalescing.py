@@ -0,0 +1,89 @@
+'''
+Measures the thundering herd of a quiz start: concurrent clients request GET /categories and
+GET /categories/<id>/questions?page=1 at the same moment, first on an empty response cache, then once
+the cached responses expired. Counts the database queries the herd runs, with the concurrent identical
+requests coalesced and expired responses served stale while they are refreshed, and without both.
+The database has to be a SQL database, whose queries are counted on the engine.
+
+    python -m benchmarks.coalescing --database-url sqlite:////tmp/trivia_bench.db --clients 200
+
+Prints the query count and the p50 and p99 latency in milliseconds of every herd as JSON
+'''
+import argparse
+import json
+import statistics
+import threading
+import time
+
+from sqlalchemy import event
+
+from flaskr import create_app
+from flaskr.prefork import load_caches
+from models import db
+
+# the cached responses expire this many seconds after they were built
+TTL = 0.5
+
+
+def herd(app, clients, paths):
+    barrier = threading.Barrier(clients)
+    latencies = []
+
+    def get(path):
+        client = app.test_client()
+        barrier.wait()
+        started_at = time.perf_counter()
+        client.get(path)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+
+    threads = [threading.Thread(target=get, args=(paths[number % len(paths)],)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--category', type=int, default=1)
+    args = parser.parse_args()
+    paths = ['/categories', '/categories/{}/questions?page=1'.format(args.category)]
+
+    queries = [0]
+
+    def count_query(*_):
+        queries[0] += 1
+
+    results = {}
+    for name, config in (('coalesced', {}),
+                         ('uncoalesced', {'RESPONSE_CACHE_COALESCING': False, 'RESPONSE_CACHE_STALE_TTL': 0})):
+        app = create_app(dict(config, DATABASE_URL=args.database_url, RATE_LIMITING=False, RESPONSE_CACHE_TTL=TTL))
+        with app.app_context():
+            engine = db.get_engine(app)
+        if not event.contains(engine, 'before_cursor_execute', count_query):
+            event.listen(engine, 'before_cursor_execute', count_query)
+        # only the queries of the cached views are counted
+        load_caches(app)
+        app.extensions['response_cache'].reset()
+
+        results[name] = {}
+        for phase in ('empty_cache', 'expired'):
+            if phase == 'expired':
+                time.sleep(TTL * 1.2)
+            queries[0] = 0
+            results[name][phase] = herd(app, args.clients, paths)
+            # background refreshes of stale responses are counted too
+            time.sleep(0.1)
+            results[name][phase]['queries'] = queries[0]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''
+Measures the transfer size and the peak memory of large listing responses: pages of
+`--per-page` questions of GET /questions and GET /questions/export, built whole or streamed,
+sent as they are or compressed with each encoding. The peak memory is the one of the app
+while the body is produced, the body chunks being dropped as a server would send them.
+
+    python -m benchmarks.compression --database-url sqlite:////tmp/trivia_bench.db --per-page 1000
+
+Prints the bytes sent, the peak memory in KiB and the milliseconds of every case as JSON
+'''
+import argparse
+import json
+import time
+import tracemalloc
+
+from werkzeug.test import EnvironBuilder
+
+from flaskr import create_app
+
+
+def measure(app, path, encoding):
+    environ = EnvironBuilder(path=path, headers={'Accept-Encoding': encoding}).get_environ()
+    sent = 0
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    body = app.wsgi_app(environ, lambda status, headers, exc_info=None: None)
+    try:
+        for chunk in body:
+            sent += len(chunk)
+    finally:
+        getattr(body, 'close', lambda: None)()
+    seconds = time.perf_counter() - started_at
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'bytes': sent, 'peak_kib': round(peak / 1024), 'ms': round(seconds * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--per-page', type=int, default=1000)
+    args = parser.parse_args()
+
+    results = {}
+    for streaming in (False, True):
+        app = create_app({'DATABASE_URL': args.database_url, 'RESPONSE_CACHE_SIZE': 0, 'JSON_STREAMING': streaming})
+        # loads the caches of the app, so that only the response is measured
+        app.test_client().get('/questions')
+        for encoding in ('identity', 'gzip', 'br'):
+            path = '/questions?per_page={}'.format(args.per_page)
+            results['questions {} {}'.format('streamed' if streaming else 'whole', encoding)] = measure(app, path, encoding)
+    for encoding in ('identity', 'gzip', 'br'):
+        results['export ' + encoding] = measure(app, '/questions/export', encoding)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''
+Measures quiz result ingestion: the throughput of POST /quizzes/results with concurrent clients,
+the cost of recording a result in the write buffer and the leaderboards alone, the rate at which the buffered results are then written to the database, and the latency of
+GET /leaderboard. The database needs the quiz_results and leaderboard tables of `alembic upgrade head`.
+
+    python -m benchmarks.leaderboard --database-url sqlite:////tmp/trivia_bench.db --results 20000
+
+Prints results per second and microseconds per request as JSON
+'''
+import argparse
+import json
+import random
+import threading
+import time
+
+from flaskr import create_app
+from flaskr.category_stats import category_stats
+
+
+def post_results(app, count, players, category_ids):
+    client = app.test_client()
+    for _ in range(count):
+        questions = random.randint(1, 20)
+        client.post('/quizzes/results', json={
+            'player': 'player{}'.format(random.randrange(players)),
+            'quiz_category': {'id': random.choice(category_ids)},
+            'score': random.randint(0, questions),
+            'questions': questions
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--results', type=int, default=20000)
+    parser.add_argument('--players', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    # flushes only run when the benchmark asks for them, so that ingestion and writes are measured apart
+    app = create_app({'DATABASE_URL': args.database_url, 'RATE_LIMITING': False,
+                      'LEADERBOARD_FLUSH_SIZE': args.results + 1, 'LEADERBOARD_FLUSH_SECONDS': 3600})
+    with app.app_context():
+        category_ids = [0] + [category_id for (category_id, _), count in category_stats.load().items() if category_id and count]
+    leaderboard = app.extensions['leaderboard']
+    random.seed(0)
+
+    threads = [threading.Thread(target=post_results, args=(app, args.results // args.concurrency, args.players, category_ids))
+               for _ in range(args.concurrency)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ingest_seconds = time.perf_counter() - started_at
+    buffered = len(leaderboard.pending)
+
+    started_at = time.perf_counter()
+    for number in range(args.results):
+        leaderboard.record('player{}'.format(number % args.players), None, number % 10, 10)
+    record_seconds = time.perf_counter() - started_at
+    buffered += args.results
+
+    started_at = time.perf_counter()
+    leaderboard.flush()
+    flush_seconds = time.perf_counter() - started_at
+
+    client = app.test_client()
+    client.get('/leaderboard')
+    started_at = time.perf_counter()
+    for _ in range(1000):
+        client.get('/leaderboard?category={}'.format(random.choice(category_ids)))
+    leaderboard_seconds = time.perf_counter() - started_at
+
+    print(json.dumps({
+        'results': buffered,
+        'ingest_results_per_second': round(args.results / ingest_seconds),
+        'record_us': round(record_seconds * 1e6 / args.results, 2),
+        'flush_results_per_second': round(buffered / flush_seconds),
+        'leaderboard_us': round(leaderboard_seconds * 1000, 1)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+'''
+Load tests the API endpoints and reports latency percentiles, throughput and peak memory as JSON.
+
+    python -m benchmarks.run --database-url sqlite:////tmp/trivia_bench.db --seed-questions 100000 \
+        --output results.json --compare baseline.json
+
+The app is served over HTTP by a threaded server in this process and driven by concurrent clients,
+or with --base-url an already running server is load tested, e.g. gunicorn with several workers.
+Every scenario sends the same sequence of requests for a given --random-seed, so results of two
+commits on the same machine are comparable. With --compare, scenarios whose p95 latency or
+throughput got worse than --tolerance are listed and the exit code is 1
+'''
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from flaskr.category_stats import category_stats
+from . import seed
+
+SEARCH_TERMS = seed.WORDS + ['plan', 'riv', 'champ', 'capital of']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+'''
+Each scenario returns the method, path and JSON body of one request
+'''
+def scenarios(total_questions):
+    pages = max(1, total_questions // 10)
+    return {
+        'questions_page': lambda generator: ('GET', '/questions?page={}'.format(generator.randint(1, pages)), None),
+        'category_questions': lambda generator: (
+            'GET', '/categories/{}/questions?page={}'.format(
+                generator.randint(1, len(seed.CATEGORIES)), generator.randint(1, max(1, pages // len(seed.CATEGORIES)))),
+            None),
+        'search': lambda generator: ('POST', '/questions/search', {'searchTerm': generator.choice(SEARCH_TERMS)}),
+        'quiz': lambda generator: ('POST', '/quizzes', {
+            'previous_questions': [generator.randint(1, total_questions) for _ in range(generator.randint(0, 50))],
+            'quiz_category': {'id': generator.randint(0, len(seed.CATEGORIES))}
+        })
+    }
+
+
+def send(base_url, method, path, body):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def run_scenario(base_url, build_request, requests, concurrency, random_seed):
+    generator = random.Random(random_seed)
+    planned = [build_request(generator) for _ in range(requests)]
+    latencies = []
+    errors = 0
+
+    def timed(planned_request):
+        started_at = time.perf_counter()
+        status = send(base_url, *planned_request)
+        return time.perf_counter() - started_at, status
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, status in pool.map(timed, planned):
+            latencies.append(latency)
+            errors += status >= 500
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(1000 * percentile(latencies, 0.50), 3),
+        'p95_ms': round(1000 * percentile(latencies, 0.95), 3),
+        'p99_ms': round(1000 * percentile(latencies, 0.99), 3)
+    }
+
+
+def peak_memory_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+'''
+Lists the scenarios whose p95 latency grew or whose throughput dropped by more than the tolerance
+'''
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        if result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {} ms -> {} ms'.format(name, previous['p95_ms'], result['p95_ms']))
+        if result['requests_per_second'] < previous['requests_per_second'] * (1 - tolerance):
+            regressions.append('{}: {} -> {} requests/s'.format(
+                name, previous['requests_per_second'], result['requests_per_second']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='database of the app served in this process')
+    parser.add_argument('--base-url', help='load test a running server instead, e.g. http://127.0.0.1:5000')
+    parser.add_argument('--seed-questions', type=int, help='reseed the database with this many questions first')
+    parser.add_argument('--scenario', action='append', help='scenarios to run, all of them by default')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--memory', action='store_true', help='copy the database into the in-memory storage and serve it from there')
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--compare', help='results file of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+    if not args.database_url and not args.base_url:
+        parser.error('one of --database-url and --base-url is required')
+    if args.seed_questions and not args.database_url:
+        parser.error('--seed-questions needs --database-url')
+
+    if args.seed_questions:
+        seed.seed(args.database_url, args.seed_questions, args.random_seed)
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url.rstrip('/')
+        with urllib.request.urlopen(base_url + '/categories/stats') as response:
+            total_questions = json.load(response)['total_questions']
+    else:
+        test_config = {'DATABASE_URL': args.database_url, 'DB_POOL_SIZE': args.concurrency, 'RATE_LIMITING': False}
+        if args.memory:
+            test_config.update(DATABASE_URL='memory://benchmark', MEMORY_STORAGE_SOURCE=args.database_url)
+        if not args.cache:
+            test_config['RESPONSE_CACHE_SIZE'] = 0
+        app = create_app(test_config)
+        with app.app_context():
+            total_questions = category_stats.total()
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    all_scenarios = scenarios(total_questions)
+    results = {
+        'commit': git_commit(),
+        'database': args.database_url.split('://')[0] if args.database_url else None,
+        'memory': args.memory,
+        'base_url': args.base_url,
+        'total_questions': total_questions,
+        'concurrency': args.concurrency,
+        'cache': None if args.base_url else args.cache,
+        'scenarios': {}
+    }
+    for name in args.scenario or all_scenarios:
+        # a short warm up loads the in-memory indexes before measuring
+        run_scenario(base_url, all_scenarios[name], min(20, args.requests), args.concurrency, args.random_seed + 1)
+        results['scenarios'][name] = run_scenario(
+            base_url, all_scenarios[name], args.requests, args.concurrency, args.random_seed)
+    if server:
+        results['peak_memory_mb'] = peak_memory_mb()
+        server.shutdown()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            results_file.write(output + '\n')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
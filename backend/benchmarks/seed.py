@@ -0,0 +1,69 @@
+'''
+Seeds a synthetic question bank for the benchmarks.
+
+    python -m benchmarks.seed --database-url sqlite:////tmp/trivia_bench.db --questions 100000
+
+The tables are created when missing. Questions are spread over the six categories and
+five difficulties, and their texts are built from a fixed vocabulary so that searches
+have matches. The same size and seed always give the same data
+'''
+import argparse
+import random
+
+from sqlalchemy import create_engine
+
+from models import db, Category, Question
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+WORDS = [
+    'planet', 'river', 'painter', 'battle', 'movie', 'team', 'element', 'capital', 'empire', 'novel',
+    'ocean', 'mountain', 'composer', 'invention', 'island', 'champion', 'theory', 'language', 'festival', 'desert'
+]
+BATCH_SIZE = 10000
+
+
+def question_rows(count, seed):
+    generator = random.Random(seed)
+    for number in range(count):
+        words = generator.sample(WORDS, 4)
+        yield {
+            'question': 'Which {} is linked to the {} of the {} and {}? #{}'.format(*words, number),
+            'answer': generator.choice(WORDS).title(),
+            'category': generator.randint(1, len(CATEGORIES)),
+            'difficulty': generator.randint(1, 5)
+        }
+
+
+def seed(database_url, questions, seed=0):
+    engine = create_engine(database_url)
+    db.metadata.create_all(engine, tables=[Category.__table__, Question.__table__])
+    with engine.begin() as connection:
+        connection.execute(Question.__table__.delete())
+        connection.execute(Category.__table__.delete())
+        connection.execute(Category.__table__.insert(),
+                           [{'id': number, 'type': name} for number, name in enumerate(CATEGORIES, 1)])
+
+    batch = []
+    for row in question_rows(questions, seed):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            with engine.begin() as connection:
+                connection.execute(Question.__table__.insert(), batch)
+            batch = []
+    if batch:
+        with engine.begin() as connection:
+            connection.execute(Question.__table__.insert(), batch)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    seed(args.database_url, args.questions, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''
+Measures the cost per row of turning questions into a JSON response body, comparing the ORM
+path (Question objects, format() and jsonify) with the column row path of the read endpoints
+(QuestionRow tuples and the fast encoder). The time of the raw fetch is reported separately.
+
+    python -m benchmarks.serialization --database-url sqlite:////tmp/trivia_bench.db --rows 2000
+
+Prints microseconds per row of each path as JSON
+'''
+import argparse
+import json
+import time
+
+from flask import jsonify
+
+from flaskr import create_app
+from flaskr.serialization import fast_jsonify
+from models import db, query_question_rows, question_rows, Question
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+        db.session.remove()
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--encoder', default='json', help='fast encoder, json or orjson')
+    args = parser.parse_args()
+
+    app = create_app({'DATABASE_URL': args.database_url, 'JSON_FAST_ENCODER': args.encoder})
+    with app.test_request_context():
+        rows = query_question_rows().order_by(Question.id).limit(args.rows)
+
+        def raw_fetch():
+            return db.session.execute(rows.statement).fetchall()
+
+        def orm_path():
+            questions = Question.query.order_by(Question.id).limit(args.rows).all()
+            return jsonify({'questions': [question.format() for question in questions]}).get_data()
+
+        def row_path():
+            return fast_jsonify({'questions': [question.format() for question in question_rows(rows)]}).get_data()
+
+        assert orm_path() == row_path()
+        fetch_seconds = best_of(args.repeat, raw_fetch)
+        orm_seconds = best_of(args.repeat, orm_path)
+        row_seconds = best_of(args.repeat, row_path)
+
+    per_row = 1e6 / args.rows
+    print(json.dumps({
+        'rows': args.rows,
+        'encoder': args.encoder,
+        'fetch_us_per_row': round(fetch_seconds * per_row, 2),
+        'orm_us_per_row': round((orm_seconds - fetch_seconds) * per_row, 2),
+        'row_us_per_row': round((row_seconds - fetch_seconds) * per_row, 2),
+        'speedup': round((orm_seconds - fetch_seconds) / (row_seconds - fetch_seconds), 2)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+'''
+Measures startup: cold starts of fresh processes, eager (the read caches are loaded before serving,
+as wsgi.py does by default) and lazy (LAZY_INIT, the first requests load what they need), with the time
+until the process can serve and the latency of its first requests. Then the cost of creating an app
+and serving its first request in a running process, as every test does, with the engine shared by the
+apps of the process and with a new engine per app.
+
+    python -m benchmarks.startup --database-url sqlite:////tmp/trivia_bench.db --runs 5 --apps 100
+
+Prints milliseconds as JSON, the median of the runs for cold starts
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# flaskr is only imported by the measured processes, so that its import time is part of the measure
+FIRST_REQUESTS = (
+    ('GET', '/categories', None),
+    ('GET', '/questions', None),
+    ('POST', '/quizzes', {'previous_questions': [], 'quiz_category': {'id': 0}}),
+    ('POST', '/questions/search', {'searchTerm': 'the'})
+)
+
+
+def milliseconds_since(started_at):
+    return round((time.perf_counter() - started_at) * 1000, 3)
+
+
+'''
+Runs in a fresh process: imports the app, creates it, loads its caches unless lazy and sends the first requests
+'''
+def cold_start(database_url, lazy):
+    started_at = time.perf_counter()
+    from flaskr import create_app
+    from flaskr.prefork import load_caches
+    results = {'import_ms': milliseconds_since(started_at)}
+    created_at = time.perf_counter()
+    app = create_app({'DATABASE_URL': database_url, 'RATE_LIMITING': False, 'LAZY_INIT': lazy})
+    results['create_app_ms'] = milliseconds_since(created_at)
+    if not lazy:
+        loaded_at = time.perf_counter()
+        load_caches(app)
+        results['load_caches_ms'] = milliseconds_since(loaded_at)
+    results['ready_ms'] = milliseconds_since(started_at)
+
+    client = app.test_client()
+    for method, path, body in FIRST_REQUESTS:
+        requested_at = time.perf_counter()
+        client.open(path, method=method, json=body)
+        results['first {} {}_ms'.format(method, path)] = milliseconds_since(requested_at)
+    results['first_requests_ms'] = milliseconds_since(started_at)
+    return results
+
+
+def median_cold_start(database_url, lazy, runs):
+    arguments = [sys.executable, '-m', 'benchmarks.startup', '--database-url', database_url, '--cold-start']
+    if lazy:
+        arguments.append('--lazy')
+    runs = [json.loads(subprocess.run(arguments, check=True, capture_output=True, text=True).stdout) for _ in range(runs)]
+    return {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+
+
+'''
+Creates apps one after the other and sends each its first request, like the test suite does in every setUp
+'''
+def app_creation(database_url, apps, shared_engine):
+    from flaskr import create_app
+    from models import db
+    started_at = time.perf_counter()
+    for _ in range(apps):
+        if not shared_engine:
+            db.engines.clear()
+        create_app({'DATABASE_URL': database_url, 'RATE_LIMITING': False}).test_client().get('/categories')
+    return round((time.perf_counter() - started_at) * 1000 / apps, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--apps', type=int, default=100)
+    parser.add_argument('--cold-start', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--lazy', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_start:
+        print(json.dumps(cold_start(args.database_url, args.lazy)))
+        return
+    results = {
+        'eager': median_cold_start(args.database_url, False, args.runs),
+        'lazy': median_cold_start(args.database_url, True, args.runs),
+        'app_new_engine_ms': app_creation(args.database_url, args.apps, False),
+        'app_shared_engine_ms': app_creation(args.database_url, args.apps, True)
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
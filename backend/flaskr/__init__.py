@@ -1,88 +1,246 @@
 import os
-from flask import Flask, request, abort, jsonify
+import base64
+from flask import Flask, request, abort, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
-import random
+from werkzeug.exceptions import Conflict
 
-from models import setup_db, Question, Category
+from models import pool_stats, database_path
+from .storage import create_storage, VersionConflict, EDIT_FIELDS
+from .question_index import QuestionIndex, question_index, target_difficulty, MIN_DIFFICULTY, MAX_DIFFICULTY
+from .quiz_sessions import create_session_store
+from .search import InvertedIndex, search_questions
+from .cache import response_cache, cached, ResponseCache
+from .bulk import import_questions, export_questions
+from .instrumentation import instrumentation
+from .category_stats import CategoryStats, category_stats
+from .admission import admission
+from .idempotency import idempotency
+from .leaderboard import Leaderboard, leaderboard, OVERALL_BOARD
+from .jobs import jobs, JobRunner
+from .prefork import warmup_command
+from . import serialization
+from .serialization import fast_jsonify, list_jsonify
+from .compression import compression
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 1000
+QUIZ_BATCH_SIZE = 10
+MAX_QUIZ_BATCH_SIZE = 50
+MAX_QUESTION_IDS = 100
+MAX_QUESTION_EDITS = 100
+MAX_PLAYER_LENGTH = 64
+MAX_QUIZ_QUESTIONS = 100
+LEADERBOARD_PAGE = 10
 
 
 '''
-# Supporting method to help paginate all questions after running /questions endpoint
+# Supporting methods to encode and decode the opaque cursor used for keyset pagination.
+The cursor holds the id of the last question of the previous page
 '''
-def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    current_questions = selection[start:end]
-    return current_questions
+def encode_cursor(question_id):
+    return base64.urlsafe_b64encode(str(question_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+
+'''
+# Supporting method reading the `per_page` parameter, QUESTIONS_PER_PAGE by default and at most MAX_QUESTIONS_PER_PAGE
+'''
+def questions_per_page(request):
+    per_page = request.args.get('per_page', QUESTIONS_PER_PAGE, type=int)
+    if not 1 <= per_page <= MAX_QUESTIONS_PER_PAGE:
+        abort(422)
+    return per_page
+
+
+'''
+# Supporting method to help paginate questions after running /questions endpoint.
+Fetches a single page of the questions ordered by id, optionally of one category, from the storage,
+either with LIMIT/OFFSET for the `page` parameter or by seeking past the `cursor` parameter.
+Returns the page and the cursor of the next page, which is None on the last page
+'''
+def paginate_questions(request, storage, category_id=None):
+    per_page = questions_per_page(request)
+    cursor = request.args.get('cursor')
+    last_id = None
+    offset = 0
+    if cursor:
+        try:
+            last_id = decode_cursor(cursor)
+        except ValueError:
+            abort(422)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        offset = (page - 1) * per_page
+
+    # one extra row tells whether there is a next page without another query
+    current_questions = storage.question_page(category_id, after_id=last_id, offset=offset, limit=per_page + 1)
+    next_cursor = None
+    if len(current_questions) > per_page:
+        current_questions = current_questions[:per_page]
+        next_cursor = encode_cursor(current_questions[-1].id)
+    return current_questions, next_cursor
+
+
+'''
+# Supporting method checking the body of PATCH /questions. Aborts with 422 unless it holds a list of
+1 to MAX_QUESTION_EDITS edits of distinct questions, each with an integer id, at least one field
+to change with a valid value, a difficulty being between MIN_DIFFICULTY and MAX_DIFFICULTY,
+and optionally an integer version. Returns the edits
+'''
+def validate_edits(body, category_ids):
+    edits = body.get('questions') if isinstance(body, dict) else None
+    if not isinstance(edits, list) or not 1 <= len(edits) <= MAX_QUESTION_EDITS:
+        abort(422)
+    for edit in edits:
+        if not isinstance(edit, dict) or 'id' not in edit or not set(edit) & set(EDIT_FIELDS) \
+                or set(edit) - set(EDIT_FIELDS) - {'id', 'version'}:
+            abort(422)
+        # bool is a subclass of int, so the exact type is checked
+        if any(type(edit[field]) is not int for field in ('id', 'version', 'category', 'difficulty') if field in edit):
+            abort(422)
+        if any(not isinstance(edit[field], str) or not edit[field] for field in ('question', 'answer') if field in edit):
+            abort(422)
+        if 'category' in edit and edit['category'] not in category_ids:
+            abort(422)
+        if 'difficulty' in edit and not MIN_DIFFICULTY <= edit['difficulty'] <= MAX_DIFFICULTY:
+            abort(422)
+    if len({edit['id'] for edit in edits}) < len(edits):
+        abort(422)
+    return edits
+
+
+'''
+# Supporting method returning the formatted questions of a list of ids with their current version
+'''
+def versioned_questions(storage, question_ids):
+    versions = storage.question_versions(question_ids)
+    return [dict(question.format(), version=versions[question.id])
+            for question in storage.get_questions(question_ids) if question.id in versions]
 
 
 def create_app(test_config=None):
-    # create and configure the app
-    app = Flask(__name__)
-    db = setup_db(app)
+    # create and configure the app, the API serves no static files
+    app = Flask(__name__, static_folder=None)
+    if test_config:
+        app.config.from_mapping(test_config)
+    storage = create_storage(app, app.config.get('DATABASE_URL', database_path))
+    QuestionIndex(app)
+    InvertedIndex(app)
+    CategoryStats(app)
+    ResponseCache(app)
+    instrumentation.init_app(app)
+    serialization.init_app(app)
+    compression.init_app(app)
+    admission.init_app(app)
+    idempotency.init_app(app)
+    Leaderboard(app)
+    JobRunner(app)
+    quiz_sessions = create_session_store(app.config)
+    app.cli.add_command(warmup_command)
     CORS(app, origins='http://localhost:3000', methods=['GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS'], supports_credentials=True)
 
     '''
     # Returns all the categories list
     '''
     @app.route('/categories')
+    @cached('categories')
     def get_categories():
-        categories = Category.query.order_by(Category.type).all()
-        cat_quantity = len(categories)
+        formatted_categories = storage.categories()
+        cat_quantity = len(formatted_categories)
         if cat_quantity == 0:
             abort(404)
-        formatted_categories = [category.format() for category in categories]
 
-        return jsonify({
+        return fast_jsonify({
             'success': True,
             'categories': formatted_categories,
             'total_categories': cat_quantity
         })
 
     '''
-    # Returns paged questions. 10 questions per query or page.
+    # Returns the number of questions of every category and how they spread over the difficulties.
+    The counts are kept in memory and updated on every write, so no question is counted here
+    '''
+    @app.route('/categories/stats')
+    def get_category_stats():
+        formatted_categories = [dict(category,
+                                     total_questions=category_stats.total(category['id']),
+                                     difficulties={str(difficulty): count for difficulty, count in category_stats.histogram(category['id']).items()})
+                                for category in storage.categories()]
+
+        return fast_jsonify({
+            'success': True,
+            'categories': formatted_categories,
+            'total_questions': category_stats.total()
+        })
+
+    '''
+    # Returns paged questions. 10 questions per query or page, or `per_page`.
+    With `ids`, a comma separated list of up to MAX_QUESTION_IDS ids, returns those questions with their version instead
     '''
     @app.route('/questions')
+    @cached('questions')
     def get_questions():
-        questions = Question.query.order_by(Question.id).all()
-        if len(questions) == 0:
+        if 'ids' in request.args:
+            return get_questions_by_ids(request.args['ids'])
+        total_questions = category_stats.total()
+        if total_questions == 0:
             abort(404)
-        unformatted_paged_questions = paginate_questions(request, questions)
-        formatted_paged_questions = [question.format() for question in unformatted_paged_questions]
-        categories = Category.query.order_by(Category.type).all()
-        formatted_categories = [category.format() for category in categories]
+        unformatted_paged_questions, next_cursor = paginate_questions(request, storage)
+        formatted_categories = storage.categories()
 
-        return jsonify({
+        response = {
             'success': True,
-            'questions': formatted_paged_questions,
-            'total_questions': len(questions),
+            'total_questions': total_questions,
             'categories': formatted_categories,
             'current_category': None
+        }
+        if next_cursor:
+            response['next_cursor'] = next_cursor
+        return list_jsonify(response, 'questions', unformatted_paged_questions)
+
+    def get_questions_by_ids(ids):
+        try:
+            question_ids = list(dict.fromkeys(int(question_id) for question_id in ids.split(',')))
+        except ValueError:
+            abort(422)
+        if len(question_ids) > MAX_QUESTION_IDS:
+            abort(422)
+        questions = versioned_questions(storage, question_ids)
+        if not questions:
+            abort(404)
+
+        return fast_jsonify({
+            'success': True,
+            'questions': questions,
+            'total_questions': len(questions)
         })
 
     '''
     # Deletes the question. Accepts question id to locate the necessary question
     '''
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
+    @admission.limited('write')
+    @idempotency.idempotent
     def delete_question(question_id):
-        try:
-            question = Question.query.filter_by(id=question_id).one_or_none()
-            question.delete()
-            return jsonify({
-                'success': True,
-                'message': 'Deleted'
-            })
-        except:
+        if storage.delete_question(question_id) is None:
             abort(422)
+        return jsonify({
+            'success': True,
+            'message': 'Deleted'
+        })
 
     '''
     # Creates a new question and answer in the database. Accepts question, answer, category and difficulty
     '''
     @app.route('/questions', methods=['POST'])
+    @admission.limited('write')
+    @idempotency.idempotent
     def create_question():
         try:
             body = request.get_json()
@@ -92,33 +250,85 @@ def create_app(test_config=None):
             new_difficulty = body['difficulty']
             new_category = body['category']
 
-            question = Question(question=new_question, answer=new_answer, difficulty=new_difficulty, category=new_category)
-            question.insert()
+            question_id = storage.insert_question(new_question, new_answer, new_category, new_difficulty)
             return jsonify({
                 'success': True,
                 'message': 'Added',
-                'id': question.id
+                'id': question_id
             })
         except:
             abort(422)
 
     '''
-    # Searches for a question. Accepts a search term string to search for
+    # Edits questions in bulk. Accepts a list of edits, each with the question id, the fields to change
+    and optionally the version of the question the edit is based on. The edits are applied in one
+    transaction, all of them or none. When a question was edited since that version, the response
+    is a 409 with the current version of the conflicting questions
+    '''
+    @app.route('/questions', methods=['PATCH'])
+    @admission.limited('write')
+    @idempotency.idempotent
+    def edit_questions():
+        edits = validate_edits(request.get_json(silent=True), {category['id'] for category in storage.categories()})
+        try:
+            edited = storage.update_questions(edits)
+        except KeyError:
+            abort(404)
+        except VersionConflict as conflict:
+            error = Conflict()
+            error.questions = versioned_questions(storage, conflict.question_ids)
+            raise error
+
+        return jsonify({
+            'success': True,
+            'questions': [dict(question.format(), version=version) for question, version in edited],
+            'total_questions': len(edited)
+        })
+
+    '''
+    # Creates questions in bulk from an NDJSON (application/x-ndjson) or CSV (text/csv) body.
+    Every line or row holds question, answer, category and difficulty. The body is read as a stream
+    and inserted in batches of BULK_BATCH_SIZE rows. Rejected lines are reported with the reason
+    '''
+    @app.route('/questions/bulk', methods=['POST'])
+    @admission.limited('bulk')
+    def bulk_create_questions():
+        if request.mimetype not in ('application/x-ndjson', 'text/csv'):
+            abort(422)
+        inserted, total_rejected, rejected = import_questions(
+            request.stream, request.mimetype, app.config.get('BULK_BATCH_SIZE', 1000))
+        return jsonify({
+            'success': True,
+            'inserted': inserted,
+            'total_rejected': total_rejected,
+            'rejected': rejected
+        })
+
+    '''
+    # Streams every question as NDJSON, one question per line
+    '''
+    @app.route('/questions/export')
+    def export_all_questions():
+        return Response(stream_with_context(export_questions()), mimetype='application/x-ndjson')
+
+    '''
+    # Searches for a question. Accepts a search term string to search for.
+    Matches are ranked and paginated like /questions
     '''
     @app.route('/questions/search', methods=['POST'])
+    @admission.limited('search')
     def search_question():
         search_term = request.get_json()['searchTerm']
-        questions = Question.query.filter(
-            Question.question.ilike("%" + search_term + "%")).order_by(Question.question).all()
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = questions_per_page(request)
+        questions, total_questions = search_questions(search_term, (page - 1) * per_page, per_page)
 
         if questions:
-            formatted_questions = [question.format() for question in questions]
-            return jsonify({
+            return list_jsonify({
                 'success': True,
-                'questions': formatted_questions,
-                'total_questions': len(formatted_questions),
+                'total_questions': total_questions,
                 'current_category': None
-            })
+            }, 'questions', questions)
         else:
             abort(404)
 
@@ -126,49 +336,261 @@ def create_app(test_config=None):
     # Returns all the questions by the provided category. Accepts a category ID
     '''
     @app.route('/categories/<int:category_id>/questions')
+    @cached('questions')
     def questions_by_category(category_id):
-        questions = Question.query.filter_by(category=category_id).all()
-        if questions:
-            unformatted_paged_questions = paginate_questions(request, questions)
-            formatted_questions = [question.format() for question in unformatted_paged_questions]
-            return jsonify({
+        total_questions = category_stats.category_total(category_id)
+        if total_questions:
+            unformatted_paged_questions, next_cursor = paginate_questions(request, storage, category_id)
+            response = {
                 'success': True,
-                'questions': formatted_questions,
-                'total_questions': len(questions),
+                'total_questions': total_questions,
                 'current_category': category_id
-            })
+            }
+            if next_cursor:
+                response['next_cursor'] = next_cursor
+            return list_jsonify(response, 'questions', unformatted_paged_questions)
         else:
             abort(404)
 
     '''
     # Returns a quiz question and an answer per chosen category. 
-    it should give a random question and should not repeat questions
+    it should give a random question and should not repeat questions.
+    The id is drawn from the in-memory question index, so only the chosen question is loaded:
+    it is the question following the last previous question in the shuffle index of the category.
+    With `adaptive` the draw favours questions whose difficulty matches the `score` of the player
     '''
     @app.route('/quizzes', methods=['POST'])
     def play_trivia():
         try:
             body = request.get_json()
-            if body["quiz_category"]["id"] == 0:
-                questions = Question.query.with_entities(Question.id).all()
-            else:
-                questions = Question.query.with_entities(Question.id).filter_by(category=body["quiz_category"]["id"]).all()
-
-            total_questions_in_category = len(questions)
-            if total_questions_in_category == 0:
+            category_id = body["quiz_category"]["id"]
+            asked_questions = [int(question_id) for question_id in body["previous_questions"]]
+            previous_questions = set(asked_questions)
+            last_question = asked_questions[-1] if asked_questions else None
+            if body.get("adaptive"):
+                difficulty = target_difficulty(int(body["score"]), len(previous_questions))
+            if len(question_index.ids(category_id)) == 0:
                 abort(404)
-            previous_questions = body["previous_questions"]
-            if len(previous_questions) == total_questions_in_category:
-                return jsonify({})
-            not_asked_question_ids = [question_id for question_id in questions if question_id not in previous_questions]
-            random_question_id = random.choice(not_asked_question_ids)
-            random_question = Question.query.get(random_question_id)
-            return jsonify({
+
+            random_question = None
+            while random_question is None:
+                if body.get("adaptive"):
+                    random_question_id = question_index.draw_adaptive(category_id, previous_questions, difficulty)
+                else:
+                    random_question_id = question_index.draw(category_id, previous_questions, last_question)
+                if random_question_id is None:
+                    return fast_jsonify({})
+                random_question = storage.get_question(random_question_id)
+                if random_question is None:
+                    # deleted by another worker since the index was loaded
+                    question_index.forget(random_question_id)
+            return fast_jsonify({
                 "success": True,
                 "question": random_question.format()
             })
         except:
             abort(422)
 
+    '''
+    # Returns `count` quiz questions of the chosen category at once (QUIZ_BATCH_SIZE by default), none of them
+    in the previous questions, so that a client can fetch a whole round in one request.
+    The ids follow each other in the shuffle index of the category and the questions are loaded with a single query.
+    Fewer questions are returned when the category runs out of them
+    '''
+    @app.route('/quizzes/batch', methods=['POST'])
+    def play_trivia_batch():
+        try:
+            body = request.get_json()
+            category_id = body["quiz_category"]["id"]
+            asked_questions = [int(question_id) for question_id in body["previous_questions"]]
+            previous_questions = set(asked_questions)
+            last_question = asked_questions[-1] if asked_questions else None
+            count = int(body.get("count", QUIZ_BATCH_SIZE))
+            category_ids = question_index.ids(category_id)
+        except:
+            abort(422)
+        if not 1 <= count <= MAX_QUIZ_BATCH_SIZE:
+            abort(422)
+        if len(category_ids) == 0:
+            abort(404)
+
+        questions = []
+        while len(questions) < count:
+            question_ids = question_index.draw_many(category_id, previous_questions, count - len(questions), last_question)
+            if not question_ids:
+                break
+            previous_questions.update(question_ids)
+            last_question = question_ids[-1]
+            found_questions = storage.get_questions(question_ids)
+            for question_id in set(question_ids) - {question.id for question in found_questions}:
+                # deleted by another worker since the index was loaded
+                question_index.forget(question_id)
+            questions += found_questions
+
+        return fast_jsonify({
+            "success": True,
+            "questions": [question.format() for question in questions]
+        })
+
+    '''
+    # Records the score of a finished quiz. Accepts the player name, the quiz category like /quizzes,
+    the number of correct answers as score and the number of questions asked.
+    The result is buffered and written with others in a single transaction, see Leaderboard
+    '''
+    @app.route('/quizzes/results', methods=['POST'])
+    @idempotency.idempotent
+    def record_quiz_result():
+        try:
+            body = request.get_json()
+            player = body["player"].strip()
+            category_id = int(body["quiz_category"]["id"]) or None
+            score = int(body["score"])
+            questions = int(body["questions"])
+        except:
+            abort(422)
+        if not 1 <= len(player) <= MAX_PLAYER_LENGTH or not 0 <= score <= questions <= MAX_QUIZ_QUESTIONS:
+            abort(422)
+        if category_id is not None and not category_stats.total(category_id):
+            abort(404)
+
+        leaderboard.record(player, category_id, score, questions)
+        return jsonify({
+            "success": True,
+            "message": "Recorded"
+        }), 202
+
+    '''
+    # Returns the best players with their best score, of every quiz or of the quizzes of a `category`.
+    Served from the leaderboards kept in memory, up to `limit` players
+    '''
+    @app.route('/leaderboard')
+    def get_leaderboard():
+        try:
+            category_id = int(request.args.get('category', OVERALL_BOARD))
+            limit = int(request.args.get('limit', LEADERBOARD_PAGE))
+        except ValueError:
+            abort(422)
+        if not 1 <= limit <= leaderboard.size:
+            abort(422)
+        if category_id != OVERALL_BOARD and not category_stats.total(category_id):
+            abort(404)
+
+        return fast_jsonify({
+            "success": True,
+            "category": category_id or None,
+            "leaderboard": leaderboard.top(category_id, limit)
+        })
+
+    '''
+    # Starts a quiz session for the chosen category. The questions of the category are shuffled for the session
+    and kept on the server, so the client does not need to send the previously asked questions
+    '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        try:
+            body = request.get_json()
+            question_ids = question_index.shuffled(body["quiz_category"]["id"])
+        except:
+            abort(422)
+        if len(question_ids) == 0:
+            abort(404)
+        session_id = quiz_sessions.create(question_ids)
+        return jsonify({
+            "success": True,
+            "session_id": session_id,
+            "total_questions": len(question_ids)
+        })
+
+    '''
+    # Returns the next question of a quiz session. The question is null once every question was asked
+    '''
+    @app.route('/quizzes/sessions/<session_id>/next')
+    def next_session_question(session_id):
+        question = None
+        try:
+            while question is None:
+                question_id = quiz_sessions.pop(session_id)
+                if question_id is None:
+                    break
+                question = storage.get_question(question_id)
+        except KeyError:
+            abort(404)
+        return fast_jsonify({
+            "success": True,
+            "question": question.format() if question else None
+        })
+
+    '''
+    # Queues a maintenance job. Accepts the task name and its arguments, the job runs in the background
+    and its status is read at /jobs/<job_id>
+    '''
+    @app.route('/jobs', methods=['POST'])
+    @admission.limited('write')
+    @idempotency.idempotent
+    def create_job():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('task'), str):
+            abort(422)
+        try:
+            job = jobs.enqueue(body['task'], body.get('arguments'))
+        except ValueError:
+            abort(422)
+        jobs.start()
+
+        response = jsonify({
+            'success': True,
+            'job': job
+        })
+        response.headers['Location'] = '/jobs/{}'.format(job['id'])
+        return response, 202
+
+    '''
+    # Returns a job with its status, attempts, and its result or last error
+    '''
+    @app.route('/jobs/<int:job_id>')
+    def get_job(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'job': job
+        })
+
+    '''
+    # Returns the hit and miss counters of the response cache
+    '''
+    @app.route('/stats/cache')
+    def cache_stats():
+        return jsonify({
+            "success": True,
+            "cache": response_cache.stats()
+        })
+
+    '''
+    # Returns how many connections were checked out of the database pool and how long they took to get
+    '''
+    @app.route('/stats/pool')
+    def database_pool_stats():
+        return jsonify({
+            "success": True,
+            "pool": pool_stats.format()
+        })
+
+    '''
+    # Readiness probe for load balancers and process managers. Answers 503 while the database cannot be reached.
+    `warm` tells whether the in-memory question index of this worker is loaded
+    '''
+    @app.route('/ready')
+    def readiness():
+        if not storage.ping():
+            abort(503)
+        return jsonify({
+            "success": True,
+            "ready": True,
+            "warm": question_index.categories is not None
+        })
+
     @app.errorhandler(500)
     def server_error(error):
         return jsonify({
@@ -201,4 +623,33 @@ def create_app(test_config=None):
             "message": "Method not allowed. Please check the documentation"
         }), 405
 
+    @app.errorhandler(409)
+    def conflict(error):
+        response = {
+            "success": False,
+            "error": 409,
+            "message": "Conflict with the current state of the resource, please reload it"
+        }
+        if getattr(error, 'questions', None) is not None:
+            response['questions'] = error.questions
+        return jsonify(response), 409
+
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify({
+            "success": False,
+            "error": 429,
+            "message": "Too many requests, please try again later"
+        })
+        response.headers['Retry-After'] = str(getattr(error, 'retry_after', 1))
+        return response, 429
+
+    @app.errorhandler(503)
+    def unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": "Service unavailable, please try again later"
+        }), 503
+
     return app
@@ -0,0 +1,148 @@
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+from models import get_setting
+from .sqlite_store import SQLiteStore
+
+# route group: (requests per second, burst) of every client
+RATE_LIMITS = {
+    'search': (10, 20),
+    'write': (5, 20),
+    'bulk': (0.1, 2)
+}
+# route group: (requests served at the same time by a worker, seconds a request may wait for a slot)
+CONCURRENCY_LIMITS = {
+    'search': (8, 2),
+    'bulk': (1, 0)
+}
+SWEEP_SECONDS = 60
+
+
+'''
+MemoryBuckets
+    token buckets of the clients kept in process memory. Every bucket holds up to burst tokens
+    and gains rate tokens per second, a request takes one. Buckets that filled up again are swept
+    every SWEEP_SECONDS, so memory only grows with the clients seen during that time
+'''
+class MemoryBuckets:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.swept_at = time.monotonic()
+
+    '''
+    Takes a token of the bucket and returns 0, or returns the seconds until a token is available
+    '''
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            # the bucket is stored with the time it will be full again
+            self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if now - self.swept_at > SWEEP_SECONDS:
+                self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+                self.swept_at = now
+        return wait
+
+
+'''
+SQLiteBuckets
+    token buckets shared by the worker processes of a host through a SQLite file,
+    with the same behaviour as MemoryBuckets
+'''
+class SQLiteBuckets(SQLiteStore):
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS rate_limits ('
+        'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)',
+    )
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.swept_at = time.time()
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        with self.transaction() as connection:
+            bucket = connection.execute('SELECT tokens, updated_at FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)',
+                               (key, tokens, now, now + (burst - tokens) / rate))
+            if now - self.swept_at > SWEEP_SECONDS:
+                connection.execute('DELETE FROM rate_limits WHERE full_at <= ?', (now,))
+                self.swept_at = now
+        return wait
+
+
+'''
+AdmissionControl
+    protects groups of expensive routes. Every client, identified by its address, has a token
+    bucket per group with the RATE_LIMITS rate and burst, and gets a 429 response with a
+    Retry-After header once it is empty. Groups with CONCURRENCY_LIMITS also run at most that
+    many requests at the same time in a worker: other requests wait up to the queue time for a
+    slot and get a 429 response after it. Buckets are kept in memory unless RATE_LIMIT_BACKEND is
+    'sqlite', which shares them between the workers of a host through the RATE_LIMIT_PATH file.
+    RATE_LIMITING set to false turns everything off
+'''
+class AdmissionControl:
+
+    def init_app(self, app):
+        concurrency_limits = dict(CONCURRENCY_LIMITS, **app.config.get('CONCURRENCY_LIMITS', {}))
+        if get_setting(app.config, 'RATE_LIMIT_BACKEND', 'memory', str) == 'sqlite':
+            buckets = SQLiteBuckets(get_setting(app.config, 'RATE_LIMIT_PATH', 'rate_limits.db', str))
+        else:
+            buckets = MemoryBuckets()
+        # kept by the app, every app of the process has its own limits and buckets
+        app.extensions['admission'] = {
+            'enabled': get_setting(app.config, 'RATE_LIMITING', True, bool),
+            'rate_limits': dict(RATE_LIMITS, **app.config.get('RATE_LIMITS', {})),
+            'concurrency_limits': concurrency_limits,
+            'buckets': buckets,
+            'slots': {group: threading.BoundedSemaphore(limit) for group, (limit, _) in concurrency_limits.items()}
+        }
+
+    def reject(self, retry_after):
+        raise TooManyRequests(retry_after=max(1, round(retry_after)))
+
+    '''
+    Decorator applying the limits of a route group
+    '''
+    def limited(self, group):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                limits = current_app.extensions['admission']
+                if not limits['enabled']:
+                    return view(*args, **kwargs)
+                if group in limits['rate_limits']:
+                    rate, burst = limits['rate_limits'][group]
+                    wait = limits['buckets'].take('{}:{}'.format(group, request.remote_addr), rate, burst)
+                    if wait:
+                        self.reject(wait)
+                slots = limits['slots'].get(group)
+                if slots is None:
+                    return view(*args, **kwargs)
+
+                queue_seconds = limits['concurrency_limits'][group][1]
+                if not slots.acquire(timeout=queue_seconds):
+                    self.reject(queue_seconds)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    slots.release()
+            return wrapper
+        return decorator
+
+
+admission = AdmissionControl()
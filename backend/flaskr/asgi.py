@@ -0,0 +1,76 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+
+'''
+AsgiApp
+    serves the trivia app to an ASGI server. Every route, JSON response and error handler
+    is the one of the WSGI app given to it. Requests run in a pool of `threads` worker threads,
+    so a slow query holds one thread while the event loop keeps accepting and answering
+    the other connections
+'''
+class AsgiApp:
+
+    def __init__(self, wsgi_app, threads=64):
+        self.wsgi_app = wsgi_app
+        self.asgi_app = WsgiToAsgi(wsgi_app)
+        self.threads = threads
+        self.loop = None
+
+    def use_executor(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=self.threads))
+            self.loop = loop
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.use_executor()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        self.use_executor()
+        await self.asgi_app(scope, receive, send)
+
+
+'''
+Sends a single request to an ASGI app and returns the status code, the headers and the body.
+Used by the tests and benchmarks to call the app without a server
+'''
+async def asgi_request(app, method, path, body=b'', headers=()):
+    path, _, query_string = path.partition('?')
+    headers = list(headers) + [('Content-Length', str(len(body)))]
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'path': path,
+        'query_string': query_string.encode(),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+        'client': ('127.0.0.1', 0)
+    }
+    request_messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {'status': None, 'headers': [], 'body': b''}
+
+    async def receive():
+        return request_messages.pop(0) if request_messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = [(name.decode(), value.decode()) for name, value in message['headers']]
+        else:
+            response['body'] += message.get('body', b'')
+
+    await app(scope, receive, send)
+    return response['status'], response['headers'], response['body']
@@ -0,0 +1,154 @@
+import csv
+import json
+
+from models import notify_question_listeners
+from .storage import current_storage
+from .question_index import MIN_DIFFICULTY, MAX_DIFFICULTY
+
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+EXPORT_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+MAX_REPORTED_REJECTIONS = 1000
+
+
+'''
+Decodes the lines of an uploaded stream as UTF-8, one at a time. A line that is not valid UTF-8
+is replaced with an empty line and its number added to invalid_lines, so that it is rejected on its own
+'''
+def decode_lines(stream, invalid_lines):
+    for line_number, line in enumerate(stream, 1):
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError:
+            invalid_lines.append(line_number)
+            yield '\n'
+
+
+'''
+Reads the rows of an uploaded NDJSON or CSV stream one line at a time.
+Yields the line number with the parsed row, or with the error when the line is not valid UTF-8 or JSON
+'''
+def read_rows(stream, content_type):
+    invalid_lines = []
+    lines = decode_lines(stream, invalid_lines)
+    if content_type == 'text/csv':
+        # blank lines are skipped by the reader, invalid ones are reported before the next row
+        reader = csv.DictReader(lines)
+        for row in reader:
+            while invalid_lines:
+                yield invalid_lines.pop(0), ValueError('invalid UTF-8')
+            yield reader.line_num, row
+        while invalid_lines:
+            yield invalid_lines.pop(0), ValueError('invalid UTF-8')
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if invalid_lines:
+            yield invalid_lines.pop(), ValueError('invalid UTF-8')
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, ValueError('invalid JSON')
+
+
+'''
+Checks an uploaded row and returns the values to insert, with a known category and a difficulty between
+MIN_DIFFICULTY and MAX_DIFFICULTY. Raises ValueError with the reason otherwise
+'''
+def validate_row(row, category_ids):
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError('expected an object')
+    for field in QUESTION_FIELDS:
+        if row.get(field) in (None, ''):
+            raise ValueError(f"missing field '{field}'")
+    try:
+        category = int(row['category'])
+        difficulty = int(row['difficulty'])
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('category and difficulty must be integers')
+    if category not in category_ids:
+        raise ValueError(f'unknown category {category}')
+    if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+        raise ValueError(f'difficulty must be between {MIN_DIFFICULTY} and {MAX_DIFFICULTY}')
+    return {
+        'question': str(row['question']),
+        'answer': str(row['answer']),
+        'category': category,
+        'difficulty': difficulty
+    }
+
+
+'''
+Inserts a batch in one transaction. When the database refuses the batch, its rows
+are inserted one by one to find the rejected ones. Returns the inserted count and the rejections
+'''
+def commit_batch(batch, line_numbers):
+    storage = current_storage()
+    try:
+        storage.insert_questions(batch)
+        return len(batch), []
+    except Exception:
+        pass
+
+    inserted = 0
+    rejected = []
+    for values, line_number in zip(batch, line_numbers):
+        try:
+            storage.insert_questions([values])
+            inserted += 1
+        except Exception as error:
+            rejected.append({'line': line_number, 'error': str(error.__cause__ or error).strip()})
+    return inserted, rejected
+
+
+'''
+import_questions(stream, content_type, batch_size)
+    inserts the questions of an NDJSON or CSV stream in transactions of batch_size rows.
+    Memory use depends on the batch size only. Returns the inserted count, the number of
+    rejected lines and the first MAX_REPORTED_REJECTIONS rejections with their line numbers
+'''
+def import_questions(stream, content_type, batch_size=1000):
+    category_ids = {category['id'] for category in current_storage().categories()}
+    inserted = 0
+    total_rejected = 0
+    rejected = []
+    batch = []
+    line_numbers = []
+
+    def report(rejections):
+        nonlocal total_rejected
+        total_rejected += len(rejections)
+        rejected.extend(rejections[:MAX_REPORTED_REJECTIONS - len(rejected)])
+
+    for line_number, row in read_rows(stream, content_type):
+        try:
+            batch.append(validate_row(row, category_ids))
+            line_numbers.append(line_number)
+        except ValueError as error:
+            report([{'line': line_number, 'error': str(error)}])
+        if len(batch) >= batch_size:
+            batch_inserted, batch_rejected = commit_batch(batch, line_numbers)
+            inserted += batch_inserted
+            report(batch_rejected)
+            batch, line_numbers = [], []
+    if batch:
+        batch_inserted, batch_rejected = commit_batch(batch, line_numbers)
+        inserted += batch_inserted
+        report(batch_rejected)
+
+    if inserted:
+        notify_question_listeners('reload', None)
+    return inserted, total_rejected, rejected
+
+
+'''
+Yields every question as an NDJSON line. Database storages read the rows through
+a server-side cursor, so memory use stays constant whatever the table size
+'''
+def export_questions():
+    for row in current_storage().scan_questions(EXPORT_FIELDS):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), sort_keys=True) + '\n'
@@ -0,0 +1,200 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, request, Response, copy_current_request_context
+from werkzeug.local import LocalProxy
+
+from models import add_question_listener
+
+# seconds a request waits for the response of the identical request in flight before running the view itself
+FLIGHT_WAIT_SECONDS = 10
+# counter of the X-Cache statuses of responses served from the cache, misses are counted as the view runs
+CACHE_COUNTERS = {
+    'HIT': 'hits',
+    'STALE': 'stale',
+    'COALESCED': 'coalesced'
+}
+
+
+'''
+ResponseCache
+    keeps the bodies of successful GET responses in a bounded LRU with a TTL, keyed by
+    the path and the sorted query arguments. Every cached route belongs to a tag and
+    all entries of a tag are dropped when the data behind it changes. Responses carry an
+    ETag, and a request whose If-None-Match matches it gets an empty 304 response.
+    Streamed responses are passed through without being cached, to keep their memory use low.
+    Concurrent misses of a key are coalesced: the first request runs the view while the others
+    wait for its response instead of running the same queries. An expired entry is still served
+    for RESPONSE_CACHE_STALE_TTL seconds while a single background request refreshes it.
+    Every app has its own cache in app.extensions['response_cache'], `response_cache` is the one of the current app
+'''
+class ResponseCache:
+
+    def __init__(self, app):
+        self.max_entries = app.config.get('RESPONSE_CACHE_SIZE', 512)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', 60)
+        self.stale_ttl = app.config.get('RESPONSE_CACHE_STALE_TTL', 30)
+        self.coalescing = app.config.get('RESPONSE_CACHE_COALESCING', True)
+        self.lock = threading.Lock()
+        self.reset()
+        app.extensions['response_cache'] = self
+        add_question_listener(app, self.on_question_change)
+
+    def reset(self):
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.flights = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.coalesced = 0
+
+    '''
+    Returns the entry of the key with whether it is fresh, or None when there is none to serve
+    '''
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['expires_at'] + self.stale_ttl <= now:
+                return None, False
+            self.entries.move_to_end(key)
+            return entry, entry['expires_at'] > now
+
+    def set(self, key, tag, generation, response):
+        body = response.get_data()
+        entry = {
+            'tag': tag,
+            'body': body,
+            'mimetype': response.mimetype,
+            'etag': hashlib.md5(body).hexdigest(),
+            'expires_at': time.monotonic() + self.ttl
+        }
+        with self.lock:
+            # the data changed while the response was built, so it may already be stale
+            if self.generations.get(tag, 0) != generation:
+                return entry
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, tag):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+            for key in [key for key, entry in self.entries.items() if entry['tag'] == tag]:
+                del self.entries[key]
+
+    '''
+    Returns the flight building the response of the key with whether the caller leads it. A request
+    only joins a flight started since the last change of the tag, so it never gets older data than it would alone
+    '''
+    def join(self, key, tag):
+        with self.lock:
+            generation = self.generations.get(tag, 0)
+            flight = self.flights.get(key)
+            if self.coalescing and flight is not None and flight['generation'] == generation:
+                return flight, False
+            flight = {'generation': generation, 'entry': None, 'done': threading.Event()}
+            self.flights[key] = flight
+            return flight, True
+
+    def land(self, key, flight):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight['done'].set()
+
+    '''
+    Runs the view for a flight and returns its response. The response is cached and shared
+    with the followers when it is a complete 200 response
+    '''
+    def fly(self, key, tag, flight, view, args, kwargs):
+        try:
+            response = view(*args, **kwargs)
+            if response.status_code == 200 and not response.is_streamed:
+                flight['entry'] = self.set(key, tag, flight['generation'], response)
+            return response
+        finally:
+            self.land(key, flight)
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'coalesced': self.coalesced,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries
+            }
+
+    '''
+    Answers the request with the cached response of the view, running the view when there is none to serve
+    '''
+    def serve(self, tag, view, args, kwargs):
+        key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+        entry, fresh = self.get(key)
+        cache_status = 'HIT'
+        if not fresh:
+            flight, leader = self.join(key, tag)
+            if entry is not None:
+                # stale: served at once, the leader refreshes it in the background
+                if leader:
+                    self.count('misses')
+                    threading.Thread(target=copy_current_request_context(self.fly), daemon=True,
+                                     args=(key, tag, flight, view, args, kwargs)).start()
+                cache_status = 'STALE'
+            elif leader:
+                self.count('misses')
+                response = self.fly(key, tag, flight, view, args, kwargs)
+                if flight['entry'] is None:
+                    return response
+                entry = flight['entry']
+                cache_status = 'MISS'
+            else:
+                flight['done'].wait(FLIGHT_WAIT_SECONDS)
+                if flight['entry'] is None:
+                    # the leader failed or got an uncacheable response, which is not shared
+                    self.count('misses')
+                    return view(*args, **kwargs)
+                entry = flight['entry']
+                cache_status = 'COALESCED'
+        if cache_status in CACHE_COUNTERS:
+            self.count(CACHE_COUNTERS[cache_status])
+
+        # compressed responses carry the ETag as weak
+        if request.if_none_match.contains_weak(entry['etag']):
+            response = Response(status=304)
+        else:
+            response = Response(entry['body'], mimetype=entry['mimetype'])
+        response.set_etag(entry['etag'])
+        response.headers['X-Cache'] = cache_status
+        return response
+
+    def on_question_change(self, action, question, previous=None):
+        self.invalidate('questions')
+
+
+response_cache = LocalProxy(lambda: current_app.extensions['response_cache'])
+
+
+'''
+Decorator caching the responses of a GET view under the given tag, in the cache of the app serving the request
+'''
+def cached(tag):
+    def decorator(view):
+        @wraps(view)
+        def cached_view(*args, **kwargs):
+            return current_app.extensions['response_cache'].serve(tag, view, args, kwargs)
+        return cached_view
+    return decorator
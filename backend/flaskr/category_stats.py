@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from models import add_question_listener
+from .storage import current_storage
+
+
+'''
+CategoryStats
+    question counts per category and per (category, difficulty), loaded with a single GROUP BY
+    query of the storage. The counters are changed by the question listeners, which run once a write is
+    committed, and fully reloaded every CATEGORY_STATS_REFRESH_SECONDS to pick up writes made
+    by other workers. Questions without a category only count in the total.
+    Every app has its own counts in app.extensions['category_stats'], `category_stats` are the ones of the current app
+'''
+class CategoryStats:
+
+    def __init__(self, app):
+        self.refresh_seconds = app.config.get('CATEGORY_STATS_REFRESH_SECONDS', 300)
+        self.lock = threading.Lock()
+        self.reset()
+        app.extensions['category_stats'] = self
+        add_question_listener(app, self.on_question_change)
+
+    def reset(self):
+        self.difficulties = None
+        self.loaded_at = 0
+
+    def is_stale(self):
+        return self.difficulties is None or time.monotonic() - self.loaded_at > self.refresh_seconds
+
+    def load(self):
+        if self.is_stale():
+            with self.lock:
+                if self.is_stale():
+                    # (category, difficulty) -> count, category None holds the uncategorized questions
+                    self.difficulties = Counter(current_storage().difficulty_counts())
+                    self.loaded_at = time.monotonic()
+        return self.difficulties
+
+    '''
+    Reloads the counts, readers keep using the current counts until the query is done
+    '''
+    def reload(self):
+        difficulties = Counter(current_storage().difficulty_counts())
+        with self.lock:
+            self.difficulties = difficulties
+            self.loaded_at = time.monotonic()
+        return sum(difficulties.values())
+
+    '''
+    Returns the number of questions of a category. Category 0 or None stands for all the questions
+    '''
+    def total(self, category_id=None):
+        if not category_id:
+            return sum(count for _, count in list(self.load().items()))
+        return self.category_total(category_id)
+
+    '''
+    Returns the number of questions of a single category, 0 for an unknown category such as 0
+    '''
+    def category_total(self, category_id):
+        return sum(count for (category, _), count in list(self.load().items()) if category == int(category_id))
+
+    '''
+    Returns the difficulty histogram of a category as {difficulty: count}
+    '''
+    def histogram(self, category_id):
+        return {difficulty: count for (category, difficulty), count in list(self.load().items())
+                if category == int(category_id) and count}
+
+    def change(self, question, delta):
+        if self.difficulties is None:
+            return
+        with self.lock:
+            self.difficulties[question['category'], question['difficulty']] += delta
+
+    '''
+    Moves a question from the count of its previous category and difficulty to the one of the question
+    '''
+    def move(self, previous, question):
+        if self.difficulties is None:
+            return
+        with self.lock:
+            self.difficulties[previous['category'], previous['difficulty']] -= 1
+            self.difficulties[question['category'], question['difficulty']] += 1
+
+    def on_question_change(self, action, question, previous=None):
+        if action == 'insert':
+            self.change(question, 1)
+        elif action == 'delete':
+            self.change(question, -1)
+        elif action == 'update':
+            self.move(previous, question)
+        else:
+            # bulk changes are not listed one by one, so reload on next use
+            self.reset()
+
+
+category_stats = LocalProxy(lambda: current_app.extensions['category_stats'])
@@ -0,0 +1,106 @@
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/html', 'text/plain'}
+
+
+'''
+Compressor factories by content coding. Each one receives the compression level and returns
+an object with compress(bytes) and flush() methods, so that streamed bodies are compressed chunk by chunk
+'''
+def gzip_compressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class BrotliCompressor:
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+ENCODINGS = {
+    'gzip': gzip_compressor,
+    'br': BrotliCompressor
+}
+LEVELS = {
+    'gzip': 6,
+    # the higher brotli qualities are meant for static files and are too slow for responses
+    'br': 4
+}
+
+
+'''
+Compression
+    compresses the responses of clients accepting it, with brotli when the brotli package is
+    installed and the client prefers it, or with gzip. Bodies smaller than COMPRESSION_MIN_SIZE bytes
+    are sent as they are, while streamed bodies are compressed as they are sent whatever their size.
+    The ETag of a compressed response becomes weak, since the bytes depend on the encoding.
+    COMPRESSION set to false turns it off
+'''
+class Compression:
+
+    def init_app(self, app):
+        # kept by the app, every app of the process has its own settings
+        app.extensions['compression'] = {
+            'enabled': app.config.get('COMPRESSION', True),
+            'min_size': app.config.get('COMPRESSION_MIN_SIZE', 1024),
+            'levels': dict(LEVELS, **app.config.get('COMPRESSION_LEVELS', {})),
+            'encodings': [encoding for encoding in app.config.get('COMPRESSION_ENCODINGS', ('br', 'gzip'))
+                          if encoding != 'br' or brotli is not None]
+        }
+        app.after_request(self.compress_response)
+
+    def negotiate(self, encodings):
+        accepted = [encoding for encoding in encodings if request.accept_encodings[encoding]]
+        if not accepted:
+            return None
+        # the client's preference first, then the order of COMPRESSION_ENCODINGS
+        return max(accepted, key=lambda encoding: request.accept_encodings[encoding])
+
+    def compress_response(self, response):
+        settings = current_app.extensions['compression']
+        if not settings['enabled'] or response.status_code != 200 or response.direct_passthrough:
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not response.is_streamed and (response.content_length or 0) < settings['min_size']:
+            return response
+        encoding = self.negotiate(settings['encodings'])
+        if encoding is None:
+            return response
+
+        compressor = ENCODINGS[encoding](settings['levels'][encoding])
+        if response.is_streamed:
+            response.response = compress_stream(compressor, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def compress_stream(compressor, chunks):
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+compression = Compression()
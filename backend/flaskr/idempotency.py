@@ -0,0 +1,158 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from flask import abort, current_app, request
+from werkzeug.exceptions import HTTPException
+
+from models import get_setting
+from .sqlite_store import SQLiteStore
+
+MAX_KEY_LENGTH = 255
+# responses that depend on the moment of the request rather than on the request itself are not replayed
+UNSTORED_STATUSES = {409, 429}
+SWEEP_SECONDS = 60
+
+
+'''
+MemoryIdempotencyStore
+    keeps the responses of the requests made with an Idempotency-Key in process memory for ttl seconds.
+    A key is reserved while its first request runs, and holds the fingerprint of the request
+    body with the response once it is done
+'''
+class MemoryIdempotencyStore:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.records = {}
+        self.swept_at = time.monotonic()
+
+    '''
+    Reserves the key and returns None, or returns the record of the key when it is already used:
+    a dict of the fingerprint and of the status, body and mimetype of the response, which are None
+    while the first request runs
+    '''
+    def reserve(self, key, fingerprint):
+        now = time.monotonic()
+        with self.lock:
+            record = self.records.get(key)
+            if record is not None and record['expires_at'] > now:
+                return record
+            self.records[key] = {'fingerprint': fingerprint, 'status': None, 'body': None, 'mimetype': None,
+                                 'expires_at': now + self.ttl}
+            if now - self.swept_at > SWEEP_SECONDS:
+                self.records = {key: record for key, record in self.records.items() if record['expires_at'] > now}
+                self.swept_at = now
+        return None
+
+    def complete(self, key, status, body, mimetype):
+        with self.lock:
+            if key in self.records:
+                self.records[key].update(status=status, body=body, mimetype=mimetype)
+
+    def release(self, key):
+        with self.lock:
+            self.records.pop(key, None)
+
+
+'''
+SQLiteIdempotencyStore
+    keeps the records of MemoryIdempotencyStore in a SQLite file, so that a retry sent
+    to another worker process of the host finds the response of the first request
+'''
+class SQLiteIdempotencyStore(SQLiteStore):
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS idempotency_keys ('
+        'key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER, body BLOB, mimetype TEXT, '
+        'expires_at REAL NOT NULL)',
+    )
+
+    def __init__(self, path, ttl):
+        super().__init__(path)
+        self.ttl = ttl
+
+    def reserve(self, key, fingerprint):
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,))
+            row = connection.execute('SELECT fingerprint, status, body, mimetype FROM idempotency_keys WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is None:
+                connection.execute('INSERT INTO idempotency_keys (key, fingerprint, expires_at) VALUES (?, ?, ?)',
+                                   (key, fingerprint, now + self.ttl))
+        if row is None:
+            return None
+        return dict(zip(('fingerprint', 'status', 'body', 'mimetype'), row))
+
+    def complete(self, key, status, body, mimetype):
+        self.connect().execute('UPDATE idempotency_keys SET status = ?, body = ?, mimetype = ? WHERE key = ?',
+                               (status, body, mimetype, key))
+
+    def release(self, key):
+        self.connect().execute('DELETE FROM idempotency_keys WHERE key = ?', (key,))
+
+
+'''
+Idempotency
+    makes retries of write requests safe. A request sent with an Idempotency-Key header runs once:
+    a retry with the same key, method and path gets the stored response of the first request with
+    an Idempotent-Replayed header, without changing anything again. A retry arriving while the first
+    request runs gets a 409 response, and reusing a key with a different body a 422 response.
+    Responses are kept IDEMPOTENCY_TTL seconds, in memory unless IDEMPOTENCY_BACKEND is 'sqlite',
+    which shares them between the workers of a host through the IDEMPOTENCY_PATH file.
+    Server errors are not kept, so that the request can be retried
+'''
+class Idempotency:
+
+    def init_app(self, app):
+        ttl = get_setting(app.config, 'IDEMPOTENCY_TTL', 86400, int)
+        # kept by the app, every app of the process has its own store
+        if get_setting(app.config, 'IDEMPOTENCY_BACKEND', 'memory', str) == 'sqlite':
+            path = get_setting(app.config, 'IDEMPOTENCY_PATH', 'idempotency.db', str)
+            app.extensions['idempotency'] = SQLiteIdempotencyStore(path, ttl)
+        else:
+            app.extensions['idempotency'] = MemoryIdempotencyStore(ttl)
+
+    '''
+    Decorator making a write view idempotent
+    '''
+    def idempotent(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if key is None:
+                return view(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                abort(422)
+
+            store = current_app.extensions['idempotency']
+            key = '{} {} {}'.format(request.method, request.path, key)
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+            record = store.reserve(key, fingerprint)
+            if record is not None:
+                if record['fingerprint'] != fingerprint:
+                    abort(422)
+                if record['status'] is None:
+                    abort(409)
+                response = current_app.response_class(record['body'], status=record['status'], mimetype=record['mimetype'])
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except HTTPException as error:
+                response = current_app.make_response(current_app.handle_http_exception(error))
+            except:
+                store.release(key)
+                raise
+            if response.status_code >= 500 or response.status_code in UNSTORED_STATUSES:
+                store.release(key)
+            else:
+                store.complete(key, response.status_code, response.get_data(), response.mimetype)
+            return response
+        return wrapper
+
+
+idempotency = Idempotency()
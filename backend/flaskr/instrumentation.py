@@ -0,0 +1,188 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import pool_stats
+from .cache import response_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+'''
+RouteMetrics
+    latency histogram and query counters of one route, in the Prometheus histogram layout
+'''
+class RouteMetrics:
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.n_plus_one = 0
+
+    def observe(self, seconds, queries, query_seconds, n_plus_one):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.queries += queries
+        self.query_seconds += query_seconds
+        self.n_plus_one += n_plus_one
+
+
+'''
+Instrumentation
+    records for every request the number and duration of SQL statements, the time spent
+    serializing JSON and the total handler time. They are sent back in a Server-Timing header
+    and aggregated per route for GET /metrics. A statement repeated N_PLUS_ONE_THRESHOLD times
+    in one request is logged as a probable N+1 query. A PROFILE_SAMPLE_RATE share of the requests
+    runs under cProfile, and the profiles of those slower than PROFILE_SLOW_MS are written to PROFILE_DIR.
+    Everything is off unless the INSTRUMENTATION setting is true. The settings and the route
+    metrics of every app are kept in app.extensions['instrumentation']
+'''
+class Instrumentation:
+
+    def __init__(self):
+        self.listening = False
+
+    def init_app(self, app):
+        if not app.config.get('INSTRUMENTATION', False):
+            return
+        app.extensions['instrumentation'] = {
+            'lock': threading.Lock(),
+            'routes': {},
+            'n_plus_one_threshold': app.config.get('N_PLUS_ONE_THRESHOLD', 5),
+            'profile_sample_rate': app.config.get('PROFILE_SAMPLE_RATE', 0),
+            'profile_slow_ms': app.config.get('PROFILE_SLOW_MS', 500),
+            'profile_dir': app.config.get('PROFILE_DIR', 'profiles')
+        }
+
+        app.json_encoder = timed_encoder(app.json_encoder)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics)
+        if not self.listening:
+            event.listen(Engine, 'before_cursor_execute', self.before_statement)
+            event.listen(Engine, 'after_cursor_execute', self.after_statement)
+            self.listening = True
+
+    def start_request(self):
+        g.instrumented = True
+        g.statements = {}
+        g.query_seconds = 0.0
+        g.serialize_seconds = 0.0
+        g.profiler = None
+        sample_rate = current_app.extensions['instrumentation']['profile_sample_rate']
+        if sample_rate and random.random() < sample_rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+        g.request_started_at = time.perf_counter()
+
+    def before_statement(self, connection, cursor, statement, parameters, context, executemany):
+        if has_request_context() and g.get('instrumented'):
+            connection.info.setdefault('statement_started_at', []).append(time.perf_counter())
+
+    def after_statement(self, connection, cursor, statement, parameters, context, executemany):
+        if has_request_context() and g.get('instrumented'):
+            g.query_seconds += time.perf_counter() - connection.info['statement_started_at'].pop()
+            g.statements[statement] = g.statements.get(statement, 0) + 1
+
+    def finish_request(self, response):
+        if not g.get('instrumented'):
+            return response
+        seconds = time.perf_counter() - g.request_started_at
+        settings = current_app.extensions['instrumentation']
+        if g.profiler:
+            g.profiler.disable()
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        queries = sum(g.statements.values())
+
+        repeated = [statement for statement, count in g.statements.items() if count >= settings['n_plus_one_threshold']]
+        for statement in repeated:
+            current_app.logger.warning('Probable N+1 query in %s %s, ran %d times: %s',
+                                request.method, route, g.statements[statement], statement)
+
+        with settings['lock']:
+            settings['routes'].setdefault((request.method, route), RouteMetrics()) \
+                .observe(seconds, queries, g.query_seconds, len(repeated))
+
+        response.headers['Server-Timing'] = 'db;dur={:.3f};desc="{} queries", serialize;dur={:.3f}, total;dur={:.3f}'.format(
+            1000 * g.query_seconds, queries, 1000 * g.serialize_seconds, 1000 * seconds)
+        if g.profiler and 1000 * seconds >= settings['profile_slow_ms']:
+            self.dump_profile(g.profiler, route, settings['profile_dir'])
+        return response
+
+    def dump_profile(self, profiler, route, profile_dir):
+        os.makedirs(profile_dir, exist_ok=True)
+        name = '{}-{}-{}.prof'.format(int(time.time() * 1000), request.method, route.strip('/').replace('/', '_') or 'root')
+        profiler.dump_stats(os.path.join(profile_dir, name))
+
+    '''
+    Prometheus text exposition of the per-route metrics, the response cache and the database pool
+    '''
+    def metrics(self):
+        lines = [
+            '# HELP trivia_request_duration_seconds Time spent handling requests',
+            '# TYPE trivia_request_duration_seconds histogram'
+        ]
+        settings = current_app.extensions['instrumentation']
+        with settings['lock']:
+            routes = sorted(settings['routes'].items())
+            for (method, route), metrics in routes:
+                labels = 'method="{}",route="{}"'.format(method, route)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), metrics.buckets):
+                    cumulative += count
+                    lines.append('trivia_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+                lines.append('trivia_request_duration_seconds_sum{{{}}} {}'.format(labels, metrics.total_seconds))
+                lines.append('trivia_request_duration_seconds_count{{{}}} {}'.format(labels, metrics.count))
+            for name, attribute, help_text in (
+                    ('trivia_db_queries_total', 'queries', 'SQL statements run by requests'),
+                    ('trivia_db_query_seconds_total', 'query_seconds', 'Time spent in SQL statements'),
+                    ('trivia_n_plus_one_total', 'n_plus_one', 'Statements repeated often enough in a request to be N+1 queries')):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} counter'.format(name))
+                for (method, route), metrics in routes:
+                    lines.append('{}{{method="{}",route="{}"}} {}'.format(name, method, route, getattr(metrics, attribute)))
+
+        cache = response_cache.stats()
+        pool = pool_stats.format()
+        lines += [
+            '# TYPE trivia_cache_hits_total counter',
+            'trivia_cache_hits_total {}'.format(cache['hits']),
+            '# TYPE trivia_cache_misses_total counter',
+            'trivia_cache_misses_total {}'.format(cache['misses']),
+            '# TYPE trivia_db_pool_checkouts_total counter',
+            'trivia_db_pool_checkouts_total {}'.format(pool['checkouts']),
+            '# TYPE trivia_db_pool_max_wait_seconds gauge',
+            'trivia_db_pool_max_wait_seconds {}'.format(pool['max_wait_ms'] / 1000)
+        ]
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+'''
+Returns a subclass of the app JSON encoder that adds its encoding time to the request
+'''
+def timed_encoder(encoder_class):
+    class TimedJSONEncoder(encoder_class):
+
+        def encode(self, o):
+            started_at = time.perf_counter()
+            try:
+                return super().encode(o)
+            finally:
+                if has_request_context() and g.get('instrumented'):
+                    g.serialize_seconds += time.perf_counter() - started_at
+
+    return TimedJSONEncoder
+
+
+instrumentation = Instrumentation()
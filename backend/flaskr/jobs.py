@@ -0,0 +1,449 @@
+import inspect
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.local import LocalProxy
+
+from models import get_setting
+from .storage import current_storage
+from .sqlite_store import SQLiteStore
+from .search import search_index
+from .category_stats import category_stats
+
+JOB_FIELDS = ('id', 'task', 'arguments', 'status', 'attempts', 'max_attempts', 'result', 'error',
+              'created_at', 'started_at', 'finished_at')
+STATUSES = ('queued', 'running', 'succeeded', 'failed')
+MAX_LISTED_JOBS = 100
+SWEEP_SECONDS = 60
+
+'''
+Tasks by name. A task is a function called in an app context with the arguments
+of its job as keyword arguments, and returning a JSON serializable result.
+A task may have a check, called with the same arguments when the job is queued,
+which raises ValueError for arguments of the wrong type
+'''
+TASKS = {}
+CHECKS = {}
+
+
+def task(name, check=None):
+    def decorator(function):
+        TASKS[name] = function
+        if check is not None:
+            CHECKS[name] = check
+        return function
+    return decorator
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+'''
+Reloads by name. A reload rebuilds state kept in the memory of every server process, such as the
+search index, which a job run by a single process could not do. The task of a reload only bumps
+its generation in the queue, and every process runs the reload once it sees the new generation,
+see JobRunner.sync(). A reload is called in an app context and returns a JSON serializable summary
+'''
+RELOADS = {}
+
+
+def reload(name):
+    def decorator(function):
+        RELOADS[name] = function
+        task(name)(lambda: {'generation': jobs.queue.bump_generation(name)})
+        return function
+    return decorator
+
+
+@reload('reindex_search')
+def reindex_search():
+    if current_storage().supports_text_search():
+        return {'indexed_questions': 0}
+    return {'indexed_questions': search_index.rebuild()}
+
+
+@reload('refresh_category_stats')
+def refresh_category_stats():
+    return {'total_questions': category_stats.reload()}
+
+
+def check_delete_questions(ids=(), category=None):
+    if not isinstance(ids, (list, tuple)) or not all(is_int(question_id) for question_id in ids):
+        raise ValueError('ids must be a list of question ids')
+    if category is not None and not is_int(category):
+        raise ValueError('category must be a category id')
+
+
+@task('delete_questions', check_delete_questions)
+def delete_questions(ids=(), category=None):
+    storage = current_storage()
+    question_ids = [int(question_id) for question_id in ids]
+    if category is not None:
+        question_ids += [question_id for question_id, in storage.scan_questions(('id',), int(category))]
+    # one transaction per question, so that the rows are never locked for long
+    deleted = sum(storage.delete_question(question_id) is not None for question_id in dict.fromkeys(question_ids))
+    return {'deleted': deleted}
+
+
+def format_time(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+def format_job(job):
+    if job is None:
+        return None
+    return dict(job, **{field: format_time(job[field]) for field in ('created_at', 'started_at', 'finished_at')})
+
+
+'''
+MemoryJobQueue
+    keeps the jobs in process memory, so they are lost on restart and only run by the workers
+    of the process. Finished jobs are kept ttl seconds
+'''
+class MemoryJobQueue:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.last_id = 0
+        self.generations = {}
+        self.swept_at = time.monotonic()
+
+    def enqueue(self, task, arguments, max_attempts):
+        now = time.time()
+        with self.lock:
+            self.last_id += 1
+            self.jobs[self.last_id] = dict(zip(JOB_FIELDS, (self.last_id, task, arguments, 'queued', 0, max_attempts,
+                                                            None, None, now, None, None)), run_after=now)
+            if time.monotonic() - self.swept_at > SWEEP_SECONDS:
+                self.jobs = {job_id: job for job_id, job in self.jobs.items()
+                             if job['finished_at'] is None or job['finished_at'] > now - self.ttl}
+                self.swept_at = time.monotonic()
+            return self.last_id
+
+    '''
+    Marks the oldest job due to run as running and returns it, or returns None
+    '''
+    def claim(self, lease_seconds):
+        now = time.time()
+        with self.lock:
+            for job in self.jobs.values():
+                if job['status'] == 'queued' and job['run_after'] <= now:
+                    job.update(status='running', attempts=job['attempts'] + 1, started_at=now)
+                    return {field: job[field] for field in JOB_FIELDS}
+        return None
+
+    def complete(self, job_id, result):
+        with self.lock:
+            self.jobs[job_id].update(status='succeeded', result=result, error=None, finished_at=time.time())
+
+    '''
+    Puts a failed job back in the queue until run_after, or marks it failed when run_after is None
+    '''
+    def fail(self, job_id, error, run_after=None):
+        with self.lock:
+            if run_after is None:
+                self.jobs[job_id].update(status='failed', error=error, finished_at=time.time())
+            else:
+                self.jobs[job_id].update(status='queued', error=error, run_after=run_after)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return {field: job[field] for field in JOB_FIELDS} if job is not None else None
+
+    def list(self, status, limit):
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if status is None or job['status'] == status]
+            return [{field: job[field] for field in JOB_FIELDS} for job in jobs[-limit:][::-1]]
+
+    '''
+    Increments the generation of a reload and returns it
+    '''
+    def bump_generation(self, name):
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+            return self.generations[name]
+
+    '''
+    Returns the generation of every reload bumped at least once, by name
+    '''
+    def read_generations(self):
+        with self.lock:
+            return dict(self.generations)
+
+
+'''
+SQLiteJobQueue
+    keeps the jobs in a SQLite file, so that they survive restarts and are shared by the worker
+    processes of a host and the command line. A running job is leased for lease_seconds: when
+    its process dies, it is queued again once the lease expires, or failed after its last attempt
+'''
+class SQLiteJobQueue(SQLiteStore):
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT, task TEXT NOT NULL, arguments TEXT NOT NULL, '
+        'status TEXT NOT NULL, attempts INTEGER NOT NULL, max_attempts INTEGER NOT NULL, result TEXT, '
+        'error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL, run_after REAL NOT NULL, '
+        'locked_until REAL)',
+        'CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, run_after)',
+        'CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, generation INTEGER NOT NULL)'
+    )
+
+    def __init__(self, path, ttl):
+        super().__init__(path)
+        self.ttl = ttl
+
+    def row_job(self, row):
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job['arguments'] = json.loads(job['arguments'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def enqueue(self, task, arguments, max_attempts):
+        now = time.time()
+        connection = self.connect()
+        connection.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at <= ?",
+                           (now - self.ttl,))
+        return connection.execute(
+            "INSERT INTO jobs (task, arguments, status, attempts, max_attempts, created_at, run_after) "
+            "VALUES (?, ?, 'queued', 0, ?, ?, ?)", (task, json.dumps(arguments), max_attempts, now, now)).lastrowid
+
+    def claim(self, lease_seconds):
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = 'the worker running the job stopped', finished_at = ? "
+                "WHERE status = 'running' AND locked_until <= ? AND attempts >= max_attempts", (now, now))
+            connection.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND locked_until <= ?", (now,))
+            row = connection.execute(
+                "SELECT {} FROM jobs WHERE status = 'queued' AND run_after <= ? ORDER BY run_after, id LIMIT 1"
+                .format(', '.join(JOB_FIELDS)), (now,)).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, locked_until = ? "
+                    "WHERE id = ?", (now, now + lease_seconds, row[0]))
+        job = self.row_job(row)
+        if job is not None:
+            job.update(status='running', attempts=job['attempts'] + 1, started_at=now)
+        return job
+
+    def complete(self, job_id, result):
+        self.connect().execute(
+            "UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, finished_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id, error, run_after=None):
+        if run_after is None:
+            self.connect().execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                                   (error, time.time(), job_id))
+        else:
+            self.connect().execute("UPDATE jobs SET status = 'queued', error = ?, run_after = ? WHERE id = ?",
+                                   (error, run_after, job_id))
+
+    def get(self, job_id):
+        return self.row_job(self.connect().execute(
+            'SELECT {} FROM jobs WHERE id = ?'.format(', '.join(JOB_FIELDS)), (job_id,)).fetchone())
+
+    def list(self, status, limit):
+        rows = self.connect().execute(
+            'SELECT {} FROM jobs WHERE ? IS NULL OR status = ? ORDER BY id DESC LIMIT ?'.format(', '.join(JOB_FIELDS)),
+            (status, status, limit)).fetchall()
+        return [self.row_job(row) for row in rows]
+
+    def bump_generation(self, name):
+        with self.transaction() as connection:
+            connection.execute('INSERT OR IGNORE INTO generations (name, generation) VALUES (?, 0)', (name,))
+            connection.execute('UPDATE generations SET generation = generation + 1 WHERE name = ?', (name,))
+            return connection.execute('SELECT generation FROM generations WHERE name = ?', (name,)).fetchone()[0]
+
+    def read_generations(self):
+        return dict(self.connect().execute('SELECT name, generation FROM generations'))
+
+
+'''
+JobRunner
+    runs maintenance tasks off the request path. Jobs are queued in the JOBS_PATH SQLite file,
+    or in memory when JOBS_BACKEND is 'memory', and run by JOBS_WORKERS threads of every server process,
+    which caps how many jobs a process runs at the same time. A failed job is retried up to
+    JOBS_MAX_ATTEMPTS times, waiting JOBS_RETRY_SECONDS before the first retry and twice as long
+    before every next one. Idle workers look for new jobs every JOBS_POLL_SECONDS, or as soon as
+    a job is queued by their process. Finished jobs are kept JOBS_TTL seconds.
+    The same threads, or a single one when JOBS_WORKERS is 0, run the reloads whose generation changed.
+    Every app has its own runner in app.extensions['jobs'], `jobs` is the one of the current app
+'''
+class JobRunner:
+
+    def __init__(self, app):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.app = app
+        self.workers_pid = None
+        self.generations_lock = threading.Lock()
+        # generations of the reloads this process is up to date with, read by its first sync()
+        self.generations = None
+        self.generations_pid = None
+        self.workers = get_setting(app.config, 'JOBS_WORKERS', 2, int)
+        self.max_attempts = get_setting(app.config, 'JOBS_MAX_ATTEMPTS', 3, int)
+        self.retry_seconds = get_setting(app.config, 'JOBS_RETRY_SECONDS', 5.0, float)
+        self.poll_seconds = get_setting(app.config, 'JOBS_POLL_SECONDS', 1.0, float)
+        self.lease_seconds = get_setting(app.config, 'JOBS_LEASE_SECONDS', 600.0, float)
+        ttl = get_setting(app.config, 'JOBS_TTL', 86400, int)
+        if get_setting(app.config, 'JOBS_BACKEND', 'sqlite', str) == 'memory':
+            self.queue = MemoryJobQueue(ttl)
+        else:
+            self.queue = SQLiteJobQueue(get_setting(app.config, 'JOBS_PATH', 'jobs.db', str), ttl)
+        app.extensions['jobs'] = self
+        app.cli.add_command(jobs_cli)
+
+    '''
+    Queues a job and returns it formatted. Raises ValueError for an unknown task or arguments it does not take
+    '''
+    def enqueue(self, task, arguments=None):
+        arguments = arguments or {}
+        if task not in TASKS or not isinstance(arguments, dict):
+            raise ValueError(task)
+        try:
+            inspect.signature(TASKS[task]).bind(**arguments)
+        except TypeError as error:
+            raise ValueError(str(error))
+        if task in CHECKS:
+            CHECKS[task](**arguments)
+        job_id = self.queue.enqueue(task, arguments, self.max_attempts)
+        self.wake.set()
+        return format_job(self.queue.get(job_id))
+
+    def get(self, job_id):
+        return format_job(self.queue.get(job_id))
+
+    '''
+    Runs the next job due to run and returns it once it succeeded, failed or was queued for a retry,
+    or returns None when no job is due
+    '''
+    def run_next(self):
+        app, queue = self.app, self.queue
+        job = queue.claim(self.lease_seconds)
+        if job is None:
+            return None
+        try:
+            with app.app_context():
+                result = TASKS[job['task']](**job['arguments'])
+        except Exception as error:
+            app.logger.exception('Job %d (%s) failed on attempt %d', job['id'], job['task'], job['attempts'])
+            retry = job['attempts'] < job['max_attempts'] and job['task'] in TASKS
+            run_after = time.time() + self.retry_seconds * 2 ** (job['attempts'] - 1) if retry else None
+            queue.fail(job['id'], '{}: {}'.format(type(error).__name__, error), run_after)
+        else:
+            queue.complete(job['id'], result)
+        return queue.get(job['id'])
+
+    '''
+    Runs the reloads whose generation in the queue is newer than the one of this process and returns
+    their names. The first call of a process only reads the generations, its state being loaded already.
+    A failed reload is logged and not retried, the state is still refreshed on its own schedule
+    '''
+    def sync(self):
+        generations = self.queue.read_generations()
+        with self.generations_lock:
+            if self.generations_pid != os.getpid():
+                self.generations, self.generations_pid = generations, os.getpid()
+                return []
+            names = [name for name, generation in generations.items()
+                     if name in RELOADS and generation > self.generations.get(name, 0)]
+            for name in names:
+                try:
+                    with self.app.app_context():
+                        result = RELOADS[name]()
+                except Exception:
+                    self.app.logger.exception('Reload %s (generation %d) failed', name, generations[name])
+                else:
+                    self.app.logger.info('Reload %s (generation %d): %s', name, generations[name], json.dumps(result))
+                self.generations[name] = generations[name]
+        return names
+
+    '''
+    Starts the worker threads, once in every process since threads do not survive a fork.
+    Without workers a single thread is started to run the reloads
+    '''
+    def start(self):
+        if self.workers_pid == os.getpid():
+            return
+        with self.lock:
+            if self.workers_pid == os.getpid():
+                return
+            for number in range(max(self.workers, 1)):
+                threading.Thread(target=self.run_worker, args=(number < self.workers,),
+                                 name='job-worker-{}'.format(number), daemon=True).start()
+            self.workers_pid = os.getpid()
+
+    def run_worker(self, run_jobs=True):
+        while True:
+            try:
+                if run_jobs and self.run_next() is not None:
+                    continue
+                self.sync()
+            except Exception:
+                self.app.logger.exception('Could not read the job queue')
+            self.wake.wait(self.poll_seconds)
+            self.wake.clear()
+
+
+jobs = LocalProxy(lambda: current_app.extensions['jobs'])
+
+
+'''
+# Command line of the job queue, e.g. `flask jobs enqueue delete_questions '{"category": 3}'`
+'''
+jobs_cli = AppGroup('jobs', help='Queue and inspect background jobs.')
+
+
+@jobs_cli.command('enqueue', help='Queues a job, ARGUMENTS being a JSON object of the task arguments.')
+@click.argument('task', type=click.Choice(sorted(TASKS)))
+@click.argument('arguments', default='{}')
+def enqueue_command(task, arguments):
+    try:
+        job = jobs.enqueue(task, json.loads(arguments))
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='ARGUMENTS')
+    click.echo(json.dumps(job))
+
+
+@jobs_cli.command('show', help='Shows a job.')
+@click.argument('job_id', type=int)
+def show_command(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise click.ClickException('job {} not found'.format(job_id))
+    click.echo(json.dumps(job, indent=2))
+
+
+@jobs_cli.command('list', help='Lists the latest jobs, newest first.')
+@click.option('--status', type=click.Choice(STATUSES))
+@click.option('--limit', default=20, type=click.IntRange(1, MAX_LISTED_JOBS))
+def list_command(status, limit):
+    for job in jobs.queue.list(status, limit):
+        click.echo('{id}\t{task}\t{status}\t{attempts}/{max_attempts}\t{created_at}'.format(
+            **dict(job, created_at=format_time(job['created_at']))))
+
+
+@jobs_cli.command('work', help='Runs the queued jobs in this process.')
+@click.option('--burst', is_flag=True, help='Stop once no job is due instead of waiting for new ones.')
+def work_command(burst):
+    while True:
+        job = jobs.run_next()
+        if job is not None:
+            click.echo('{id}\t{task}\t{status}'.format(**job))
+        elif burst:
+            return
+        else:
+            time.sleep(jobs.poll_seconds)
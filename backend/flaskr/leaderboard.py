@@ -0,0 +1,211 @@
+import atexit
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left, insort
+from datetime import datetime
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from models import get_setting
+from .storage import current_storage
+
+# the board ranking every result, the other boards are numbered by category id
+OVERALL_BOARD = 0
+# while the storage refuses the writes, the buffer keeps up to this many batches and drops the oldest results
+MAX_PENDING_BATCHES = 100
+
+
+'''
+TopK
+    the best size players of a leaderboard, each with their best result, kept as a list of
+    (-score, achieved_at, player, questions) tuples in rank order. Since the best result of a
+    player can only improve, a player pushed out of the list can never come back with that result,
+    so the list alone is enough to maintain the exact top players as results arrive
+'''
+class TopK:
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = []
+        self.players = {}
+
+    '''
+    Adds a result, returns whether it changed the leaderboard
+    '''
+    def offer(self, player, score, questions, achieved_at):
+        entry = (-score, achieved_at, player, questions)
+        current = self.players.get(player)
+        if current is not None:
+            if current[0] <= entry[0]:
+                return False
+            del self.entries[bisect_left(self.entries, current)]
+        elif len(self.entries) >= self.size and entry >= self.entries[-1]:
+            return False
+        insort(self.entries, entry)
+        self.players[player] = entry
+        if len(self.entries) > self.size:
+            del self.players[self.entries.pop()[2]]
+        return True
+
+    def format(self, limit):
+        return [{
+            'rank': rank,
+            'player': player,
+            'score': -negative_score,
+            'questions': questions,
+            'achieved_at': achieved_at.isoformat()
+        } for rank, (negative_score, achieved_at, player, questions) in enumerate(self.entries[:limit], 1)]
+
+
+'''
+Leaderboard
+    records the quiz results of an app and ranks the players. Results are added to the in-memory leaderboards
+    at once and to a write buffer, which a background thread writes to the storage of the app in a single
+    transaction every LEADERBOARD_FLUSH_SECONDS, or as soon as it holds LEADERBOARD_FLUSH_SIZE results.
+    The thread stops once the buffer is written and starts again with the next result.
+    Leaderboards keep the best LEADERBOARD_SIZE players and are reloaded from the storage every
+    LEADERBOARD_REFRESH_SECONDS to pick up the results recorded by other workers. Results still in the
+    buffer are lost if the process is killed, the buffer is written when the process exits normally.
+    Every app has its own Leaderboard in app.extensions['leaderboard'], `leaderboard` is the one of the current app
+'''
+class Leaderboard:
+
+    def __init__(self, app):
+        self.app = app
+        self.size = get_setting(app.config, 'LEADERBOARD_SIZE', 100, int)
+        self.flush_size = get_setting(app.config, 'LEADERBOARD_FLUSH_SIZE', 500, int)
+        self.flush_seconds = get_setting(app.config, 'LEADERBOARD_FLUSH_SECONDS', 1.0, float)
+        self.refresh_seconds = get_setting(app.config, 'LEADERBOARD_REFRESH_SECONDS', 10.0, float)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.flusher_pid = None
+        self.pending = []
+        self.flushing = []
+        self.boards = None
+        app.extensions['leaderboard'] = self
+        LEADERBOARDS.add(self)
+
+    def board_keys(self, result):
+        if result['category'] is None:
+            return (OVERALL_BOARD,)
+        return (OVERALL_BOARD, result['category'])
+
+    def offer(self, result):
+        for board in self.board_keys(result):
+            if board not in self.boards:
+                self.boards[board] = TopK(self.size)
+            self.boards[board].offer(result['player'], result['score'], result['questions'], result['created_at'])
+
+    def load(self):
+        boards = current_storage().leaderboard_entries(self.size)
+        with self.lock:
+            self.boards = {}
+            for board, entries in boards.items():
+                top = self.boards[board] = TopK(self.size)
+                for entry in entries:
+                    top.offer(entry['player'], entry['score'], entry['questions'], entry['achieved_at'])
+            # results not written yet are missing from the storage
+            for result in self.flushing + self.pending:
+                self.offer(result)
+            self.loaded_at = time.monotonic()
+
+    '''
+    Records the result of a quiz, category None standing for a quiz on all categories
+    '''
+    def record(self, player, category_id, score, questions):
+        result = {
+            'player': player,
+            'category': category_id,
+            'score': score,
+            'questions': questions,
+            'created_at': datetime.utcnow()
+        }
+        with self.lock:
+            self.pending.append(result)
+            if self.boards is not None:
+                self.offer(result)
+            full = len(self.pending) >= self.flush_size
+        self.start_flusher()
+        if full:
+            self.wake.set()
+
+    '''
+    Returns the best players of a board, up to limit of them
+    '''
+    def top(self, board, limit):
+        if self.boards is None or time.monotonic() - self.loaded_at > self.refresh_seconds:
+            self.load()
+        with self.lock:
+            top = self.boards.get(board)
+            return top.format(limit) if top is not None else []
+
+    '''
+    Writes the buffered results and the leaderboard entries they improve in one transaction.
+    A failed batch is put back in the buffer, to be written with the next one
+    '''
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                self.flushing, self.pending = self.pending, []
+            if not self.flushing:
+                return
+            best = {}
+            for result in self.flushing:
+                for board in self.board_keys(result):
+                    entry = best.get((board, result['player']))
+                    if entry is None or result['score'] > entry['score']:
+                        best[board, result['player']] = {
+                            'board': board,
+                            'player': result['player'],
+                            'score': result['score'],
+                            'questions': result['questions'],
+                            'achieved_at': result['created_at']
+                        }
+            try:
+                with self.app.app_context():
+                    current_storage().record_quiz_results(self.flushing, list(best.values()))
+            except Exception:
+                self.app.logger.exception('Could not write %d quiz results, retrying with the next batch', len(self.flushing))
+                with self.lock:
+                    self.pending = (self.flushing + self.pending)[-self.flush_size * MAX_PENDING_BATCHES:]
+            finally:
+                self.flushing = []
+
+    '''
+    Starts the background thread writing the buffer unless it runs, in every process since threads do not survive a fork
+    '''
+    def start_flusher(self):
+        if self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            threading.Thread(target=self.run_flusher, name='leaderboard-flusher', daemon=True).start()
+            self.flusher_pid = os.getpid()
+
+    def run_flusher(self):
+        while True:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            self.flush()
+            with self.lock:
+                if not self.pending:
+                    self.flusher_pid = None
+                    return
+
+
+# the leaderboards of the apps of the process, written when it exits
+LEADERBOARDS = weakref.WeakSet()
+
+
+@atexit.register
+def flush_leaderboards():
+    for board in list(LEADERBOARDS):
+        board.flush()
+
+
+leaderboard = LocalProxy(lambda: current_app.extensions['leaderboard'])
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .question_index import question_index
+from .category_stats import category_stats
+from .leaderboard import leaderboard
+from .search import search_index
+from .storage import current_storage
+
+
+'''
+load_caches(app)
+    loads the in-memory read caches of the app: question index, category counts, leaderboards, search index
+    and the cached categories response. Returns the milliseconds each one took, by name
+'''
+def load_caches(app):
+    timings = {}
+
+    def timed(name, load):
+        started_at = time.perf_counter()
+        load()
+        timings[name] = round((time.perf_counter() - started_at) * 1000, 3)
+
+    with app.app_context():
+        timed('question_index', question_index.load)
+        timed('category_stats', category_stats.load)
+        timed('leaderboard', leaderboard.load)
+        if not current_storage().supports_text_search():
+            timed('search_index', search_index.load)
+    timed('categories', lambda: app.test_client().get('/categories'))
+    return timings
+
+
+'''
+warm_up(app)
+    loads the read caches before the server forks its workers, so that they start with the caches
+    already loaded and share their memory pages with the master process until they change them.
+    Connections opened by the master are dropped, they must not be shared with the workers
+'''
+def warm_up(app):
+    load_caches(app)
+    dispose_engines(app)
+
+
+'''
+warm_up_in_background(app)
+    loads the read caches in a thread of the process, for the LAZY_INIT mode: the server answers
+    as soon as it started and the requests arriving before the caches are loaded load what they need
+'''
+def warm_up_in_background(app):
+    def run():
+        try:
+            load_caches(app)
+        except Exception:
+            app.logger.exception('Could not load the read caches, they are loaded on first use')
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+'''
+dispose_engines(app)
+    drops the pooled database connections of the app storage, to be called in every forked worker
+    so that it opens its own connections instead of using sockets inherited from the master
+'''
+def dispose_engines(app):
+    app.extensions['storage'].dispose()
+
+
+'''
+# `flask warmup` checks that the database answers and loads the read caches, printing how long each one took
+'''
+@click.command('warmup', help='Checks the database and loads the read caches, printing the milliseconds each took.')
+@with_appcontext
+def warmup_command():
+    started_at = time.perf_counter()
+    if not current_storage().ping():
+        raise click.ClickException('the database cannot be reached')
+    timings = {'database': round((time.perf_counter() - started_at) * 1000, 3)}
+    timings.update(load_caches(current_app._get_current_object()))
+    click.echo(json.dumps(timings))
@@ -0,0 +1,300 @@
+import random
+import threading
+import time
+from array import array
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from models import add_question_listener
+from .storage import current_storage
+
+DRAW_ATTEMPTS = 8
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+# kinds of keys, each with a rank array indexed by question id, see rank_kind()
+RANK_KINDS = ('all', 'category', 'difficulty', 'category_difficulty')
+# weight of a difficulty one step away from the target, two steps away gets its square and so on
+DIFFICULTY_WEIGHT_DECAY = 0.3
+
+
+'''
+QuestionIndex
+    keeps the question ids of every category, and of every (category, difficulty) bucket,
+    in compact int arrays, so that a quiz draw picks an id in memory and only fetches
+    the chosen question from the database.
+    The ids of a category are kept as a random permutation, the shuffle index, with the rank of
+    every id in it, so that a draw takes the next id after the rank of the last asked question.
+    Writes keep the permutations uniformly random by swapping the added or removed id with a
+    random or the last one, without reshuffling. The difficulty buckets keep the rank of every id too,
+    so that a removal moves the last id of the bucket in its place. The arrays are updated by the question listeners on
+    every write and fully reloaded and reshuffled every QUESTION_INDEX_REFRESH_SECONDS to pick up
+    writes made by other workers.
+    Every app has its own index in app.extensions['question_index'], `question_index` is the one of the current app
+'''
+class QuestionIndex:
+
+    def __init__(self, app):
+        self.refresh_seconds = app.config.get('QUESTION_INDEX_REFRESH_SECONDS', 300)
+        self.lock = threading.Lock()
+        self.reset()
+        app.extensions['question_index'] = self
+        add_question_listener(app, self.on_question_change)
+
+    def reset(self):
+        self.categories = None
+        self.buckets = None
+        self.ranks = None
+        self.loaded_at = 0
+
+    def is_stale(self):
+        return self.categories is None or time.monotonic() - self.loaded_at > self.refresh_seconds
+
+    def load(self):
+        if self.is_stale():
+            with self.lock:
+                if self.is_stale():
+                    # None holds the ids of all questions, used when quizzing over every category
+                    categories = {None: array('i')}
+                    buckets = {}
+                    rows = current_storage().scan_questions(('id', 'category', 'difficulty'))
+                    for question_id, category_id, difficulty in rows:
+                        for key in index_keys(category_id):
+                            categories.setdefault(key, array('i')).append(question_id)
+                            buckets.setdefault((key, difficulty), array('i')).append(question_id)
+                    # the rank of every id in the arrays of its keys, indexed by question id since every
+                    # question has a single category and difficulty, so a single key of every kind
+                    ranks = {kind: array('I') for kind in RANK_KINDS}
+                    for key, ids in list(categories.items()) + list(buckets.items()):
+                        if not isinstance(key, tuple):
+                            random.shuffle(ids)
+                        key_ranks = ranks[rank_kind(key)]
+                        grow(key_ranks, max(ids, default=-1))
+                        for rank, question_id in enumerate(ids):
+                            key_ranks[question_id] = rank
+                    self.ranks = ranks
+                    self.categories = categories
+                    self.buckets = buckets
+                    self.loaded_at = time.monotonic()
+        return self.categories
+
+    '''
+    Returns the id array of a category. Category 0 or None stands for all the questions
+    '''
+    def ids(self, category_id=None):
+        key = int(category_id) if category_id else None
+        return self.load().get(key or None, array('i'))
+
+    '''
+    Returns a copy of the ids of a category in an order of its own, shuffled on every call
+    '''
+    def shuffled(self, category_id=None):
+        ids = self.ids(category_id)
+        with self.lock:
+            ids = ids[:]
+        random.shuffle(ids)
+        return ids
+
+    '''
+    Returns the id array of a key, a category or a (category, difficulty) bucket
+    '''
+    def key_ids(self, key):
+        return (self.buckets if isinstance(key, tuple) else self.categories).get(key)
+
+    '''
+    Returns the rank of a question id in the array of a key, None when it is not in it
+    '''
+    def rank(self, key, question_id):
+        key_ranks = self.ranks[rank_kind(key)]
+        ids = self.key_ids(key)
+        if ids is None or not 0 <= question_id < len(key_ranks):
+            return None
+        rank = key_ranks[question_id]
+        return rank if rank < len(ids) and ids[rank] == question_id else None
+
+    '''
+    Picks the question id of the category that follows last_id in its permutation and is not in
+    previous_ids, a set of ids. Without last_id, or when it is not in the category, the draw starts at
+    a random rank. Returns None when every question was asked
+    '''
+    def draw(self, category_id, previous_ids, last_id=None):
+        key = int(category_id) if category_id else None
+        ids = self.ids(category_id)
+        with self.lock:
+            if not ids:
+                return None
+            rank = self.rank(key, last_id) if last_id is not None else None
+            start = rank + 1 if rank is not None else random.randrange(len(ids))
+            for position in range(start, start + len(ids)):
+                question_id = ids[position % len(ids)]
+                if question_id not in previous_ids:
+                    return question_id
+        return None
+
+    '''
+    Picks up to count different question ids of the category that are not in previous_ids,
+    following each other in the permutation after last_id.
+    Returns fewer ids when the category runs out of questions
+    '''
+    def draw_many(self, category_id, previous_ids, count, last_id=None):
+        previous_ids = set(previous_ids)
+        question_ids = []
+        while len(question_ids) < count:
+            last_id = self.draw(category_id, previous_ids, last_id)
+            if last_id is None:
+                break
+            previous_ids.add(last_id)
+            question_ids.append(last_id)
+        return question_ids
+
+    '''
+    Picks a question id of the category that is not in previous_ids, favouring questions close
+    to target_difficulty. A difficulty bucket is chosen with a weight of DIFFICULTY_WEIGHT_DECAY
+    to the power of its distance to the target, then an id is drawn in it like draw() does.
+    Exhausted buckets are left out and the choice repeated. Returns None when every question was asked
+    '''
+    def draw_adaptive(self, category_id, previous_ids, target_difficulty):
+        key = int(category_id) if category_id else None
+        self.load()
+        buckets = {difficulty: ids for (bucket_key, difficulty), ids in list(self.buckets.items())
+                   if bucket_key == key and difficulty is not None and ids}
+        while buckets:
+            difficulties = list(buckets)
+            weights = [DIFFICULTY_WEIGHT_DECAY ** abs(difficulty - target_difficulty) for difficulty in difficulties]
+            difficulty = random.choices(difficulties, weights)[0]
+            question_id = draw_from(buckets.pop(difficulty), previous_ids)
+            if question_id is not None:
+                return question_id
+        return None
+
+    '''
+    Puts the id at a random rank of the array of the key and moves the id found there to the end,
+    one step of the inside-out Fisher-Yates shuffle
+    '''
+    def insert_shuffled(self, key, question_id):
+        if self.rank(key, question_id) is not None:
+            return
+        ids = (self.buckets if isinstance(key, tuple) else self.categories).setdefault(key, array('i'))
+        key_ranks = self.ranks[rank_kind(key)]
+        grow(key_ranks, question_id)
+        rank = random.randrange(len(ids) + 1)
+        if rank < len(ids):
+            ids.append(ids[rank])
+            grow(key_ranks, ids[rank])
+            key_ranks[ids[rank]] = len(ids) - 1
+            ids[rank] = question_id
+        else:
+            ids.append(question_id)
+        key_ranks[question_id] = rank
+
+    '''
+    Removes the id from the array of the key by moving the last id to its rank
+    '''
+    def remove_shuffled(self, key, question_id):
+        rank = self.rank(key, question_id)
+        if rank is None:
+            return
+        ids = self.key_ids(key)
+        last_id = ids.pop()
+        if last_id != question_id:
+            ids[rank] = last_id
+            self.ranks[rank_kind(key)][last_id] = rank
+
+    def add(self, question_id, category_id, difficulty):
+        if self.categories is None:
+            return
+        with self.lock:
+            for key in index_keys(category_id):
+                self.insert_shuffled(key, question_id)
+                self.insert_shuffled((key, difficulty), question_id)
+
+    def discard(self, question_id, category_id, difficulty):
+        if self.categories is None:
+            return
+        with self.lock:
+            for key in index_keys(category_id):
+                self.remove_shuffled(key, question_id)
+                self.remove_shuffled((key, difficulty), question_id)
+
+    '''
+    Removes an id whose category and difficulty are unknown, such as a question deleted by another worker,
+    from every key it is filed under. The rank arrays tell in constant time whether a key holds it
+    '''
+    def forget(self, question_id):
+        if self.categories is None:
+            return
+        with self.lock:
+            for key in list(self.categories) + list(self.buckets):
+                self.remove_shuffled(key, question_id)
+
+    def on_question_change(self, action, question, previous=None):
+        if action == 'insert':
+            self.add(question['id'], question['category'], question['difficulty'])
+        elif action == 'delete':
+            self.discard(question['id'], question['category'], question['difficulty'])
+        elif action == 'update':
+            # only the keys of the previous and the new category and difficulty are touched
+            if (previous['category'], previous['difficulty']) != (question['category'], question['difficulty']):
+                self.discard(question['id'], previous['category'], previous['difficulty'])
+                self.add(question['id'], question['category'], question['difficulty'])
+        else:
+            # bulk changes are not listed one by one, so reload on next use
+            self.reset()
+
+
+'''
+Returns the keys a question of the category is filed under, None stands for all the questions
+'''
+def index_keys(category_id):
+    return (None,) if category_id is None else (None, int(category_id))
+
+
+'''
+Returns the kind of a key, which names its rank array: all the questions, a category,
+and the (category, difficulty) buckets of all the questions or of a category
+'''
+def rank_kind(key):
+    if isinstance(key, tuple):
+        return 'difficulty' if key[0] is None else 'category_difficulty'
+    return 'all' if key is None else 'category'
+
+
+'''
+Extends a rank array with zeros so that it can be indexed by question_id
+'''
+def grow(ranks, question_id):
+    if question_id >= len(ranks):
+        ranks.frombytes(bytes(ranks.itemsize * (question_id + 1 - len(ranks))))
+
+
+'''
+Returns the difficulty the next question should have for a player who answered score of the
+asked questions right, from MIN_DIFFICULTY when none was right to MAX_DIFFICULTY when all were.
+Players start in the middle
+'''
+def target_difficulty(score, asked):
+    if not 0 <= score <= asked:
+        raise ValueError('score must be between 0 and the number of asked questions')
+    accuracy = score / asked if asked else 0.5
+    return MIN_DIFFICULTY + accuracy * (MAX_DIFFICULTY - MIN_DIFFICULTY)
+
+
+'''
+Picks a random id of the array, such as a difficulty bucket, that is not in previous_ids, a set of ids.
+Random probing finds one in a few tries unless most of the ids were already asked,
+only then the remaining ids are listed. Returns None when every id was asked
+'''
+def draw_from(ids, previous_ids):
+    if not ids:
+        return None
+    for _ in range(DRAW_ATTEMPTS):
+        question_id = ids[random.randrange(len(ids))]
+        if question_id not in previous_ids:
+            return question_id
+    remaining_ids = [question_id for question_id in ids if question_id not in previous_ids]
+    if not remaining_ids:
+        return None
+    return random.choice(remaining_ids)
+
+
+question_index = LocalProxy(lambda: current_app.extensions['question_index'])
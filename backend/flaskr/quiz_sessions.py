@@ -0,0 +1,112 @@
+import secrets
+import threading
+import time
+from array import array
+
+from models import get_setting
+from .sqlite_store import SQLiteStore
+
+ID_SIZE = array('i').itemsize
+
+
+'''
+MemorySessionStore
+    keeps each quiz session as a pre-shuffled array of question ids and a cursor.
+    Sessions that were not used for `ttl` seconds are evicted
+'''
+class MemorySessionStore:
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.swept_at = time.monotonic()
+
+    def create(self, question_ids):
+        session_id = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self.lock:
+            if now - self.swept_at > self.ttl:
+                self.sweep(now)
+            self.sessions[session_id] = [array('i', question_ids), 0, now + self.ttl]
+        return session_id
+
+    def sweep(self, now):
+        expired_ids = [session_id for session_id, session in self.sessions.items() if session[2] <= now]
+        for session_id in expired_ids:
+            del self.sessions[session_id]
+        self.swept_at = now
+
+    '''
+    Returns the next question id of the session, or None once every question was served.
+    Raises KeyError for unknown or expired sessions
+    '''
+    def pop(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session[2] <= now:
+                self.sessions.pop(session_id, None)
+                raise KeyError(session_id)
+            question_ids, position, _ = session
+            session[2] = now + self.ttl
+            if position >= len(question_ids):
+                return None
+            session[1] = position + 1
+            return question_ids[position]
+
+
+'''
+SQLiteSessionStore
+    keeps quiz sessions in a SQLite file so that several server processes share them.
+    The shuffled ids are stored as a blob of packed ints and each pop reads only the
+    four bytes at the cursor
+'''
+class SQLiteSessionStore(SQLiteStore):
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS quiz_sessions ('
+        'id TEXT PRIMARY KEY, question_ids BLOB NOT NULL, '
+        'position INTEGER NOT NULL, expires_at REAL NOT NULL)',
+    )
+
+    def __init__(self, path, ttl=3600):
+        super().__init__(path)
+        self.ttl = ttl
+
+    def create(self, question_ids):
+        session_id = secrets.token_urlsafe(16)
+        now = time.time()
+        connection = self.connect()
+        connection.execute('DELETE FROM quiz_sessions WHERE expires_at <= ?', (now,))
+        connection.execute(
+            'INSERT INTO quiz_sessions (id, question_ids, position, expires_at) VALUES (?, ?, 0, ?)',
+            (session_id, array('i', question_ids).tobytes(), now + self.ttl))
+        return session_id
+
+    def pop(self, session_id):
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute(
+                'SELECT substr(question_ids, position * ? + 1, ?), position FROM quiz_sessions '
+                'WHERE id = ? AND expires_at > ?', (ID_SIZE, ID_SIZE, session_id, now)).fetchone()
+            if row is None:
+                raise KeyError(session_id)
+            packed_id, position = row
+            if packed_id:
+                position += 1
+            connection.execute(
+                'UPDATE quiz_sessions SET position = ?, expires_at = ? WHERE id = ?',
+                (position, now + self.ttl, session_id))
+        if not packed_id:
+            return None
+        return array('i', packed_id)[0]
+
+
+'''
+Creates the session store selected by the QUIZ_SESSION_BACKEND setting, 'memory' or 'sqlite'
+'''
+def create_session_store(config):
+    ttl = get_setting(config, 'QUIZ_SESSION_TTL', 3600, int)
+    if get_setting(config, 'QUIZ_SESSION_BACKEND', 'memory', str) == 'sqlite':
+        return SQLiteSessionStore(get_setting(config, 'QUIZ_SESSION_PATH', 'quiz_sessions.db', str), ttl)
+    return MemorySessionStore(ttl)
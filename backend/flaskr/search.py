@@ -0,0 +1,163 @@
+import re
+import threading
+from bisect import bisect_left, insort
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from models import add_question_listener
+from .storage import current_storage
+from .category_stats import category_stats
+
+TOKEN_PATTERN = re.compile(r'\w+')
+EXACT_MATCH_WEIGHT = 2
+PREFIX_MATCH_WEIGHT = 1
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+'''
+InvertedIndex
+    maps every word of the question texts to the ids of the questions containing it.
+    Used to search on databases without full-text search. Search terms match words
+    by prefix, every term has to match, and questions are ranked by how many times the terms
+    occur, exact words counting more than prefixes.
+    Every app has its own index in app.extensions['search_index'], `search_index` is the one of the current app.
+    An index created without an app is not kept up to date, see rebuild()
+'''
+class InvertedIndex:
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.reset()
+        if app is not None:
+            app.extensions['search_index'] = self
+            add_question_listener(app, self.on_question_change)
+
+    def reset(self):
+        self.postings = None
+        self.words = []
+        self.documents = {}
+
+    def load(self):
+        if self.postings is None:
+            with self.lock:
+                if self.postings is None:
+                    self.postings = {}
+                    rows = current_storage().scan_questions(('id', 'question'))
+                    for question_id, question in rows:
+                        self.index_question(question_id, question)
+                    self.words.sort()
+
+    '''
+    Builds a new index and swaps it in, searches keep using the current one meanwhile.
+    Questions written while it is built are picked up by the next rebuild or reload.
+    Returns the number of indexed questions
+    '''
+    def rebuild(self):
+        index = InvertedIndex()
+        index.load()
+        with self.lock:
+            self.postings, self.words, self.documents = index.postings, index.words, index.documents
+        return len(index.documents)
+
+    def index_question(self, question_id, question, keep_sorted=False):
+        tokens = tokenize(question)
+        self.documents[question_id] = (question or '', tokens)
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                if keep_sorted:
+                    insort(self.words, token)
+                else:
+                    self.words.append(token)
+            posting[question_id] = posting.get(question_id, 0) + 1
+
+    def add(self, question_id, question):
+        if self.postings is None:
+            return
+        with self.lock:
+            self.index_question(question_id, question, keep_sorted=True)
+
+    def remove(self, question_id):
+        if self.postings is None:
+            return
+        with self.lock:
+            document = self.documents.pop(question_id, None)
+            if document is None:
+                return
+            for token in set(document[1]):
+                posting = self.postings[token]
+                posting.pop(question_id, None)
+                if not posting:
+                    del self.postings[token]
+                    del self.words[bisect_left(self.words, token)]
+
+    def prefix_scores(self, term):
+        scores = {}
+        position = bisect_left(self.words, term)
+        while position < len(self.words) and self.words[position].startswith(term):
+            word = self.words[position]
+            weight = EXACT_MATCH_WEIGHT if word == term else PREFIX_MATCH_WEIGHT
+            for question_id, count in self.postings[word].items():
+                scores[question_id] = scores.get(question_id, 0) + weight * count
+            position += 1
+        return scores
+
+    '''
+    Returns the ids of the questions matching every term, best matches first
+    and questions of equal rank in alphabetical order
+    '''
+    def search(self, terms):
+        self.load()
+        with self.lock:
+            scores = None
+            for term in terms:
+                term_scores = self.prefix_scores(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {question_id: score + term_scores[question_id]
+                              for question_id, score in scores.items() if question_id in term_scores}
+                if not scores:
+                    return []
+            return sorted(scores, key=lambda question_id: (-scores[question_id], self.documents[question_id][0]))
+
+    def on_question_change(self, action, question, previous=None):
+        if action == 'reload':
+            self.reset()
+            return
+        if action != 'insert':
+            self.remove(question['id'])
+        if action != 'delete':
+            self.add(question['id'], question['question'])
+
+
+search_index = LocalProxy(lambda: current_app.extensions['search_index'])
+
+
+'''
+search_questions(search_term, offset, limit)
+    returns one page of the questions matching the search term and the total number of matches.
+    Storages with a full-text search rank the matches themselves, such as PostgreSQL with the GIN
+    index on to_tsvector('english', question). Other storages use the in-memory inverted index.
+    An empty search term matches every question, a term without any word, such as '!!!', matches none
+'''
+def search_questions(search_term, offset, limit):
+    storage = current_storage()
+    if not (search_term or '').strip():
+        return storage.question_page(offset=offset, limit=limit, order_by='question'), category_stats.total()
+    terms = tokenize(search_term)
+    if not terms:
+        return [], 0
+
+    results = storage.text_search(terms, offset, limit)
+    if results is not None:
+        return results
+
+    question_ids = search_index.search(terms)
+    page_ids = question_ids[offset:offset + limit]
+    return storage.get_questions(page_ids), len(question_ids)
@@ -0,0 +1,109 @@
+import json
+import time
+
+from flask import current_app, g, has_request_context
+
+
+'''
+JSON encoders of the fast response path. Each factory receives the app and returns a function
+turning a payload of plain dicts, lists, strings and numbers into the exact bytes that jsonify
+would produce with the app settings. More encoders can be added to ENCODERS and picked with
+the JSON_FAST_ENCODER setting
+'''
+def jsonify_options(app):
+    if app.config['JSONIFY_PRETTYPRINT_REGULAR'] or app.debug:
+        return {'indent': 2, 'separators': (', ', ': ')}
+    return {'indent': None, 'separators': (',', ':')}
+
+
+def stdlib_encoder(app):
+    options = jsonify_options(app)
+    sort_keys = app.config['JSON_SORT_KEYS']
+    ensure_ascii = app.config['JSON_AS_ASCII']
+
+    def encode(payload):
+        return (json.dumps(payload, sort_keys=sort_keys, ensure_ascii=ensure_ascii, **options) + '\n').encode()
+    return encode
+
+
+def orjson_encoder(app):
+    import orjson
+
+    # orjson always writes UTF-8, so it only matches jsonify for compact output without ASCII escapes
+    if app.config['JSON_AS_ASCII'] or jsonify_options(app)['indent']:
+        app.logger.warning('orjson output differs from jsonify with these settings, using the json module')
+        return stdlib_encoder(app)
+    option = orjson.OPT_SORT_KEYS if app.config['JSON_SORT_KEYS'] else 0
+
+    def encode(payload):
+        return orjson.dumps(payload, option=option) + b'\n'
+    return encode
+
+
+ENCODERS = {
+    'json': stdlib_encoder,
+    'orjson': orjson_encoder
+}
+
+
+# placeholder of the streamed list in the encoded payload, a string no encoder leaves unescaped
+STREAM_PLACEHOLDER = '\x00items\x00'
+STREAM_CHUNK_ITEMS = 100
+
+
+def init_app(app):
+    app.extensions['fast_json_encoder'] = ENCODERS[app.config.get('JSON_FAST_ENCODER', 'json')](app)
+    # pretty printed lists are built whole, since their items are indented by their depth
+    streaming = app.config.get('JSON_STREAMING', True) and not jsonify_options(app)['indent']
+    app.extensions['json_stream_min_items'] = app.config.get('JSON_STREAM_MIN_ITEMS', 200) if streaming else None
+
+
+'''
+fast_jsonify(payload)
+    same response as jsonify(payload) for payloads of plain values, built with the configured fast encoder
+'''
+def fast_jsonify(payload):
+    started_at = time.perf_counter()
+    body = current_app.extensions['fast_json_encoder'](payload)
+    if has_request_context() and g.get('instrumented'):
+        g.serialize_seconds += time.perf_counter() - started_at
+    return current_app.response_class(body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+'''
+stream_jsonify(payload, key, items)
+    same response as fast_jsonify for the payload with the list of items under key, but the items
+    are taken from an iterable and encoded STREAM_CHUNK_ITEMS at a time while the body is sent,
+    so neither the list nor the body are held in memory whole
+'''
+def stream_jsonify(payload, key, items):
+    encode = current_app.extensions['fast_json_encoder']
+    head, tail = encode(dict(payload, **{key: STREAM_PLACEHOLDER})).split(encode(STREAM_PLACEHOLDER)[:-1], 1)
+
+    def generate():
+        yield head + b'['
+        separator = b''
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == STREAM_CHUNK_ITEMS:
+                # the encoded chunk without its brackets and newline
+                yield separator + encode(chunk)[1:-2]
+                separator = b','
+                chunk = []
+        if chunk:
+            yield separator + encode(chunk)[1:-2]
+        yield b']' + tail
+    return current_app.response_class(generate(), mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+'''
+list_jsonify(payload, key, rows)
+    response of the payload with the formatted rows under key. Lists of JSON_STREAM_MIN_ITEMS rows
+    or more are streamed, unless JSON_STREAMING is false
+'''
+def list_jsonify(payload, key, rows):
+    min_items = current_app.extensions['json_stream_min_items']
+    if min_items is None or len(rows) < min_items:
+        return fast_jsonify(dict(payload, **{key: [row.format() for row in rows]}))
+    return stream_jsonify(payload, key, (row.format() for row in rows))
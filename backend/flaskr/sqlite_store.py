@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# seconds a connection waits for the lock of another process before failing
+BUSY_TIMEOUT = 10
+# (store class, path) of the files whose tables were created by this process
+CREATED_TABLES = set()
+
+
+'''
+SQLiteStore
+    base of the stores kept in a SQLite file shared by the worker processes of a host: rate limit
+    buckets, idempotency records, quiz sessions and jobs. Every thread opens its own connection, in
+    autocommit mode and with write-ahead logging, so that readers never wait for a writer.
+    The SCHEMA statements are run by the first connection of the process to the file,
+    so that creating a store does not touch the file
+'''
+class SQLiteStore:
+    SCHEMA = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            key = (type(self), os.path.abspath(self.path))
+            if key not in CREATED_TABLES:
+                for statement in self.SCHEMA:
+                    connection.execute(statement)
+                CREATED_TABLES.add(key)
+            self.local.connection = connection
+        return connection
+
+    '''
+    Runs the block in a transaction holding the write lock of the file from its start,
+    committed when the block ends and rolled back when it raises
+    '''
+    @contextmanager
+    def transaction(self):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
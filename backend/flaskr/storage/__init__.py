@@ -0,0 +1,34 @@
+from urllib.parse import urlparse
+
+from flask import current_app
+
+from .base import Storage, VersionConflict, EDIT_FIELDS
+from .sql import SQLAlchemyStorage, SQLiteStorage
+from .memory import MemoryStorage
+
+'''
+Storage backends by database URL scheme, any other scheme is served by SQLAlchemyStorage
+'''
+BACKENDS = {
+    'sqlite': SQLiteStorage,
+    'memory': MemoryStorage
+}
+
+
+'''
+create_storage(app, database_url)
+    creates the storage backend of the database URL and attaches it to the app
+'''
+def create_storage(app, database_url):
+    scheme = urlparse(database_url).scheme.split('+')[0]
+    storage = BACKENDS.get(scheme, SQLAlchemyStorage)(app, database_url)
+    app.extensions['storage'] = storage
+    return storage
+
+
+'''
+current_storage()
+    returns the storage backend of the current app
+'''
+def current_storage():
+    return current_app.extensions['storage']
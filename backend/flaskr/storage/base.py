@@ -0,0 +1,144 @@
+# the question fields PATCH /questions can change
+EDIT_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+'''
+VersionConflict
+    raised by Storage.update_questions when a question was edited since the version
+    the edit was based on. question_ids lists the conflicting questions
+'''
+class VersionConflict(Exception):
+
+    def __init__(self, question_ids):
+        super().__init__('questions {} were changed by another edit'.format(', '.join(map(str, question_ids))))
+        self.question_ids = question_ids
+
+
+'''
+Storage
+    the contract of a storage backend. Every read and write of categories and questions made
+    by the API goes through these methods, so that the same app runs on PostgreSQL, SQLite or
+    in memory. Questions are returned as models.QuestionRow tuples and categories as formatted
+    dicts. Writes notify the question listeners once they are committed
+'''
+class Storage:
+
+    '''
+    Returns every category as {'id', 'type'}, ordered by type
+    '''
+    def categories(self):
+        raise NotImplementedError
+
+    '''
+    Returns the number of questions of every (category, difficulty) pair
+    '''
+    def difficulty_counts(self):
+        raise NotImplementedError
+
+    '''
+    Returns up to limit questions, optionally of one category and after the id after_id,
+    skipping offset of them. order_by is 'id' or 'question'
+    '''
+    def question_page(self, category_id=None, after_id=None, offset=0, limit=None, order_by='id'):
+        raise NotImplementedError
+
+    '''
+    Returns the questions of a list of ids in their order, ids that do not exist are left out
+    '''
+    def get_questions(self, question_ids):
+        raise NotImplementedError
+
+    '''
+    Returns a question, None when it does not exist
+    '''
+    def get_question(self, question_id):
+        questions = self.get_questions([question_id])
+        return questions[0] if questions else None
+
+    '''
+    Yields a tuple of the named columns for every question, or every question of a category, ordered by id
+    '''
+    def scan_questions(self, columns, category_id=None):
+        raise NotImplementedError
+
+    '''
+    Returns whether text_search() is implemented
+    '''
+    def supports_text_search(self):
+        return False
+
+    '''
+    Returns a page of the questions matching every term and their total count, ranked by the
+    backend, or None when the backend has no full text search and the in-memory index is used instead
+    '''
+    def text_search(self, terms, offset, limit):
+        return None
+
+    '''
+    Adds a question and returns its id. Raises an exception when the values are refused
+    '''
+    def insert_question(self, question, answer, category, difficulty):
+        raise NotImplementedError
+
+    '''
+    Deletes a question and returns it, None when it does not exist
+    '''
+    def delete_question(self, question_id):
+        raise NotImplementedError
+
+    '''
+    Applies a batch of edits in a single transaction and returns the edited questions in
+    their order, as (QuestionRow, version) pairs. Every edit is a dict of the question id, the EDIT_FIELDS to change and
+    optionally the version it is based on. Every edit increments the version of its question.
+    Nothing is changed when an edit fails: raises KeyError for a question that does not
+    exist, VersionConflict when versions do not match and another exception for refused values
+    '''
+    def update_questions(self, edits):
+        raise NotImplementedError
+
+    '''
+    Returns the current version of the questions of a list of ids, as a dict by id
+    '''
+    def question_versions(self, question_ids):
+        raise NotImplementedError
+
+    '''
+    Adds a batch of validated questions, given as dicts, in a single transaction. Raises an exception
+    and adds none of them when one is refused. The listeners are not notified, see bulk.import_questions
+    '''
+    def insert_questions(self, batch):
+        raise NotImplementedError
+
+    '''
+    Adds a batch of quiz results, given as dicts, and stores the leaderboard entries, given as dicts
+    of board, player, score, questions and achieved_at, that beat the stored entry of their player.
+    Both in a single transaction
+    '''
+    def record_quiz_results(self, results, entries):
+        raise NotImplementedError
+
+    '''
+    Returns the best entries of every leaderboard, up to size of them, as {board: [entry]}.
+    Entries rank by score, then by who achieved it first
+    '''
+    def leaderboard_entries(self, size):
+        raise NotImplementedError
+
+    '''
+    Replaces every category and question with the given dicts, keeping their ids.
+    Used to seed test databases and to copy a database into memory
+    '''
+    def load(self, categories, questions):
+        raise NotImplementedError
+
+    '''
+    Returns whether the storage can serve requests
+    '''
+    def ping(self):
+        return True
+
+    '''
+    Drops the open connections, called in forked workers so that they do not share the sockets of their parent
+    '''
+    def dispose(self):
+        pass
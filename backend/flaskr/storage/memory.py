@@ -0,0 +1,265 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from urllib.parse import urlparse
+
+from sqlalchemy import create_engine
+
+from models import get_setting, notify_question_listeners, QuestionRow, Question, Category
+from .base import Storage, VersionConflict, EDIT_FIELDS
+
+# missing categories and difficulties are stored as 0 in the int columns
+NONE = 0
+# the range of the int columns, the one of the integer columns of PostgreSQL
+MIN_INT = -2 ** 31
+MAX_INT = 2 ** 31 - 1
+
+
+'''
+MemoryStorage
+    keeps categories and questions in the memory of the process, with each question column in
+    its own array sorted by id and the ids of every category in a sorted array, so that pages,
+    lookups by id and category filters are slices and binary searches without any database round trip.
+    Databases are named by the URL, memory://<name>, and shared by the apps of the process that use
+    the same name. When MEMORY_STORAGE_SOURCE holds a database URL, an empty database is first
+    copied from it. Writes are not shared with other processes, so this suits read-mostly
+    deployments running a single process, and tests. A write notifies the listeners of the app
+    making it, the other apps sharing the database see it in their read caches once they reload
+'''
+class MemoryStorage(Storage):
+    databases = {}
+    databases_lock = threading.Lock()
+
+    def __new__(cls, app, database_url):
+        name = urlparse(database_url).netloc or urlparse(database_url).path
+        with cls.databases_lock:
+            if name not in cls.databases:
+                storage = super().__new__(cls)
+                storage.lock = threading.RLock()
+                storage.clear()
+                storage.quiz_results = []
+                storage.leaderboard = {}
+                cls.databases[name] = storage
+            return cls.databases[name]
+
+    def __init__(self, app, database_url):
+        source_url = get_setting(app.config, 'MEMORY_STORAGE_SOURCE', None, str)
+        if source_url and not self.ids:
+            self.copy_from(source_url)
+
+    def clear(self):
+        self.category_types = {}
+        self.ids = array('i')
+        self.questions = []
+        self.answers = []
+        self.question_categories = array('i')
+        self.difficulties = array('i')
+        self.versions = array('i')
+        self.category_ids = {}
+        self.text_order = None
+        self.next_id = 1
+
+    def row(self, position):
+        return QuestionRow(self.ids[position], self.questions[position], self.answers[position],
+                           self.question_categories[position] or None, self.difficulties[position] or None)
+
+    def position(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            return position
+        return None
+
+    def categories(self):
+        with self.lock:
+            return [{'id': category_id, 'type': category_type}
+                    for category_id, category_type in sorted(self.category_types.items(), key=lambda item: item[1])]
+
+    def difficulty_counts(self):
+        with self.lock:
+            counts = Counter(zip(self.question_categories, self.difficulties))
+        return {(category_id or None, difficulty or None): count for (category_id, difficulty), count in counts.items()}
+
+    def question_page(self, category_id=None, after_id=None, offset=0, limit=None, order_by='id'):
+        with self.lock:
+            if order_by == 'question':
+                if self.text_order is None:
+                    self.text_order = sorted(range(len(self.ids)), key=lambda position: (self.questions[position] or '', self.ids[position]))
+                positions = [position for position in self.text_order
+                             if category_id is None or self.question_categories[position] == category_id]
+                if after_id is not None:
+                    positions = [position for position in positions if self.ids[position] > after_id]
+                end = None if limit is None else offset + limit
+                return [self.row(position) for position in positions[offset:end]]
+
+            ids = self.ids if category_id is None else self.category_ids.get(int(category_id), array('i'))
+            start = offset + (bisect_right(ids, after_id) if after_id is not None else 0)
+            end = None if limit is None else start + limit
+            page_ids = ids[start:end]
+            if category_id is None:
+                return [self.row(position) for position in range(start, start + len(page_ids))]
+            return [self.row(self.position(question_id)) for question_id in page_ids]
+
+    def get_questions(self, question_ids):
+        with self.lock:
+            positions = [self.position(question_id) for question_id in question_ids]
+            return [self.row(position) for position in positions if position is not None]
+
+    def scan_questions(self, columns, category_id=None):
+        with self.lock:
+            if category_id is None:
+                positions = range(len(self.ids))
+            else:
+                positions = [self.position(question_id) for question_id in self.category_ids.get(int(category_id), ())]
+            rows = [self.row(position) for position in positions]
+        for row in rows:
+            yield tuple(getattr(row, column) for column in columns)
+
+    def insert_question(self, question, answer, category, difficulty):
+        values = self.validate({'question': question, 'answer': answer, 'category': category, 'difficulty': difficulty})
+        with self.lock:
+            question_id = self.append(values)
+        notify_question_listeners('insert', self.get_questions([question_id])[0].format())
+        return question_id
+
+    def delete_question(self, question_id):
+        with self.lock:
+            position = self.position(question_id)
+            if position is None:
+                return None
+            question = self.row(position)
+            for column in (self.ids, self.questions, self.answers, self.question_categories, self.difficulties, self.versions):
+                del column[position]
+            if question.category is not None:
+                category_ids = self.category_ids[question.category]
+                del category_ids[bisect_left(category_ids, question_id)]
+            self.text_order = None
+        notify_question_listeners('delete', question.format())
+        return question
+
+    def update_questions(self, edits):
+        with self.lock:
+            # every edit is checked before the first one is applied, so that a failed batch changes nothing
+            positions = []
+            conflicts = []
+            for edit in edits:
+                position = self.position(edit['id'])
+                if position is None:
+                    raise KeyError(edit['id'])
+                if edit.get('version') is not None and edit['version'] != self.versions[position]:
+                    conflicts.append(edit['id'])
+                positions.append(position)
+            if conflicts:
+                raise VersionConflict(conflicts)
+            # the int values are packed with the others, so that nothing is written before every edit is accepted
+            staged = []
+            for edit, position in zip(edits, positions):
+                question_values = self.validate(dict(self.row(position)._asdict(),
+                                                     **{field: edit[field] for field in EDIT_FIELDS if field in edit}))
+                int_values = array('i', (question_values['category'] or NONE, question_values['difficulty'] or NONE,
+                                         self.versions[position] + 1))
+                staged.append((edit['id'], position, question_values, int_values))
+
+            previous = []
+            for question_id, position, question_values, int_values in staged:
+                previous_category = self.question_categories[position] or None
+                previous.append({'category': previous_category, 'difficulty': self.difficulties[position] or None})
+                if previous_category != question_values['category']:
+                    if previous_category is not None:
+                        category_ids = self.category_ids[previous_category]
+                        del category_ids[bisect_left(category_ids, question_id)]
+                    if question_values['category'] is not None:
+                        insort(self.category_ids.setdefault(question_values['category'], array('i')), question_id)
+                self.questions[position] = question_values['question']
+                self.answers[position] = question_values['answer']
+                self.question_categories[position] = int_values[0]
+                self.difficulties[position] = int_values[1]
+                self.versions[position] = int_values[2]
+            self.text_order = None
+            edited = [(self.row(position), self.versions[position]) for position in positions]
+        for (question, _), previous_values in zip(edited, previous):
+            notify_question_listeners('update', question.format(), previous_values)
+        return edited
+
+    def question_versions(self, question_ids):
+        with self.lock:
+            positions = [self.position(question_id) for question_id in question_ids]
+            return {self.ids[position]: self.versions[position] for position in positions if position is not None}
+
+    def insert_questions(self, batch):
+        batch = [self.validate(values) for values in batch]
+        with self.lock:
+            for values in batch:
+                self.append(values)
+
+    def record_quiz_results(self, results, entries):
+        with self.lock:
+            for result in results:
+                self.quiz_results.append(dict(result, id=len(self.quiz_results) + 1))
+            for entry in entries:
+                stored = self.leaderboard.get((entry['board'], entry['player']))
+                if stored is None or entry['score'] > stored['score']:
+                    self.leaderboard[entry['board'], entry['player']] = dict(entry)
+
+    def leaderboard_entries(self, size):
+        boards = {}
+        with self.lock:
+            for entry in self.leaderboard.values():
+                boards.setdefault(entry['board'], []).append(entry)
+        return {board: sorted(entries, key=lambda entry: (-entry['score'], entry['achieved_at'], entry['player']))[:size]
+                for board, entries in boards.items()}
+
+    def load(self, categories, questions):
+        with self.lock:
+            self.clear()
+            self.category_types = {category['id']: category['type'] for category in categories}
+            for values in sorted(questions, key=lambda values: values['id']):
+                self.append(self.validate(values), values['id'], values.get('version') or 1)
+        notify_question_listeners('reload', None)
+
+    def copy_from(self, source_url):
+        engine = create_engine(source_url)
+        with engine.connect() as connection:
+            categories = [dict(row) for row in connection.execute(Category.__table__.select())]
+            questions = [dict(row) for row in connection.execute(Question.__table__.select())]
+        engine.dispose()
+        self.load(categories, questions)
+
+    '''
+    Checks the values of a question like the database constraints do and converts them
+    '''
+    def validate(self, values):
+        category = values.get('category')
+        difficulty = values.get('difficulty')
+        category = int(category) if category is not None else None
+        difficulty = int(difficulty) if difficulty is not None else None
+        for name, value in (('category', category), ('difficulty', difficulty)):
+            if value is not None and not MIN_INT <= value <= MAX_INT:
+                raise ValueError('{} {} is out of range'.format(name, value))
+        if category is not None and category not in self.category_types:
+            raise ValueError('unknown category {}'.format(category))
+        return {
+            'question': values.get('question'),
+            'answer': values.get('answer'),
+            'category': category,
+            'difficulty': difficulty
+        }
+
+    def append(self, values, question_id=None, version=1):
+        if question_id is None:
+            question_id = self.next_id
+        if self.ids and question_id <= self.ids[-1]:
+            raise ValueError('question ids must be appended in increasing order')
+        # the int values are packed before any column changes, so that a refused value leaves the columns aligned
+        int_values = array('i', (question_id, values['category'] or NONE, values['difficulty'] or NONE, version))
+        self.ids.append(int_values[0])
+        self.questions.append(values['question'])
+        self.answers.append(values['answer'])
+        self.question_categories.append(int_values[1])
+        self.difficulties.append(int_values[2])
+        self.versions.append(int_values[3])
+        if values['category'] is not None:
+            self.category_ids.setdefault(values['category'], array('i')).append(question_id)
+        self.text_order = None
+        self.next_id = question_id + 1
+        return question_id
@@ -0,0 +1,259 @@
+import csv
+import io
+
+from sqlalchemy import DateTime, bindparam, event, func, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+import models
+from models import db, read_session, query_question_rows, question_rows, get_question_rows, \
+    notify_question_listeners, Question, QuestionRow, Category, QuizResult, LeaderboardEntry
+from .base import Storage, VersionConflict, EDIT_FIELDS
+
+COPY_FIELDS = ('question', 'answer', 'category', 'difficulty')
+ENTRY_FIELDS = ('board', 'player', 'score', 'questions', 'achieved_at')
+# supported by PostgreSQL and SQLite, an entry only replaces a lower score of its player
+UPSERT_LEADERBOARD = text(
+    'INSERT INTO leaderboard (board, player, score, questions, achieved_at) '
+    'VALUES (:board, :player, :score, :questions, :achieved_at) '
+    'ON CONFLICT (board, player) DO UPDATE SET score = excluded.score, questions = excluded.questions, '
+    'achieved_at = excluded.achieved_at WHERE excluded.score > leaderboard.score'
+).bindparams(bindparam('achieved_at', type_=DateTime))
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+    # negative sizes are in kilobytes
+    ('cache_size', -65536),
+    ('mmap_size', 268435456)
+)
+
+
+'''
+SQLAlchemyStorage
+    stores categories and questions in a database through the Flask-SQLAlchemy models.
+    Reads go to the read replica when one is configured. PostgreSQL also runs the full text search
+'''
+class SQLAlchemyStorage(Storage):
+
+    def __init__(self, app, database_url):
+        self.app = app
+        models.setup_db(app, database_url)
+
+    def categories(self):
+        return [category.format() for category in read_session().query(Category).order_by(Category.type)]
+
+    def difficulty_counts(self):
+        rows = read_session().query(Question.category, Question.difficulty, func.count(Question.id)) \
+            .group_by(Question.category, Question.difficulty)
+        return {(category_id, difficulty): count for category_id, difficulty, count in rows}
+
+    def question_page(self, category_id=None, after_id=None, offset=0, limit=None, order_by='id'):
+        selection = query_question_rows()
+        if category_id is not None:
+            selection = selection.filter(Question.category == category_id)
+        if after_id is not None:
+            selection = selection.filter(Question.id > after_id)
+        if order_by == 'question':
+            selection = selection.order_by(Question.question, Question.id)
+        else:
+            selection = selection.order_by(Question.id)
+        return question_rows(selection.offset(offset or None).limit(limit))
+
+    def get_questions(self, question_ids):
+        return get_question_rows(question_ids)
+
+    def scan_questions(self, columns, category_id=None, chunk_size=10000):
+        selection = read_session().query(*[getattr(Question, column) for column in columns])
+        if category_id is not None:
+            selection = selection.filter(Question.category == category_id)
+        return iter(selection.order_by(Question.id).execution_options(stream_results=True).yield_per(chunk_size))
+
+    def supports_text_search(self):
+        return db.engine.dialect.name == 'postgresql'
+
+    def text_search(self, terms, offset, limit):
+        if not self.supports_text_search():
+            return None
+        document = func.to_tsvector('english', Question.question)
+        query = func.to_tsquery('english', ' & '.join(term + ':*' for term in terms))
+        selection = query_question_rows().filter(document.op('@@')(query))
+        questions = question_rows(selection.order_by(func.ts_rank(document, query).desc(), Question.question)
+                                  .offset(offset).limit(limit))
+        return questions, selection.count()
+
+    def insert_question(self, question, answer, category, difficulty):
+        new_question = Question(question=question, answer=answer, category=category, difficulty=difficulty)
+        new_question.insert()
+        return new_question.id
+
+    def returning(self):
+        return db.engine.dialect.name == 'postgresql'
+
+    def delete_question(self, question_id):
+        table = Question.__table__
+        columns = question_columns()
+        statement = table.delete().where(table.c.id == question_id)
+        try:
+            if self.returning():
+                # a single round trip deletes the question and returns it
+                row = db.session.execute(statement.returning(*columns)).fetchone()
+            else:
+                row = db.session.execute(select(columns).where(table.c.id == question_id)).fetchone()
+                if row is not None:
+                    db.session.execute(statement)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if row is None:
+            return None
+        question = QuestionRow._make(row)
+        notify_question_listeners('delete', question.format())
+        return question
+
+    def update_questions(self, edits):
+        table = Question.__table__
+        columns = question_columns() + [table.c.version]
+        rows = {}
+        conflicts = []
+        try:
+            # the category and difficulty before the edits, for the question listeners
+            previous = {row.id: {'category': row.category, 'difficulty': row.difficulty} for row in db.session.execute(
+                select([table.c.id, table.c.category, table.c.difficulty])
+                .where(table.c.id.in_([edit['id'] for edit in edits])).with_for_update())}
+            for edit in edits:
+                statement = table.update().where(table.c.id == edit['id']) \
+                    .values(version=table.c.version + 1, **{field: edit[field] for field in EDIT_FIELDS if field in edit})
+                if edit.get('version') is not None:
+                    statement = statement.where(table.c.version == edit['version'])
+                if self.returning():
+                    row = db.session.execute(statement.returning(*columns)).fetchone()
+                    if row is not None:
+                        rows[row.id] = row
+                        continue
+                elif db.session.execute(statement).rowcount:
+                    continue
+                if db.session.execute(select([table.c.id]).where(table.c.id == edit['id'])).fetchone() is None:
+                    raise KeyError(edit['id'])
+                conflicts.append(edit['id'])
+            if conflicts:
+                raise VersionConflict(conflicts)
+            if not self.returning():
+                edited_ids = [edit['id'] for edit in edits]
+                rows = {row.id: row for row in db.session.execute(select(columns).where(table.c.id.in_(edited_ids)))}
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        edited = [(QuestionRow._make(rows[edit['id']][:-1]), rows[edit['id']][-1]) for edit in edits]
+        for question, _ in edited:
+            notify_question_listeners('update', question.format(), previous[question.id])
+        return edited
+
+    def question_versions(self, question_ids):
+        table = Question.__table__
+        # read from the primary database, replicas may return a version that is already outdated
+        rows = db.session.execute(select([table.c.id, table.c.version]).where(table.c.id.in_(question_ids)))
+        return dict(rows.fetchall())
+
+    def insert_questions(self, batch):
+        try:
+            connection = db.session.connection()
+            if connection.dialect.name == 'postgresql':
+                # COPY is several times faster than multi-row inserts on PostgreSQL
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for values in batch:
+                    writer.writerow([values[field] for field in COPY_FIELDS])
+                buffer.seek(0)
+                cursor = connection.connection.cursor()
+                cursor.copy_expert('COPY questions (question, answer, category, difficulty) FROM STDIN WITH (FORMAT csv)', buffer)
+            else:
+                connection.execute(Question.__table__.insert(), batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def record_quiz_results(self, results, entries):
+        try:
+            if results:
+                db.session.execute(QuizResult.__table__.insert(), results)
+            if entries:
+                db.session.execute(UPSERT_LEADERBOARD, entries)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def leaderboard_entries(self, size):
+        table = LeaderboardEntry.__table__
+        rank = func.row_number().over(partition_by=table.c.board,
+                                      order_by=(table.c.score.desc(), table.c.achieved_at, table.c.player))
+        ranked = select([table.c[field] for field in ENTRY_FIELDS] + [rank.label('rank')]).alias('ranked')
+        rows = read_session().execute(select([ranked.c[field] for field in ENTRY_FIELDS])
+                                      .where(ranked.c.rank <= size).order_by(ranked.c.board, ranked.c.rank))
+        boards = {}
+        for row in rows:
+            boards.setdefault(row.board, []).append(dict(zip(ENTRY_FIELDS, row)))
+        return boards
+
+    def load(self, categories, questions):
+        db.create_all()
+        db.session.execute(Question.__table__.delete())
+        db.session.execute(Category.__table__.delete())
+        if categories:
+            db.session.execute(Category.__table__.insert(), categories)
+        if questions:
+            db.session.execute(Question.__table__.insert(), questions)
+        if db.engine.dialect.name == 'postgresql':
+            for table in ('categories', 'questions'):
+                db.session.execute(text("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                                        "coalesce(max(id), 0) + 1, false) FROM {0}".format(table)))
+        db.session.commit()
+        notify_question_listeners('reload', None)
+
+    def ping(self):
+        try:
+            read_session().execute('SELECT 1')
+            return True
+        except SQLAlchemyError:
+            return False
+
+    def dispose(self):
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+            for bind in self.app.config.get('SQLALCHEMY_BINDS') or {}:
+                db.get_engine(self.app, bind=bind).dispose()
+
+
+'''
+SQLiteStorage
+    SQLAlchemyStorage for a SQLite file. Every connection is set up with SQLITE_PRAGMAS:
+    write-ahead logging lets readers run while a write is in progress, and the larger page
+    cache and memory mapping keep the hot pages in memory
+'''
+class SQLiteStorage(SQLAlchemyStorage):
+
+    def __init__(self, app, database_url):
+        super().__init__(app, database_url)
+        with app.app_context():
+            engine = db.get_engine(app)
+            # engines are shared by the apps of the process
+            if not event.contains(engine, 'connect', set_sqlite_pragmas):
+                event.listen(engine, 'connect', set_sqlite_pragmas)
+
+
+def question_columns():
+    table = Question.__table__
+    return [table.c.id, table.c.question, table.c.answer, table.c.category, table.c.difficulty]
+
+
+def set_sqlite_pragmas(connection, connection_record):
+    cursor = connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
@@ -0,0 +1,42 @@
+'''
+Gunicorn settings of the trivia API, see "Running the server in production" in the README.
+Every setting can be changed with the environment variable in brackets
+'''
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+# [WEB_CONCURRENCY] one worker per core by default
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# [GUNICORN_THREADS] requests served at the same time by each worker
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# [MAX_REQUESTS] a worker is replaced after this many requests, 0 never replaces it
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+# [MAX_REQUESTS_JITTER] so that the workers are not all replaced at the same time
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 1000))
+# [GRACEFUL_TIMEOUT] seconds given to a stopping worker to finish its requests
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+
+# the app and its caches are loaded once in the master and shared by the forked workers
+preload_app = True
+accesslog = '-'
+
+
+def when_ready(server):
+    # objects loaded until now are kept out of the garbage collector, which would otherwise
+    # write to their memory pages and copy them into every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from flaskr.prefork import dispose_engines, warm_up_in_background
+    from models import get_setting
+    from wsgi import app
+    dispose_engines(app)
+    # [LAZY_INIT] the master did not load the caches, every worker loads them while it serves
+    if get_setting(app.config, 'LAZY_INIT', False, bool):
+        warm_up_in_background(app)
+    # queued jobs run in the workers, the master only forks them
+    app.extensions['jobs'].start()
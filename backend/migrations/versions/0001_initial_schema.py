@@ -0,0 +1,45 @@
+"""initial schema
+
+Creates the categories and questions tables as defined in trivia.psql.
+Databases restored from trivia.psql already have them and are left unchanged.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'categories' not in existing_tables:
+        op.create_table(
+            'categories',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('type', sa.Text()),
+        )
+    if 'questions' not in existing_tables:
+        op.create_table(
+            'questions',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('question', sa.Text()),
+            sa.Column('answer', sa.Text()),
+            sa.Column('difficulty', sa.Integer()),
+            sa.Column('category', sa.Integer()),
+            sa.ForeignKeyConstraint(['category'], ['categories.id'], name='category',
+                                    onupdate='CASCADE', ondelete='SET NULL'),
+        )
+
+
+def downgrade():
+    op.drop_table('questions')
+    op.drop_table('categories')
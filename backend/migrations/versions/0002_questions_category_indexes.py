@@ -0,0 +1,44 @@
+"""questions category foreign key and indexes
+
+Tables created by db.create_all() declared questions.category as a string without
+a foreign key. This turns it into an integer referencing categories and adds the
+indexes used by category listings, quiz draws and difficulty filters.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    category_column = next(column for column in inspector.get_columns('questions') if column['name'] == 'category')
+    has_category_fk = any(foreign_key['constrained_columns'] == ['category']
+                          for foreign_key in inspector.get_foreign_keys('questions'))
+
+    with op.batch_alter_table('questions') as batch_op:
+        if not isinstance(category_column['type'], sa.Integer):
+            batch_op.alter_column('category', type_=sa.Integer(), existing_type=category_column['type'],
+                                  postgresql_using='category::integer')
+        if not has_category_fk:
+            batch_op.create_foreign_key('category', 'categories', ['category'], ['id'],
+                                        onupdate='CASCADE', ondelete='SET NULL')
+
+    # the (category, id) index also serves filters on category alone
+    op.create_index('ix_questions_category_id', 'questions', ['category', 'id'])
+    op.create_index('ix_questions_difficulty', 'questions', ['difficulty'])
+
+
+def downgrade():
+    op.drop_index('ix_questions_difficulty', table_name='questions')
+    op.drop_index('ix_questions_category_id', table_name='questions')
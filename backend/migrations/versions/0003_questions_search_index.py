@@ -0,0 +1,29 @@
+"""questions full-text search index
+
+Adds the GIN index serving the full-text search of POST /questions/search on PostgreSQL.
+Other databases search with the in-memory index and need no change.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE INDEX IF NOT EXISTS questions_question_search "
+                   "ON questions USING gin (to_tsvector('english'::regconfig, question))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS questions_question_search')
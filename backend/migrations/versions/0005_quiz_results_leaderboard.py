@@ -0,0 +1,47 @@
+"""quiz results and leaderboard
+
+Adds the quiz_results table recording the scores sent to POST /quizzes/results and the
+leaderboard table holding the best result of every player on every leaderboard.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'quiz_results',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('player', sa.String(64), nullable=False),
+        sa.Column('category', sa.Integer()),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.Column('questions', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['category'], ['categories.id'], onupdate='CASCADE', ondelete='SET NULL'),
+    )
+    op.create_table(
+        'leaderboard',
+        sa.Column('board', sa.Integer(), primary_key=True),
+        sa.Column('player', sa.String(64), primary_key=True),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.Column('questions', sa.Integer(), nullable=False),
+        sa.Column('achieved_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_leaderboard_rank', 'leaderboard', ['board', 'score', 'achieved_at'])
+
+
+def downgrade():
+    op.drop_index('ix_leaderboard_rank', table_name='leaderboard')
+    op.drop_table('leaderboard')
+    op.drop_table('quiz_results')
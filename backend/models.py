@@ -1,35 +1,174 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+import time
+from collections import namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, create_engine, inspect
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 import json
 
 database_name = "trivia"
-database_path = "postgresql://{}/{}".format('postgres:postgres@localhost:5432', database_name)
+database_path = os.environ.get(
+    'DATABASE_URL', "postgresql://{}/{}".format('postgres:postgres@localhost:5432', database_name))
 
-db = SQLAlchemy()
+'''
+SharedEngineSQLAlchemy
+    creates a single engine, and so a single connection pool, for every database URL and engine options
+    of the process. Apps created one after the other, such as one per test, reuse the connections
+    of the previous ones instead of connecting again
+'''
+class SharedEngineSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engines = {}
+        self.engines_lock = threading.Lock()
+
+    def create_engine(self, sa_url, engine_opts):
+        key = (str(sa_url), repr(sorted(engine_opts.items())))
+        with self.engines_lock:
+            if key not in self.engines:
+                self.engines[key] = super().create_engine(sa_url, engine_opts)
+            return self.engines[key]
+
+db = SharedEngineSQLAlchemy()
+
+'''
+Question listeners
+    functions called after a question is committed, registered by every app in
+    app.extensions['question_listeners']. Each one receives the action name
+    ('insert', 'update' or 'delete'), the formatted question and, for an update, the
+    category and difficulty the question had before as {'category': ..., 'difficulty': ...}.
+    After bulk changes the action is 'reload' and the question is None. A write notifies
+    the listeners of the current app only, so that every app keeps the read caches of its own database
+'''
+def add_question_listener(app, listener):
+    app.extensions.setdefault('question_listeners', []).append(listener)
+
+def notify_question_listeners(action, question, previous=None):
+    if not has_app_context():
+        return
+    for listener in current_app.extensions.get('question_listeners', ()):
+        listener(action, question, previous)
+
+'''
+PoolStats
+    counts connection checkouts and the time spent waiting for a connection from the pool
+'''
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def format(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'average_wait_ms': round(1000 * self.total_wait / self.checkouts, 3) if self.checkouts else 0,
+                'max_wait_ms': round(1000 * self.max_wait, 3)
+            }
+
+pool_stats = PoolStats()
+
+class TimedQueuePool(QueuePool):
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record(time.perf_counter() - started_at)
+
+'''
+Database settings, read from the app config first, then from the environment
+'''
+def get_setting(config, name, default, cast=int):
+    if name in config:
+        return config[name]
+    if name in os.environ:
+        if cast is bool:
+            return os.environ[name].lower() in ('1', 'true', 'yes')
+        return cast(os.environ[name])
+    return default
+
+'''
+Builds the engine options of a database URL: pool size and overflow, connection recycling,
+pre-ping to drop connections broken by a failover, and a statement timeout on PostgreSQL
+'''
+def get_engine_options(config, database_path):
+    options = {
+        'pool_pre_ping': get_setting(config, 'DB_POOL_PRE_PING', True, bool),
+        'pool_recycle': get_setting(config, 'DB_POOL_RECYCLE', 1800)
+    }
+    if not database_path.startswith('sqlite'):
+        options.update({
+            'poolclass': TimedQueuePool,
+            'pool_size': get_setting(config, 'DB_POOL_SIZE', 5),
+            'max_overflow': get_setting(config, 'DB_MAX_OVERFLOW', 10),
+            'pool_timeout': get_setting(config, 'DB_POOL_TIMEOUT', 30)
+        })
+    statement_timeout = get_setting(config, 'DB_STATEMENT_TIMEOUT', 0)
+    if statement_timeout and database_path.startswith('postgresql'):
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(statement_timeout)}
+    return options
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service and returns the service.
+    When DATABASE_REPLICA_URL is set, read_session() queries go to that read replica.
+    The schema is managed by the Alembic migrations, run `alembic upgrade head` to create or update it
 '''
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(app.config, database_path)
+    replica_path = get_setting(app.config, 'DATABASE_REPLICA_URL', None, str)
+    if replica_path:
+        app.config["SQLALCHEMY_BINDS"] = {'replica': replica_path}
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+    app.extensions.pop('replica_session', None)
+    if replica_path:
+        replica_session = db.create_scoped_session({'bind': db.get_engine(app, bind='replica'), 'binds': {}})
+        app.extensions['replica_session'] = replica_session
+        app.teardown_appcontext(lambda exception: replica_session.remove())
+    return db
+
+'''
+read_session()
+    returns the session of the read replica if the app has one, otherwise the primary session
+'''
+def read_session():
+    return current_app.extensions.get('replica_session', db.session)
 
 '''
 Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_difficulty', 'difficulty'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
+  # incremented by every edit, see Storage.update_questions
+  version = Column(Integer, nullable=False, default=1, server_default='1')
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
@@ -40,13 +179,37 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    notify_question_listeners('insert', self.format())
   
   def update(self):
+    state = inspect(self)
+    previous = {field: (state.attrs[field].history.deleted or [getattr(self, field)])[0]
+                for field in ('category', 'difficulty')}
     db.session.commit()
+    notify_question_listeners('update', self.format(), previous)
 
   def delete(self):
+    formatted_question = self.format()
     db.session.delete(self)
     db.session.commit()
+    notify_question_listeners('delete', formatted_question)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'question': self.question,
+      'answer': self.answer,
+      'category': self.category,
+      'difficulty': self.difficulty
+    }
+
+'''
+QuestionRow
+    a question read as a plain tuple of its columns. Read endpoints load these instead of
+    Question objects to skip the ORM identity map and per-attribute bookkeeping, writes go through Question
+'''
+class QuestionRow(namedtuple('QuestionRow', ['id', 'question', 'answer', 'category', 'difficulty'])):
+  __slots__ = ()
 
   def format(self):
     return {
@@ -57,6 +220,29 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+'''
+query_question_rows()
+    returns a query of the QuestionRow columns on the read session, to be filtered and ordered
+'''
+def query_question_rows():
+    return read_session().query(Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+
+'''
+question_rows(query)
+    runs a query built by query_question_rows() without the ORM and returns its QuestionRows
+'''
+def question_rows(query):
+    # fetchall() skips the per-row fetchone() calls of iterating the result
+    return list(map(QuestionRow._make, query.session.execute(query.statement).fetchall()))
+
+'''
+get_question_rows(question_ids)
+    returns the QuestionRows of a list of ids in their order with a single IN query, ids that do not exist are left out
+'''
+def get_question_rows(question_ids):
+    questions_by_id = {question.id: question for question in question_rows(query_question_rows().filter(Question.id.in_(question_ids)))}
+    return [questions_by_id[question_id] for question_id in question_ids if question_id in questions_by_id]
+
 '''
 Category
 
@@ -74,4 +260,45 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+QuizResult
+    the score of a finished quiz. category is None for quizzes played on all categories
+'''
+class QuizResult(db.Model):
+  __tablename__ = 'quiz_results'
+
+  id = Column(Integer, primary_key=True)
+  player = Column(String(64), nullable=False)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
+  score = Column(Integer, nullable=False)
+  questions = Column(Integer, nullable=False)
+  created_at = Column(DateTime, nullable=False)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'player': self.player,
+      'category': self.category,
+      'score': self.score,
+      'questions': self.questions,
+      'created_at': self.created_at.isoformat()
+    }
+
+'''
+LeaderboardEntry
+    the best result of a player on a leaderboard. Board 0 ranks every result and the
+    other boards the results of the quizzes played on the category of the same id
+'''
+class LeaderboardEntry(db.Model):
+  __tablename__ = 'leaderboard'
+  __table_args__ = (
+    Index('ix_leaderboard_rank', 'board', 'score', 'achieved_at'),
+  )
+
+  board = Column(Integer, primary_key=True)
+  player = Column(String(64), primary_key=True)
+  score = Column(Integer, nullable=False)
+  questions = Column(Integer, nullable=False)
+  achieved_at = Column(DateTime, nullable=False)
@@ -1,36 +1,64 @@
 import os
+import shutil
+import tempfile
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+import gzip
+import asyncio
+from flask import jsonify
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.asgi import AsgiApp, asgi_request
+from flaskr.storage import current_storage
+from flaskr.jobs import task, TASKS
 
 new_question_id = None
+# holds the job queue of the test apps, so that the tests leave no jobs.db behind
+jobs_directory = None
+
+
+def setUpModule():
+    global jobs_directory
+    jobs_directory = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(jobs_directory)
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
+    database_name = "trivia_test"
+    database_path = "postgresql://{}/{}".format('postgres:postgres@localhost:5432', database_name)
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        # one queue per test case, whose workers reload from its database only
+        self.jobs_path = os.path.join(jobs_directory, '{}.db'.format(type(self).__name__))
+        self.app = create_app({'DATABASE_URL': self.database_path, 'JOBS_PATH': self.jobs_path})
         self.client = self.app.test_client()
-        self.database_name = "trivia_test"
-        self.database_path = "postgresql://{}/{}".format('postgres:postgres@localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
 
     def tearDown(self):
         """Executed after reach test"""
         pass
 
+    def stored_questions(self, category_id=None):
+        """Returns the stored questions ordered by id, read through the export endpoint"""
+        questions = [json.loads(line) for line in self.client.get('/questions/export').data.splitlines()]
+        return [question for question in questions if category_id is None or question["category"] == category_id]
+
+    def finished_job(self, client, job_id):
+        """Returns the job once it succeeded or failed, polling GET /jobs/<job_id>"""
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            job = json.loads(client.get('/jobs/{}'.format(job_id)).data)["job"]
+            if job["status"] in ("succeeded", "failed"):
+                return job
+            time.sleep(0.05)
+        self.fail("job {} did not finish".format(job_id))
+
     def test_get_categories(self):
         """Tests the GET /categories API endpoint to gets all categories"""
         api = self.client.get('/categories')
@@ -68,6 +96,188 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(api.data)
         self.assertEqual(data, expected_response)
 
+    def test_get_categories_not_modified(self):
+        """ Tests the GET /categories API endpoint answers 304 when the client already has the current response """
+        api = self.client.get('/categories')
+        self.assertEqual(api.status_code, 200)
+        etag = api.headers["ETag"]
+
+        api = self.client.get('/categories', headers={'If-None-Match': etag})
+        self.assertEqual(api.status_code, 304)
+        self.assertEqual(api.headers["X-Cache"], "HIT")
+        self.assertEqual(api.data, b'')
+
+        # every app caches the responses of its own database, another app neither reads nor resets them
+        other_client = create_app({'DATABASE_URL': 'memory://response_cache_test'}).test_client()
+        api = other_client.get('/categories')
+        self.assertNotEqual(api.headers.get("X-Cache"), "HIT")
+        self.assertNotIn(b'Science', api.data)
+        self.assertEqual(self.client.get('/categories').headers["X-Cache"], "HIT")
+
+    def test_get_category_stats(self):
+        """ Tests the GET /categories/stats endpoint counts the questions of every category and difficulty, also after a write """
+        api = self.client.get('/categories/stats')
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], True)
+        questions = self.stored_questions()
+        self.assertEqual(data["total_questions"], len(questions))
+        for category in data["categories"]:
+            category_questions = [question for question in questions if question["category"] == category["id"]]
+            self.assertEqual(category["total_questions"], len(category_questions))
+            for difficulty, count in category["difficulties"].items():
+                self.assertEqual(count, len([question for question in category_questions if question["difficulty"] == int(difficulty)]))
+        geography = [category for category in data["categories"] if category["id"] == 3][0]
+
+        question = {"question": "Stats test: capital of Kenya?", "answer": "Nairobi", "category": 3, "difficulty": 5}
+        api = self.client.post('/questions', data=json.dumps(question), headers={'Content-Type': 'application/json'})
+        question_id = json.loads(api.data)["id"]
+        data = json.loads(self.client.get('/categories/stats').data)
+        updated_geography = [category for category in data["categories"] if category["id"] == 3][0]
+        self.assertEqual(updated_geography["total_questions"], geography["total_questions"] + 1)
+        self.assertEqual(updated_geography["difficulties"]["5"], geography["difficulties"].get("5", 0) + 1)
+        self.assertEqual(json.loads(self.client.get('/categories/3/questions').data)["total_questions"],
+                         geography["total_questions"] + 1)
+
+        # an edit moves the question between the counts without reloading them
+        history = [category for category in data["categories"] if category["id"] == 4][0]
+        loaded_at = self.app.extensions['category_stats'].loaded_at
+        self.client.patch('/questions', json={"questions": [{"id": question_id, "category": 4, "difficulty": 3}]})
+        data = json.loads(self.client.get('/categories/stats').data)
+        self.assertEqual([category for category in data["categories"] if category["id"] == 3][0], geography)
+        updated_history = [category for category in data["categories"] if category["id"] == 4][0]
+        self.assertEqual(updated_history["total_questions"], history["total_questions"] + 1)
+        self.assertEqual(updated_history["difficulties"]["3"], history["difficulties"].get("3", 0) + 1)
+        self.assertEqual(self.app.extensions['category_stats'].loaded_at, loaded_at)
+
+        self.client.delete('/questions/{}'.format(question_id))
+        data = json.loads(self.client.get('/categories/stats').data)
+        self.assertEqual([category for category in data["categories"] if category["id"] == 4][0], history)
+
+        # the writes of another app of the process only count in its own database
+        other_client = create_app({'DATABASE_URL': 'memory://category_stats_test'}).test_client()
+        api = other_client.post('/questions', json={"question": "Stats test: elsewhere?", "answer": "Yes", "category": None, "difficulty": 1})
+        self.assertEqual(api.status_code, 200)
+        self.assertEqual(json.loads(self.client.get('/categories/stats').data)["total_questions"], len(questions))
+        self.assertEqual(json.loads(other_client.get('/categories/stats').data)["total_questions"], 1)
+        other_client.delete('/questions/{}'.format(json.loads(api.data)["id"]))
+
+    def test_get_category_stats_fail(self):
+        """ Tests the GET /categories/stats endpoint does not accept other methods """
+        api = self.client.post('/categories/stats')
+        self.assertEqual(api.status_code, 405)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], False)
+
+    def test_cache_stats(self):
+        """ Tests the GET /stats/cache endpoint counts hits and misses of the response cache """
+        self.client.get('/categories')
+        self.client.get('/categories')
+        api = self.client.get('/stats/cache')
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["cache"]["hits"], 1)
+        self.assertEqual(data["cache"]["misses"], 1)
+
+    def test_cache_coalescing(self):
+        """ Tests concurrent identical requests share one response, and an expired one is served stale while it is refreshed """
+        barrier = threading.Barrier(20)
+        statuses = []
+
+        def get_category_questions():
+            client = self.app.test_client()
+            barrier.wait()
+            statuses.append(client.get('/categories/1/questions?page=1').headers["X-Cache"])
+        threads = [threading.Thread(target=get_category_questions) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses.count("MISS"), 1)
+        cache = json.loads(self.client.get('/stats/cache').data)["cache"]
+        self.assertEqual((cache["misses"], cache["hits"] + cache["coalesced"]), (1, 19))
+
+        client = create_app({'DATABASE_URL': self.database_path, 'RESPONSE_CACHE_TTL': 0.2}).test_client()
+        api = client.get('/categories')
+        self.assertEqual(api.headers["X-Cache"], "MISS")
+        time.sleep(0.25)
+        stale = client.get('/categories')
+        self.assertEqual((stale.headers["X-Cache"], stale.data), ("STALE", api.data))
+        # served stale until the background refresh is done
+        deadline = time.monotonic() + 5
+        while client.get('/categories').headers["X-Cache"] != "HIT":
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_cache_coalescing_fail(self):
+        """ Tests responses other than 200 are neither cached nor shared, and a stale listing is not served after a write """
+        for _ in range(2):
+            api = self.client.get('/categories/99/questions')
+            self.assertEqual(api.status_code, 404)
+            self.assertNotIn("X-Cache", api.headers)
+        self.assertEqual(json.loads(self.client.get('/stats/cache').data)["cache"]["entries"], 0)
+
+        client = create_app({'DATABASE_URL': self.database_path, 'RESPONSE_CACHE_TTL': 0}).test_client()
+        total_questions = json.loads(client.get('/questions').data)["total_questions"]
+        question = {"question": "Is it stale?", "answer": "No", "category": 1, "difficulty": 1}
+        question_id = json.loads(client.post('/questions', json=question).data)["id"]
+        api = client.get('/questions')
+        self.assertEqual(api.headers["X-Cache"], "MISS")
+        self.assertEqual(json.loads(api.data)["total_questions"], total_questions + 1)
+        client.delete('/questions/{}'.format(question_id))
+
+    def test_cache_invalidated_on_write(self):
+        """ Tests the cached GET /questions response is refreshed after a question is added and deleted """
+        total_questions = json.loads(self.client.get('/questions').data)["total_questions"]
+        question = {
+            "answer": "Canberra",
+            "category": 3,
+            "difficulty": 2,
+            "question": "What is the capital of Australia?"
+        }
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        question_id = json.loads(self.client.post('/questions', data=json.dumps(question), headers=headers).data)["id"]
+        self.assertEqual(json.loads(self.client.get('/questions').data)["total_questions"], total_questions + 1)
+
+        self.client.delete(f'/questions/{question_id}')
+        self.assertEqual(json.loads(self.client.get('/questions').data)["total_questions"], total_questions)
+
+    def test_pool_stats(self):
+        """ Tests the GET /stats/pool endpoint reports connection checkouts of the database pool """
+        api = self.client.get('/stats/pool')
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(sorted(data["pool"]), ["average_wait_ms", "checkouts", "max_wait_ms"])
+
+    def test_instrumentation(self):
+        """ Tests the Server-Timing header and the GET /metrics endpoint of an instrumented app """
+        app = create_app({"INSTRUMENTATION": True, "DATABASE_URL": self.database_path})
+        client = app.test_client()
+        api = client.get('/questions')
+        self.assertEqual(api.status_code, 200)
+        self.assertIn('db;dur=', api.headers["Server-Timing"])
+        self.assertIn('serialize;dur=', api.headers["Server-Timing"])
+
+        api = client.get('/metrics')
+        self.assertEqual(api.status_code, 200)
+        metrics = api.data.decode()
+        self.assertIn('trivia_request_duration_seconds_count{method="GET",route="/questions"} 1', metrics)
+        self.assertIn('trivia_db_queries_total{method="GET",route="/questions"}', metrics)
+
+        # the metrics of every app are its own, creating another app keeps them
+        other_client = create_app({"INSTRUMENTATION": True, "DATABASE_URL": self.database_path}).test_client()
+        self.assertIn('route="/questions"} 1', client.get('/metrics').data.decode())
+        self.assertNotIn('route="/questions"', other_client.get('/metrics').data.decode())
+
+    def test_metrics_fail(self):
+        """ Tests the GET /metrics endpoint is not served when instrumentation is off """
+        api = self.client.get('/metrics')
+        self.assertEqual(api.status_code, 404)
+
     def test_get_questions(self):
         """ Tests the GET /questions API endpoint which is expected to be paginated at 10 questions / page """
         expected_response = {
@@ -153,6 +363,45 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(api.data)
         self.assertEqual(data, expected_response)
 
+    def test_get_questions_by_ids(self):
+        """ Tests the GET /questions endpoint returns the requested ids in their order and leaves out missing ones """
+        api = self.client.get('/questions?ids=21,5,1000,9')
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], True)
+        self.assertEqual([question["id"] for question in data["questions"]], [21, 5, 9])
+        self.assertEqual(data["total_questions"], 3)
+
+    def test_get_questions_by_ids_fail(self):
+        """ Tests the GET /questions endpoint with invalid and unknown ids """
+        api = self.client.get('/questions?ids=1,two')
+        self.assertEqual(api.status_code, 422)
+        api = self.client.get('/questions?ids=1000,1001')
+        self.assertEqual(api.status_code, 404)
+        self.assertEqual(json.loads(api.data)["success"], False)
+
+    def test_get_questions_cursor(self):
+        """ Tests the GET /questions API endpoint when following the cursor of the first page """
+        first_page = json.loads(self.client.get('/questions').data)
+        self.assertEqual(len(first_page["questions"]), 10)
+        self.assertIn("next_cursor", first_page)
+
+        api = self.client.get(f'/questions?cursor={first_page["next_cursor"]}')
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["total_questions"], 19)
+        self.assertEqual(len(data["questions"]), 9)
+        self.assertGreater(data["questions"][0]["id"], first_page["questions"][-1]["id"])
+        self.assertNotIn("next_cursor", data)
+
+    def test_get_questions_cursor_fail(self):
+        """ Tests the GET /questions API endpoint when providing a malformed cursor """
+        api = self.client.get('/questions?cursor=not-a-cursor')
+        self.assertEqual(api.status_code, 422)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable data, please check your data")
+
     def test_add_question(self):
         """ Test the POST /questions endpoint which creates a new question """
         global new_question_id
@@ -172,6 +421,135 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(body["message"], "Added")
         new_question_id = body.get("id")
 
+    def test_idempotent_add_question(self):
+        """ Tests a POST /questions retried with the same Idempotency-Key adds the question once """
+        question = {"question": "Idempotency test: capital of Peru?", "answer": "Lima", "category": 3, "difficulty": 1}
+        headers = {"Idempotency-Key": "add-lima"}
+        api = self.client.post('/questions', json=question, headers=headers)
+        self.assertEqual(api.status_code, 200)
+        question_id = json.loads(api.data)["id"]
+
+        retry = self.client.post('/questions', json=question, headers=headers)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data, api.data)
+        self.assertEqual(len([stored for stored in self.stored_questions(3) if stored["answer"] == "Lima"]), 1)
+
+        api = self.client.post('/questions', json=dict(question, answer="Cusco"), headers=headers)
+        self.assertEqual(api.status_code, 422)
+        # the keys of an app are kept by its own store, whatever the apps created after it
+        create_app({'DATABASE_URL': self.database_path})
+        self.assertEqual(self.client.post('/questions', json=question, headers=headers).headers["Idempotent-Replayed"], "true")
+        self.client.delete(f'/questions/{question_id}')
+
+    def test_edit_questions(self):
+        """ Tests the PATCH /questions endpoint edits questions in one batch and refuses edits of outdated versions """
+        headers = {'Content-Type': 'application/json'}
+        question_ids = [json.loads(self.client.post('/questions', data=json.dumps(question), headers=headers).data)["id"]
+                        for question in ({"question": "Edit test: capital of Chile?", "answer": "Lima", "category": 3, "difficulty": 1},
+                                         {"question": "Edit test: capital of Peru?", "answer": "Santiago", "category": 3, "difficulty": 1})]
+        api = self.client.patch('/questions', json={"questions": [
+            {"id": question_ids[0], "version": 1, "answer": "Santiago", "difficulty": 2},
+            {"id": question_ids[1], "answer": "Lima", "category": 4}
+        ]})
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual([(question["answer"], question["version"]) for question in data["questions"]], [("Santiago", 2), ("Lima", 2)])
+        stored = json.loads(self.client.get('/questions?ids={},{}'.format(*question_ids)).data)["questions"]
+        self.assertEqual([(question["difficulty"], question["category"]) for question in stored], [(2, 3), (1, 4)])
+
+        api = self.client.patch('/questions', json={"questions": [
+            {"id": question_ids[1], "version": 2, "difficulty": 5},
+            {"id": question_ids[0], "version": 1, "answer": "Valparaiso"}
+        ]})
+        self.assertEqual(api.status_code, 409)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], False)
+        self.assertEqual([(question["id"], question["answer"], question["version"]) for question in data["questions"]],
+                         [(question_ids[0], "Santiago", 2)])
+        self.assertEqual(json.loads(self.client.get(f'/questions?ids={question_ids[1]}').data)["questions"][0]["difficulty"], 1)
+        for question_id in question_ids:
+            self.client.delete(f'/questions/{question_id}')
+
+    def test_edit_questions_fail(self):
+        """ Tests the PATCH /questions endpoint with an unknown question and invalid edits """
+        api = self.client.patch('/questions', json={"questions": [{"id": 2000, "answer": "Nobody"}]})
+        self.assertEqual(api.status_code, 404)
+        for edits in ([], [{"id": 5}], [{"id": 5, "category": 99}], [{"id": 5, "answer": ""}],
+                      [{"id": 5, "answer": "Maya"}, {"id": 5, "difficulty": 3}], [{"id": 5, "difficulty": 6}],
+                      [{"id": 5, "answer": "Maya"}, {"id": 9, "difficulty": 2 ** 40}]):
+            api = self.client.patch('/questions', json={"questions": edits})
+            self.assertEqual(api.status_code, 422)
+            self.assertEqual(json.loads(api.data)["success"], False)
+        # a refused batch changes none of its questions
+        question = json.loads(self.client.get('/questions?ids=5').data)["questions"][0]
+        self.assertEqual((question["answer"], question["version"]), ("Maya Angelou", 1))
+
+    def test_bulk_add_questions(self):
+        """ Tests the POST /questions/bulk endpoint with NDJSON and CSV bodies containing a rejected line """
+        ndjson = '\n'.join([
+            json.dumps({"question": "Bulk test: largest planet?", "answer": "Jupiter", "category": 1, "difficulty": 1}),
+            json.dumps({"question": "Bulk test: missing answer?", "category": 1, "difficulty": 1}),
+            json.dumps({"question": "Bulk test: smallest planet?", "answer": "Mercury", "category": 1, "difficulty": 2})
+        ])
+        api = self.client.post('/questions/bulk', data=ndjson, headers={'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["total_rejected"], 1)
+        self.assertEqual(data["rejected"], [{"line": 2, "error": "missing field 'answer'"}])
+
+        csv_body = 'question,answer,category,difficulty\nBulk test: red planet?,Mars,1,1\nBulk test: ringed planet?,Saturn,99,1\n'
+        api = self.client.post('/questions/bulk', data=csv_body, headers={'Content-Type': 'text/csv'})
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual(data["rejected"], [{"line": 3, "error": "unknown category 99"}])
+
+        for question in self.stored_questions():
+            if question["question"].startswith('Bulk test:'):
+                self.client.delete('/questions/{}'.format(question["id"]))
+
+    def test_bulk_add_questions_fail(self):
+        """ Tests the POST /questions/bulk endpoint with an unsupported content type, and rejects invalid UTF-8 and out of range values """
+        api = self.client.post('/questions/bulk', data='<questions/>', headers={'Content-Type': 'application/xml'})
+        self.assertEqual(api.status_code, 422)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], False)
+
+        ndjson = b'\n'.join([
+            b'{"question": "Bulk test: \xff?", "answer": "Nothing", "category": 1, "difficulty": 1}',
+            b'{"question": "Bulk test: overflow?", "answer": "Nothing", "category": 1, "difficulty": 1e400}',
+            b'{"question": "Bulk test: too hard?", "answer": "Nothing", "category": 1, "difficulty": 6}'
+        ])
+        # a third bulk request would be rate limited
+        client = create_app({'DATABASE_URL': self.database_path, 'RATE_LIMITING': False}).test_client()
+        api = client.post('/questions/bulk', data=ndjson, headers={'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["inserted"], 0)
+        self.assertEqual(data["rejected"], [{"line": 1, "error": "invalid UTF-8"},
+                                            {"line": 2, "error": "category and difficulty must be integers"},
+                                            {"line": 3, "error": "difficulty must be between 1 and 5"}])
+        csv_body = b'question,answer,category,difficulty\nBulk test: \xff?,Nothing,1,1\n'
+        api = client.post('/questions/bulk', data=csv_body, headers={'Content-Type': 'text/csv'})
+        self.assertEqual(json.loads(api.data)["rejected"], [{"line": 2, "error": "invalid UTF-8"}])
+
+    def test_export_questions(self):
+        """ Tests the GET /questions/export endpoint streams every question as one JSON object per line """
+        api = self.client.get('/questions/export')
+        self.assertEqual(api.status_code, 200)
+        self.assertEqual(api.mimetype, 'application/x-ndjson')
+        questions = [json.loads(line) for line in api.data.decode().splitlines()]
+        self.assertEqual(len(questions), 19)
+        self.assertEqual(questions[0], {
+            "answer": "Apollo 13",
+            "category": 5,
+            "difficulty": 4,
+            "id": 2,
+            "question": "What movie earned Tom Hanks his third straight Oscar nomination, in 1996?"
+        })
+
     def test_delete_question(self):
         """ Tests the DELETE /questions/<question_id> endpoint which deletes a specific question """
         global new_question_id
@@ -200,6 +578,14 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Unprocessable data, please check your data")
 
+        # refused by the memory storage and PostgreSQL, while SQLite stores any 64 bit integer
+        stored_questions = self.stored_questions()
+        api = self.client.post('/questions', json=dict(question, answer="Defense of the Ancients", difficulty=2 ** 40))
+        self.assertIn(api.status_code, (200, 422))
+        if api.status_code == 200:
+            self.client.delete('/questions/{}'.format(json.loads(api.data)["id"]))
+        self.assertEqual(self.stored_questions(), stored_questions)
+
     def test_delete_question_fail(self):
         """ Tests the DELETE /questions/question_id endpoint by providing a non-existent question ID to delete"""
         api = self.client.delete(f'/questions/2000')
@@ -259,11 +645,12 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_questions_by_category_fail(self):
         """ Tests the GET /categories/category_id/questions/ endpoint with non-existent category ID"""
-        api = self.client.get('/categories/1000/questions')
-        self.assertEqual(api.status_code, 404)
-        data = json.loads(api.data)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Resource you are trying to modify is not found")
+        for category_id in (1000, 0):
+            api = self.client.get('/categories/{}/questions'.format(category_id))
+            self.assertEqual(api.status_code, 404)
+            data = json.loads(api.data)
+            self.assertEqual(data["success"], False)
+            self.assertEqual(data["message"], "Resource you are trying to modify is not found")
 
     def test_search_questions(self):
         """ Tests the POST /questions/search endpoint for looking up questions by the search term """
@@ -292,19 +679,86 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(api.data)
         self.assertEqual(data, expected_response)
 
-    def test_search_questions_fail(self):
-        """ Tests the POST /questions/search endpoint with a search term that doesn't return anything """
-        search_term = {
-            "searchTerm": "hola"
+    def test_search_questions_prefix(self):
+        """ Tests the POST /questions/search endpoint matches the beginning of words and requires every word """
+        headers = {
+            'Content-Type': 'application/json'
         }
+        api = self.client.post('/questions/search', data=json.dumps({"searchTerm": "soccer world"}), headers=headers)
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["total_questions"], 2)
+        self.assertEqual(sorted(question["id"] for question in data["questions"]), [10, 11])
+
+        api = self.client.post('/questions/search', data=json.dumps({"searchTerm": "penicil"}), headers=headers)
+        self.assertEqual(api.status_code, 200)
+        self.assertEqual(json.loads(api.data)["questions"][0]["id"], 21)
+
+    def test_search_questions_fail(self):
+        """ Tests the POST /questions/search endpoint with search terms that don't return anything, also without any word """
         headers = {
             'Content-Type': 'application/json'
         }
-        api = self.client.post('/questions/search', data=json.dumps(search_term), headers=headers)
-        self.assertEqual(api.status_code, 404)
+        for term in ("hola", "!!!", " - "):
+            api = self.client.post('/questions/search', data=json.dumps({"searchTerm": term}), headers=headers)
+            self.assertEqual(api.status_code, 404)
+            data = json.loads(api.data)
+            self.assertEqual(data["success"], False)
+            self.assertEqual(data["message"], "Resource you are trying to modify is not found")
+
+    def test_rate_limits(self):
+        """ Tests a client over the search rate limit gets 429 responses while other clients are served """
+        app = create_app({"RATE_LIMITS": {"search": (0.01, 2)}, "DATABASE_URL": self.database_path})
+        client = app.test_client()
+        for _ in range(2):
+            api = client.post('/questions/search', json={"searchTerm": "title"})
+            self.assertEqual(api.status_code, 200)
+
+        api = client.post('/questions/search', json={"searchTerm": "title"})
+        self.assertEqual(api.status_code, 429)
+        self.assertEqual(api.headers["Retry-After"], "100")
         data = json.loads(api.data)
         self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Resource you are trying to modify is not found")
+        self.assertEqual(data["message"], "Too many requests, please try again later")
+
+        api = client.post('/questions/search', json={"searchTerm": "title"}, environ_base={"REMOTE_ADDR": "10.0.0.2"})
+        self.assertEqual(api.status_code, 200)
+
+        # the limits of an app are its own, whatever the apps created after it
+        create_app({"RATE_LIMITING": False, "DATABASE_URL": self.database_path})
+        self.assertEqual(client.post('/questions/search', json={"searchTerm": "title"}).status_code, 429)
+        self.assertEqual(self.client.post('/questions/search', json={"searchTerm": "title"}).status_code, 200)
+
+    def test_concurrency_limits_fail(self):
+        """ Tests a bulk import is refused without waiting when every slot is taken """
+        app = create_app({"CONCURRENCY_LIMITS": {"bulk": (0, 0)}, "DATABASE_URL": self.database_path})
+        api = app.test_client().post('/questions/bulk', data=b'', content_type='application/x-ndjson')
+        self.assertEqual(api.status_code, 429)
+        self.assertEqual(json.loads(api.data)["success"], False)
+
+    def test_streamed_compressed_questions(self):
+        """ Tests a streamed page of questions gets the same body as a whole one, compressed with gzip when accepted """
+        app = create_app({"JSON_STREAM_MIN_ITEMS": 1, "COMPRESSION_MIN_SIZE": 0, "DATABASE_URL": self.database_path})
+        api = app.test_client().get('/questions?per_page=15', headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(api.status_code, 200)
+        self.assertTrue(api.is_streamed)
+        self.assertEqual(api.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", api.headers["Vary"])
+
+        whole_app = create_app({"JSON_STREAMING": False, "COMPRESSION": False, "DATABASE_URL": self.database_path})
+        whole = whole_app.test_client().get('/questions?per_page=15', headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", whole.headers)
+        self.assertEqual(gzip.decompress(api.data), whole.data)
+        self.assertEqual(len(json.loads(whole.data)["questions"]), 15)
+        # the settings of an app do not change the ones of the apps created before it
+        api = app.test_client().get('/questions?per_page=15', headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(api.headers["Content-Encoding"], "gzip")
+
+    def test_questions_per_page_fail(self):
+        """ Tests pages of more than MAX_QUESTIONS_PER_PAGE questions are refused """
+        api = self.client.get('/questions?per_page=1001')
+        self.assertEqual(api.status_code, 422)
+        self.assertEqual(json.loads(api.data)["success"], False)
 
     def test_quizzes(self):
         """
@@ -324,6 +778,360 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client.post('/quizzes', data=json.dumps(data), headers=headers)
         self.assertEqual(res.status_code, 200)
 
+    def test_quizzes_no_repeat(self):
+        """
+        Tests the POST /quizzes endpoint returns the only question of the category that was not asked yet
+        and an empty response once every question was asked
+        """
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        data = {
+            "previous_questions": [2, 4],
+            "quiz_category": {
+                "type": "Entertainment",
+                "id": "5"
+            }
+        }
+        res = self.client.post('/quizzes', data=json.dumps(data), headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)["question"]["id"], 6)
+
+        data["previous_questions"] = [2, 4, 6]
+        res = self.client.post('/quizzes', data=json.dumps(data), headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), {})
+
+    def play_round(self, category_id):
+        """Plays a whole quiz of the category on POST /quizzes and returns the asked question ids in order"""
+        data = {"previous_questions": [], "quiz_category": {"id": category_id}}
+        while True:
+            question = json.loads(self.client.post('/quizzes', json=data).data).get("question")
+            if question is None:
+                return data["previous_questions"]
+            data["previous_questions"].append(question["id"])
+
+    def test_quizzes_shuffle_index(self):
+        """ Tests POST /quizzes follows the shuffle index after the last asked question, which writes update without a reload """
+        asked_ids = self.play_round(0)
+        self.assertEqual(sorted(asked_ids), [question["id"] for question in self.stored_questions()])
+        first_id = asked_ids[0]
+        next_ids = [json.loads(self.client.post('/quizzes', json={"previous_questions": [first_id], "quiz_category": {"id": 0}}).data)["question"]["id"]
+                    for _ in range(3)]
+        self.assertEqual(len(set(next_ids)), 1)
+        api = self.client.post('/quizzes', json={"previous_questions": [first_id, next_ids[0]], "quiz_category": {"id": 0}})
+        third_id = json.loads(api.data)["question"]["id"]
+        api = self.client.post('/quizzes/batch', json={"previous_questions": [first_id], "quiz_category": {"id": 0}, "count": 2})
+        self.assertEqual(sorted(question["id"] for question in json.loads(api.data)["questions"]), sorted([next_ids[0], third_id]))
+
+        loaded_at = self.app.extensions['question_index'].loaded_at
+        question = {"question": "Which rank is it?", "answer": "A random one", "category": 1, "difficulty": 2}
+        question_id = json.loads(self.client.post('/questions', json=question).data)["id"]
+        self.assertIn(question_id, self.play_round(1))
+        self.client.patch('/questions', json={"questions": [{"id": question_id, "category": 2, "difficulty": 4}]})
+        buckets = self.app.extensions['question_index'].buckets
+        self.assertEqual([question_id in buckets.get(key, ()) for key in ((1, 2), (None, 2), (2, 4), (None, 4))],
+                         [False, False, True, True])
+        self.assertNotIn(question_id, self.play_round(1))
+        self.assertIn(question_id, self.play_round(2))
+        self.client.delete('/questions/{}'.format(question_id))
+        self.assertEqual(sorted(self.play_round(2)), [question["id"] for question in self.stored_questions(2)])
+        self.assertEqual(self.app.extensions['question_index'].loaded_at, loaded_at)
+
+    def test_quizzes_shuffle_index_fail(self):
+        """ Tests POST /quizzes with invalid previous questions, and a last question that is not in the category or not known """
+        api = self.client.post('/quizzes', json={"previous_questions": [2, "last"], "quiz_category": {"id": 5}})
+        self.assertEqual(api.status_code, 422)
+        self.assertEqual(json.loads(api.data)["success"], False)
+        for previous_questions in ([2, 4, 1000], [4, 20]):
+            api = self.client.post('/quizzes', json={"previous_questions": previous_questions, "quiz_category": {"id": 5}})
+            self.assertNotIn(json.loads(api.data)["question"]["id"], previous_questions)
+        api = self.client.post('/quizzes', json={"previous_questions": [6, 2, 4], "quiz_category": {"id": 5}})
+        self.assertEqual(json.loads(api.data), {})
+
+    def test_quizzes_deleted_by_other_app(self):
+        """ Tests POST /quizzes and /quizzes/batch skip a question of the index deleted through another app, and drop it from the index """
+        other_client = create_app({'DATABASE_URL': self.database_path}).test_client()
+        for path in ('/quizzes', '/quizzes/batch'):
+            question = {"question": "Which app deleted it?", "answer": "The other one", "category": 5, "difficulty": 3}
+            question_id = json.loads(self.client.post('/questions', json=question).data)["id"]
+            with self.app.app_context():
+                self.assertIn(question_id, self.app.extensions['question_index'].ids(5))
+            self.assertEqual(other_client.delete('/questions/{}'.format(question_id)).status_code, 200)
+
+            api = self.client.post(path, json={"previous_questions": [2, 4, 6], "quiz_category": {"id": 5}})
+            self.assertEqual(api.status_code, 200)
+            self.assertEqual(json.loads(api.data).get("questions", []), [])
+            index = self.app.extensions['question_index']
+            self.assertNotIn(question_id, index.ids(5))
+            self.assertNotIn(question_id, index.ids(0))
+            self.assertFalse(any(question_id in ids for ids in index.buckets.values()))
+
+    def test_quizzes_adaptive(self):
+        """
+        Tests the adaptive POST /quizzes endpoint favours easy questions for a low score and hard ones for a high score,
+        and still asks every question of the category once
+        """
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        data = {
+            "previous_questions": [1000, 1001],
+            "quiz_category": {"id": 0},
+            "adaptive": True
+        }
+        difficulties = {}
+        for score in [0, 2]:
+            data["score"] = score
+            difficulties[score] = []
+            for _ in range(40):
+                res = self.client.post('/quizzes', data=json.dumps(data), headers=headers)
+                self.assertEqual(res.status_code, 200)
+                difficulties[score].append(json.loads(res.data)["question"]["difficulty"])
+        self.assertGreater(len([difficulty for difficulty in difficulties[0] if difficulty <= 2]), 25)
+        self.assertGreater(sum(difficulties[2]), sum(difficulties[0]))
+
+        data = {"previous_questions": [], "quiz_category": {"id": 2}, "adaptive": True, "score": 0}
+        while True:
+            res = self.client.post('/quizzes', data=json.dumps(data), headers=headers)
+            question = json.loads(res.data).get("question")
+            if question is None:
+                break
+            self.assertNotIn(question["id"], data["previous_questions"])
+            data["previous_questions"].append(question["id"])
+            data["score"] += 1
+        self.assertEqual(len(data["previous_questions"]), len(self.stored_questions(2)))
+
+    def test_quizzes_adaptive_fail(self):
+        """ Tests the adaptive POST /quizzes endpoint rejects a missing score or a score above the asked questions """
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        data = {"previous_questions": [2], "quiz_category": {"id": 0}, "adaptive": True}
+        for score in [None, 2, -1]:
+            if score is not None:
+                data["score"] = score
+            res = self.client.post('/quizzes', data=json.dumps(data), headers=headers)
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(json.loads(res.data)["success"], False)
+
+    def test_quizzes_batch(self):
+        """ Tests the POST /quizzes/batch endpoint returns several unasked questions of the category at once """
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        data = {
+            "previous_questions": [2],
+            "quiz_category": {"type": "Entertainment", "id": 5},
+            "count": 5
+        }
+        res = self.client.post('/quizzes/batch', data=json.dumps(data), headers=headers)
+        self.assertEqual(res.status_code, 200)
+        body = json.loads(res.data)
+        self.assertEqual(body["success"], True)
+        self.assertEqual(sorted(question["id"] for question in body["questions"]), [4, 6])
+
+        data = {"previous_questions": [], "quiz_category": {"id": 0}}
+        res = self.client.post('/quizzes/batch', data=json.dumps(data), headers=headers)
+        question_ids = [question["id"] for question in json.loads(res.data)["questions"]]
+        self.assertEqual(len(question_ids), 10)
+        self.assertEqual(len(set(question_ids)), 10)
+
+    def test_quizzes_batch_fail(self):
+        """ Tests the POST /quizzes/batch endpoint rejects a missing category and counts out of range """
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        for data in [{"previous_questions": []},
+                     {"previous_questions": [], "quiz_category": {"id": 1}, "count": 0},
+                     {"previous_questions": [], "quiz_category": {"id": 1}, "count": 1000}]:
+            res = self.client.post('/quizzes/batch', data=json.dumps(data), headers=headers)
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(json.loads(res.data)["success"], False)
+
+    def test_quiz_session(self):
+        """
+        Tests the POST /quizzes/sessions and GET /quizzes/sessions/<session_id>/next endpoints
+        which serve every question of the category once and then a null question
+        """
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        data = {
+            "quiz_category": {
+                "type": "Entertainment",
+                "id": 5
+            }
+        }
+        api = self.client.post('/quizzes/sessions', data=json.dumps(data), headers=headers)
+        self.assertEqual(api.status_code, 200)
+        session = json.loads(api.data)
+        self.assertEqual(session["success"], True)
+        self.assertEqual(session["total_questions"], 3)
+
+        asked_ids = []
+        for _ in range(3):
+            api = self.client.get(f'/quizzes/sessions/{session["session_id"]}/next')
+            self.assertEqual(api.status_code, 200)
+            asked_ids.append(json.loads(api.data)["question"]["id"])
+        self.assertEqual(sorted(asked_ids), [2, 4, 6])
+
+        api = self.client.get(f'/quizzes/sessions/{session["session_id"]}/next')
+        self.assertEqual(api.status_code, 200)
+        self.assertEqual(json.loads(api.data)["question"], None)
+
+        # every session has an order of its own, not a rotation of a shared one
+        orders = []
+        for _ in range(2):
+            session = json.loads(self.client.post('/quizzes/sessions', json={"quiz_category": {"id": 0}}).data)
+            orders.append([json.loads(self.client.get(f'/quizzes/sessions/{session["session_id"]}/next').data)["question"]["id"]
+                           for _ in range(session["total_questions"])])
+        self.assertEqual(sorted(orders[0]), sorted(orders[1]))
+        start = orders[1].index(orders[0][0])
+        self.assertNotEqual(orders[1][start:] + orders[1][:start], orders[0])
+
+    def test_quiz_session_fail(self):
+        """ Tests the GET /quizzes/sessions/<session_id>/next endpoint with a non-existent session """
+        api = self.client.get('/quizzes/sessions/unknown/next')
+        self.assertEqual(api.status_code, 404)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Resource you are trying to modify is not found")
+
+    def test_leaderboard(self):
+        """ Tests the results of POST /quizzes/results rank players by their best score on GET /leaderboard, also once written """
+        other_app = create_app({'DATABASE_URL': 'memory://leaderboard_test'})
+        for player, category_id, score in (("ada", 1, 3), ("grace", 1, 5), ("ada", 1, 4), ("linus", 0, 2), ("ada", 1, 1)):
+            api = self.client.post('/quizzes/results', json={
+                "player": player, "quiz_category": {"type": "Science", "id": category_id}, "score": score, "questions": 5})
+            self.assertEqual(api.status_code, 202)
+            self.assertEqual(json.loads(api.data)["success"], True)
+
+        api = self.client.get('/leaderboard')
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["category"], None)
+        self.assertEqual([(entry["rank"], entry["player"], entry["score"]) for entry in data["leaderboard"]],
+                         [(1, "grace", 5), (2, "ada", 4), (3, "linus", 2)])
+        data = json.loads(self.client.get('/leaderboard?category=1&limit=1').data)
+        self.assertEqual([(entry["player"], entry["score"], entry["questions"]) for entry in data["leaderboard"]], [("grace", 5, 5)])
+
+        # the buffered results are written to the database of the app that received them, and read back by a new app
+        self.app.extensions['leaderboard'].flush()
+        client = create_app({'DATABASE_URL': self.database_path}).test_client()
+        data = json.loads(client.get('/leaderboard?category=1').data)
+        self.assertEqual([(entry["player"], entry["score"]) for entry in data["leaderboard"]], [("grace", 5), ("ada", 4)])
+        with other_app.app_context():
+            self.assertEqual(other_app.extensions['storage'].leaderboard_entries(10), {})
+
+    def test_leaderboard_fail(self):
+        """ Tests POST /quizzes/results and GET /leaderboard with invalid results, limits and categories """
+        for result in ({"quiz_category": {"id": 1}, "score": 1, "questions": 5},
+                       {"player": "ada", "quiz_category": {"id": 1}, "score": 6, "questions": 5},
+                       {"player": " ", "quiz_category": {"id": 1}, "score": 1, "questions": 5}):
+            api = self.client.post('/quizzes/results', json=result)
+            self.assertEqual(api.status_code, 422)
+        api = self.client.post('/quizzes/results', json={"player": "ada", "quiz_category": {"id": 99}, "score": 1, "questions": 5})
+        self.assertEqual(api.status_code, 404)
+        self.assertEqual(self.client.get('/leaderboard?category=99').status_code, 404)
+        api = self.client.get('/leaderboard?limit=0')
+        self.assertEqual(api.status_code, 422)
+        self.assertEqual(json.loads(api.data)["success"], False)
+
+    def test_jobs(self):
+        """ Tests POST /jobs runs a bulk delete and the maintenance tasks in the background, with their status on GET /jobs/<id> """
+        question = {"question": "Which job is queued?", "answer": "This one", "category": 1, "difficulty": 1}
+        question_id = json.loads(self.client.post('/questions', json=question).data)["id"]
+        api = self.client.post('/jobs', json={"task": "delete_questions", "arguments": {"ids": [question_id]}})
+        self.assertEqual(api.status_code, 202)
+        job = json.loads(api.data)["job"]
+        self.assertTrue(api.headers["Location"].endswith("/jobs/{}".format(job["id"])))
+        self.assertEqual((job["task"], job["arguments"]), ("delete_questions", {"ids": [question_id]}))
+
+        job = self.finished_job(self.client, job["id"])
+        self.assertEqual((job["status"], job["result"], job["attempts"]), ("succeeded", {"deleted": 1}, 1))
+        self.assertEqual(self.client.get('/questions?ids={}'.format(question_id)).status_code, 404)
+
+        # the reloads run in every process sharing the queue, such as the one of this other app
+        other_app = create_app({'DATABASE_URL': self.database_path, 'JOBS_PATH': self.jobs_path})
+        other_jobs = other_app.extensions['jobs']
+        with other_app.app_context():
+            total_questions = other_app.extensions['category_stats'].total()
+            text_search = current_storage().supports_text_search()
+            self.assertEqual(other_app.extensions['search_index'].search(["zanzibar"]), [])
+        self.assertEqual(other_jobs.sync(), [])
+        question = {"question": "Which ocean is Zanzibar in?", "answer": "Indian", "category": 3, "difficulty": 2}
+        question_id = json.loads(self.client.post('/questions', json=question).data)["id"]
+        for task in ("reindex_search", "refresh_category_stats"):
+            job_id = json.loads(self.client.post('/jobs', json={"task": task}).data)["job"]["id"]
+            job = self.finished_job(self.client, job_id)
+            self.assertEqual(job["status"], "succeeded")
+            self.assertEqual(set(job["result"]), {"generation"})
+        self.assertEqual(sorted(other_jobs.sync()), ["refresh_category_stats", "reindex_search"])
+        self.assertEqual(other_jobs.sync(), [])
+        with other_app.app_context():
+            self.assertEqual(other_app.extensions['category_stats'].total(), total_questions + 1)
+            if not text_search:
+                self.assertEqual(other_app.extensions['search_index'].search(["zanzibar"]), [question_id])
+        self.client.delete('/questions/{}'.format(question_id))
+
+        with self.app.app_context():
+            geography = [question_id for question_id, in current_storage().scan_questions(('id',), 3)]
+        self.assertEqual(geography, [question["id"] for question in self.stored_questions(3)])
+        job_id = json.loads(self.client.post('/jobs', json={"task": "delete_questions", "arguments": {"category": 99}}).data)["job"]["id"]
+        self.assertEqual(self.finished_job(self.client, job_id)["result"], {"deleted": 0})
+
+    def test_jobs_fail(self):
+        """ Tests POST /jobs with unknown tasks and arguments, unknown jobs, and a failing job retried until its last attempt """
+        for body in ({"task": "drop_database"}, {"task": "reindex_search", "arguments": {"all": True}},
+                     {"task": "delete_questions", "arguments": [1]}, {"arguments": {}},
+                     {"task": "delete_questions", "arguments": {"ids": "24"}},
+                     {"task": "delete_questions", "arguments": {"ids": 5}},
+                     {"task": "delete_questions", "arguments": {"ids": [2, "4"]}},
+                     {"task": "delete_questions", "arguments": {"ids": [True]}},
+                     {"task": "delete_questions", "arguments": {"category": "3"}}):
+            api = self.client.post('/jobs', json=body)
+            self.assertEqual(api.status_code, 422)
+            self.assertEqual(json.loads(api.data)["success"], False)
+        self.assertEqual(self.client.get('/jobs/0').status_code, 404)
+
+        self.assertEqual(len(self.stored_questions(5)), 3)
+
+        def always_fails():
+            raise ValueError('failed on purpose')
+
+        task('always_fails')(always_fails)
+        try:
+            client = create_app({'DATABASE_URL': self.database_path, 'JOBS_BACKEND': 'memory', 'JOBS_RETRY_SECONDS': 0}).test_client()
+            api = client.post('/jobs', json={"task": "always_fails"})
+            job = self.finished_job(client, json.loads(api.data)["job"]["id"])
+        finally:
+            TASKS.pop('always_fails')
+        self.assertEqual((job["status"], job["attempts"], job["result"]), ("failed", 3, None))
+        self.assertIn("ValueError", job["error"])
+
+    def test_warmup_command(self):
+        """ Tests `flask warmup` checks the database and loads the read caches of the app with their timings """
+        result = self.app.test_cli_runner().invoke(args=['warmup'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        timings = json.loads(result.output)
+        self.assertTrue({"database", "question_index", "category_stats", "leaderboard", "categories"} <= set(timings))
+        self.assertEqual(json.loads(self.client.get('/ready').data)["warm"], True)
+
+    def test_warmup_command_fail(self):
+        """ Tests creating the app touches neither the database nor the job queue, and `flask warmup` fails without a database """
+        directory = tempfile.mkdtemp()
+        try:
+            app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(directory, 'missing', 'trivia.db'),
+                              'JOBS_PATH': os.path.join(directory, 'jobs.db')})
+            self.assertEqual(os.listdir(directory), [])
+            result = app.test_cli_runner().invoke(args=['warmup'])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("the database cannot be reached", result.output)
+            self.assertEqual(app.test_client().get('/ready').status_code, 503)
+        finally:
+            shutil.rmtree(directory)
+
     def test_fail_quizzes(self):
         """
         Test the POST /quizzes endpoint that plays the trivia game by sending incomplete quiz data
@@ -341,6 +1149,106 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Unprocessable data, please check your data")
 
+    def test_fast_json_matches_jsonify(self):
+        """ Tests the column rows and the fast encoder give the same bytes as jsonify of the stored questions """
+        api = self.client.get('/categories/2/questions')
+        self.assertEqual(api.status_code, 200)
+        questions = self.stored_questions(2)
+        with self.app.app_context():
+            expected = jsonify({
+                'success': True,
+                'questions': questions[:10],
+                'total_questions': len(questions),
+                'current_category': 2
+            })
+        self.assertEqual(api.data, expected.get_data())
+        self.assertEqual(api.mimetype, expected.mimetype)
+
+    def test_readiness(self):
+        """ Tests the GET /ready endpoint answers once the database can be reached """
+        api = self.client.get('/ready')
+        self.assertEqual(api.status_code, 200)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["ready"], True)
+
+    def test_readiness_fail(self):
+        """ Tests the GET /ready endpoint answers 503 when the database cannot be reached """
+        app = create_app({'DATABASE_URL': 'sqlite:////nonexistent/trivia.db'})
+        api = app.test_client().get('/ready')
+        self.assertEqual(api.status_code, 503)
+        data = json.loads(api.data)
+        self.assertEqual(data["success"], False)
+
+    def test_asgi_app(self):
+        """ Tests the ASGI app returns the same responses as the WSGI app """
+        asgi_app = AsgiApp(self.app, threads=4)
+        for path in ['/categories', '/questions?page=2', '/categories/1/questions', '/categories/1000/questions']:
+            status, headers, body = asyncio.run(asgi_request(asgi_app, 'GET', path))
+            api = self.client.get(path)
+            self.assertEqual(status, api.status_code)
+            self.assertEqual(json.loads(body), json.loads(api.data))
+
+        search_term = json.dumps({"searchTerm": "penicillin"}).encode()
+        status, headers, body = asyncio.run(asgi_request(
+            asgi_app, 'POST', '/questions/search', search_term, [('Content-Type', 'application/json')]))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["questions"][0]["id"], 21)
+
+
+
+def read_trivia_dump(path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')):
+    """Reads the categories and questions of the trivia.psql dump"""
+    tables = {}
+    rows = None
+    with open(path, encoding='utf-8') as dump:
+        for line in dump:
+            line = line.rstrip('\n')
+            if line.startswith('COPY '):
+                table = line.split()[1].split('.')[-1]
+                columns = line[line.index('(') + 1:line.index(')')].split(', ')
+                rows = tables[table] = []
+            elif line == '\\.':
+                rows = None
+            elif rows is not None:
+                values = [None if value == '\\N' else value for value in line.split('\t')]
+                rows.append(dict(zip(columns, values)))
+    for column in ('id', 'category', 'difficulty'):
+        for row in tables['questions']:
+            row[column] = int(row[column]) if row[column] is not None else None
+    for row in tables['categories']:
+        row['id'] = int(row['id'])
+    return tables['categories'], tables['questions']
+
+
+def seed_storage(database_path):
+    """Replaces the data of a storage with the trivia.psql dump"""
+    app = create_app({'DATABASE_URL': database_path})
+    with app.app_context():
+        app.extensions['storage'].load(*read_trivia_dump())
+
+
+class SQLiteTriviaTestCase(TriviaTestCase):
+    """Runs the trivia test case on a SQLite database seeded from trivia.psql"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.database_path = 'sqlite:///' + os.path.join(cls.directory, 'trivia_test.db')
+        seed_storage(cls.database_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+
+class MemoryTriviaTestCase(TriviaTestCase):
+    """Runs the trivia test case on the in-memory storage seeded from trivia.psql"""
+    database_path = 'memory://trivia_test'
+
+    @classmethod
+    def setUpClass(cls):
+        seed_storage(cls.database_path)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,12 @@
+'''
+WSGI entry point of the trivia API for prefork servers, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`.
+The app is created and its read caches are loaded once, before the workers are forked.
+With LAZY_INIT the workers load them in the background once they started instead
+'''
+from flaskr import create_app
+from flaskr.prefork import warm_up
+from models import get_setting
+
+app = create_app()
+if not get_setting(app.config, 'LAZY_INIT', False, bool):
+    warm_up(app)
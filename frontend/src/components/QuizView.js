@@ -11,12 +11,16 @@ class QuizView extends Component {
     this.state = {
         quizCategory: null,
         previousQuestions: [], 
+        upcomingQuestions: [],
         showAnswer: false,
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
         guess: '',
-        forceEnd: false
+        forceEnd: false,
+        player: '',
+        scoreSaved: false,
+        leaderboard: []
     }
   }
 
@@ -41,47 +45,54 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.getRound)
   }
 
   handleChange = (event) => {
     this.setState({[event.target.name]: event.target.value})
   }
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions]
-    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
+  getRound = () => {
     $.ajax({
-      url: 'http://localhost:5000/quizzes', //TODO: update request URL
+      url: 'http://localhost:5000/quizzes/batch', //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        previous_questions: [],
+        quiz_category: this.state.quizCategory,
+        count: questionsPerPlay
       }),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true
-        })
+        this.setState({ upcomingQuestions: result.questions }, this.getNextQuestion)
         return;
       },
       error: (error) => {
-        alert('Unable to load question. Please try your request again')
+        alert('Unable to load questions. Please try your request again')
         return;
       }
     })
   }
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions]
+    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
+    const [nextQuestion, ...upcomingQuestions] = this.state.upcomingQuestions
+
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      upcomingQuestions: upcomingQuestions,
+      currentQuestion: nextQuestion || {},
+      guess: '',
+      forceEnd: nextQuestion ? false : true
+    })
+  }
+
   submitGuess = (event) => {
     event.preventDefault();
     const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
@@ -92,15 +103,62 @@ class QuizView extends Component {
     })
   }
 
+  saveScore = (event) => {
+    event.preventDefault();
+    $.ajax({
+      url: 'http://localhost:5000/quizzes/results', //TODO: update request URL
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        player: this.state.player,
+        quiz_category: this.state.quizCategory,
+        score: this.state.numCorrect,
+        questions: this.state.previousQuestions.length
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ scoreSaved: true }, this.getLeaderboard)
+        return;
+      },
+      error: (error) => {
+        alert('Unable to save your score. Please try your request again')
+        return;
+      }
+    })
+  }
+
+  getLeaderboard = () => {
+    $.ajax({
+      url: `http://localhost:5000/leaderboard?category=${this.state.quizCategory.id}`, //TODO: update request URL
+      type: "GET",
+      success: (result) => {
+        this.setState({ leaderboard: result.leaderboard })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to load the leaderboard. Please try your request again')
+        return;
+      }
+    })
+  }
+
   restartGame = () => {
     this.setState({
       quizCategory: null,
       previousQuestions: [], 
+      upcomingQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
-      forceEnd: false
+      forceEnd: false,
+      player: '',
+      scoreSaved: false,
+      leaderboard: []
     })
   }
 
@@ -130,6 +188,20 @@ class QuizView extends Component {
     return(
       <div className="quiz-play-holder">
         <div className="final-header"> Your Final Score is {this.state.numCorrect}</div>
+        {this.state.scoreSaved
+          ? (
+            <ol className="leaderboard">
+              {this.state.leaderboard.map(entry => (
+                <li key={entry.player}>{entry.player}: {entry.score} / {entry.questions}</li>
+              ))}
+            </ol>
+          )
+          : (
+            <form onSubmit={this.saveScore}>
+              <input type="text" name="player" placeholder="Your name" maxLength="64" onChange={this.handleChange}/>
+              <input className="save-score button" type="submit" value="Save Score" />
+            </form>
+          )}
         <div className="play-again button" onClick={this.restartGame}> Play Again? </div>
       </div>
     )